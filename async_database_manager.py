@@ -0,0 +1,189 @@
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+import logging
+from database_config import db_config
+from db_metrics import TimedAsyncConnection, query_metrics, status_rowcount
+
+try:
+    import asyncpg
+except ImportError:  # asyncpg 为可选依赖，仅异步接口需要
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+_PLACEHOLDER_RE = re.compile(r"%%|%s")
+
+@lru_cache(maxsize=512)
+def to_asyncpg_query(query: str) -> str:
+    """将 psycopg2 风格的 %s 占位符转换为 asyncpg 的 $1, $2 ..."""
+    counter = 0
+
+    def replace(match):
+        nonlocal counter
+        if match.group(0) == '%%':
+            return '%'
+        counter += 1
+        return f"${counter}"
+
+    return _PLACEHOLDER_RE.sub(replace, query)
+
+# PostgreSQL 协议单条语句最多 32767 个绑定参数
+MAX_BIND_PARAMS = 32767
+BATCH_INSERT_PAGE_SIZE = 1000
+
+@lru_cache(maxsize=128)
+def to_asyncpg_values_query(query: str, width: int, rows: int) -> str:
+    """将 execute_values 风格的语句（单个 %s 表示 VALUES 列表）展开为 rows 行、每行 width 个参数的 asyncpg 语句"""
+    markers = [match for match in _PLACEHOLDER_RE.finditer(query) if match.group(0) == '%s']
+    if len(markers) != 1:
+        raise ValueError("批量插入语句必须有且只有一个 %s 表示 VALUES 列表")
+    start, end = markers[0].span()
+    values = ", ".join(
+        "(" + ", ".join(f"${i * width + j + 1}" for j in range(width)) + ")"
+        for i in range(rows)
+    )
+    return to_asyncpg_query(query[:start]) + values + to_asyncpg_query(query[end:])
+
+class AsyncDatabaseManager:
+    """异步数据库管理器，基于 asyncpg 连接池，接口与 DatabaseManager 保持一致"""
+
+    def __init__(self):
+        self.config = db_config
+        self._pool = None
+        self._pool_lock: Optional[asyncio.Lock] = None
+        self.metrics = query_metrics
+
+    async def create_pool(self):
+        """创建异步连接池"""
+        if self._pool is not None:
+            return self._pool
+        if asyncpg is None:
+            raise RuntimeError("异步数据库接口需要安装 asyncpg: pip install asyncpg")
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self._pool is None:
+                params = self.config.get_connection_params()
+                try:
+                    self._pool = await asyncpg.create_pool(
+                        host=params['host'],
+                        port=int(params['port']),
+                        database=params['database'],
+                        user=params['user'],
+                        password=params['password'] or None,
+                        ssl=params['sslmode'],
+                        min_size=self.config.pool_min_size,
+                        max_size=self.config.pool_max_size,
+                    )
+                    logger.info("异步数据库连接池创建成功")
+                except Exception as e:
+                    logger.error(f"创建异步数据库连接池失败: {e}")
+                    raise
+        return self._pool
+
+    async def close_pool(self):
+        """关闭异步连接池"""
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+            logger.info("异步数据库连接池已关闭")
+
+    @asynccontextmanager
+    async def get_connection(self):
+        """获取数据库连接的异步上下文管理器；启用统计时返回计时代理，连接上的每条语句和取连接等待都计入 metrics"""
+        pool = await self.create_pool()
+        try:
+            started = time.perf_counter()
+            async with pool.acquire() as conn:
+                if not self.metrics.enabled:
+                    yield conn
+                    return
+                self.metrics.observe_pool_wait(time.perf_counter() - started)
+                yield TimedAsyncConnection(conn, self.metrics)
+        except Exception as e:
+            logger.error(f"数据库操作失败: {e}")
+            raise
+
+    @asynccontextmanager
+    async def transaction(self):
+        """在单个事务中执行多条语句，正常退出时提交，出现异常时回滚"""
+        async with self.get_connection() as conn:
+            async with conn.transaction():
+                yield conn
+
+    async def execute_query(self, query: str, params: Optional[Tuple] = None) -> List[Dict[str, Any]]:
+        """执行查询语句，返回结果列表"""
+        async with self.get_connection() as conn:
+            rows = await conn.fetch(to_asyncpg_query(query), *(params or ()))
+            return [dict(row) for row in rows]
+
+    async def execute_query_tuples(self, query: str, params: Optional[Tuple] = None) -> List[Any]:
+        """执行查询语句，直接返回 asyncpg Record 列表（按列顺序取值，不构建字典）"""
+        async with self.get_connection() as conn:
+            return await conn.fetch(to_asyncpg_query(query), *(params or ()))
+
+    async def execute_single_query(self, query: str, params: Optional[Tuple] = None) -> Optional[Dict[str, Any]]:
+        """执行查询语句，返回单条结果"""
+        async with self.get_connection() as conn:
+            row = await conn.fetchrow(to_asyncpg_query(query), *(params or ()))
+            return dict(row) if row else None
+
+    async def execute_update(self, query: str, params: Optional[Tuple] = None) -> int:
+        """执行更新语句，返回影响的行数"""
+        async with self.get_connection() as conn:
+            status = await conn.execute(to_asyncpg_query(query), *(params or ()))
+            return status_rowcount(status)
+
+    async def execute_insert(self, query: str, params: Optional[Tuple] = None) -> Any:
+        """执行插入语句，返回插入的ID或结果"""
+        async with self.get_connection() as conn:
+            return await conn.fetchval(to_asyncpg_query(query), *(params or ()))
+
+    async def execute_single_write(self, query: str, params: Optional[Tuple] = None) -> Optional[Dict[str, Any]]:
+        """执行带 RETURNING 的写入语句，返回单条结果（asyncpg 在事务外自动提交）"""
+        return await self.execute_single_query(query, params)
+
+    async def execute_batch_insert(self, query: str, params_list: List[Tuple]) -> None:
+        """批量插入数据，query 与 execute_values 相同，使用单个 %s 表示 VALUES 列表
+
+        按 BATCH_INSERT_PAGE_SIZE 行分批（每批参数不超过 MAX_BIND_PARAMS），全部批次在同一事务中执行。
+        """
+        if not params_list:
+            return
+        width = len(params_list[0])
+        page_size = max(min(BATCH_INSERT_PAGE_SIZE, MAX_BIND_PARAMS // width), 1)
+        async with self.get_connection() as conn:
+            async with conn.transaction():
+                for start in range(0, len(params_list), page_size):
+                    page = params_list[start:start + page_size]
+                    args = [value for params in page for value in params]
+                    await conn.execute(to_asyncpg_values_query(query, width, len(page)), *args)
+
+    async def execute_transaction(self, queries: List[Tuple[str, Optional[Tuple]]]) -> bool:
+        """执行事务，包含多个SQL语句"""
+        async with self.get_connection() as conn:
+            try:
+                async with conn.transaction():
+                    for query, params in queries:
+                        await conn.execute(to_asyncpg_query(query), *(params or ()))
+                return True
+            except Exception as e:
+                logger.error(f"事务执行失败: {e}")
+                return False
+
+    async def test_connection(self) -> bool:
+        """测试数据库连接"""
+        try:
+            async with self.get_connection() as conn:
+                await conn.fetchval("SELECT 1")
+                return True
+        except Exception as e:
+            logger.error(f"数据库连接测试失败: {e}")
+            return False
+
+# 全局异步数据库管理器实例
+async_db_manager = AsyncDatabaseManager()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+棋牌游戏系统压测工具
+在本地 PostgreSQL 上模拟完整的对局生命周期（注册、开局、加减分、结算）和排行榜/统计读取，
+按操作统计吞吐量和 p50/p95/p99 延迟，结果保存为 JSON，可与历史结果对比发现性能回退。
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_MIX = 'game=30,award=20,deduct=10,leaderboard=15,stats=15,rank=5,register=5'
+PERCENTILES = (50, 95, 99)
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """解析读写比例，如 game=30,award=20,leaderboard=50"""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in Workload.OPERATIONS:
+            raise argparse.ArgumentTypeError(f"未知操作 {name}，可选: {', '.join(Workload.OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("操作比例不能全为 0")
+    return mix
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩法分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+class Workload:
+    """一次压测：准备数据并按比例并发执行各类操作"""
+
+    # 对局由开局和结算两步组成，分别计时
+    OPERATIONS = ('game', 'award', 'deduct', 'leaderboard', 'stats', 'rank', 'register')
+
+    SEED_PLAYERS_SQL = "INSERT INTO players (username, created_at) VALUES %s ON CONFLICT (username) DO NOTHING"
+    PLAYER_IDS_SQL = "SELECT player_id FROM players WHERE username LIKE %s ORDER BY player_id LIMIT %s"
+    # 为没有总分记录的压测玩家发放初始积分，同时写入对应流水，保证总分与流水一致
+    SEED_SCORES_SQL = """
+        WITH seeded AS (
+            INSERT INTO scores (player_id, current_total, last_updated)
+            SELECT player_id, %s, NOW() FROM unnest(%s::bigint[]) AS t(player_id)
+            ON CONFLICT (player_id) DO NOTHING
+            RETURNING player_id, current_total
+        )
+        INSERT INTO score_transactions (player_id, points_change, current_total, event_time)
+        SELECT player_id, current_total, current_total, NOW() FROM seeded
+        """
+
+    def __init__(self, args: argparse.Namespace):
+        from services import game_service, player_service, score_service
+        from database_manager import db_manager
+        self.args = args
+        self.db_manager = db_manager
+        self.game_service = game_service
+        self.player_service = player_service
+        self.score_service = score_service
+        self.prefix = f"{args.prefix}_"
+        self.player_ids: List[int] = []
+        self._register_seq = 0
+        self._register_lock = threading.Lock()
+        self._run_id = f"{int(time.time())}_{os.getpid()}"
+
+    # ---------- 数据准备 ----------
+
+    def prepare(self) -> None:
+        """创建压测玩家、发放初始积分，并按需预置已结束的对局（扩大 games/game_participants 表）"""
+        args = self.args
+        began = time.monotonic()
+        rows = [(f"{self.prefix}{index:07d}", datetime.now()) for index in range(args.players)]
+        for start in range(0, len(rows), 5000):
+            self.db_manager.execute_batch_insert(self.SEED_PLAYERS_SQL, rows[start:start + 5000])
+        self.player_ids = [row['player_id'] for row in self.db_manager.execute_query(
+            self.PLAYER_IDS_SQL, (self.prefix.replace('_', r'\_') + '%', args.players))]
+        self.db_manager.execute_update(self.SEED_SCORES_SQL, (args.initial_score, self.player_ids))
+        print(f"✅ 压测玩家 {len(self.player_ids)} 名")
+
+        if args.seed_games:
+            with ThreadPoolExecutor(args.concurrency) as executor:
+                list(executor.map(lambda _: self._play_game(random.Random()), range(args.seed_games)))
+            print(f"✅ 预置对局 {args.seed_games} 局")
+        print(f"数据准备耗时 {time.monotonic() - began:.1f} 秒")
+
+    # ---------- 操作 ----------
+
+    def _play_game(self, rng: random.Random, timings: Optional[Dict[str, List[float]]] = None,
+                   failures: Optional[Dict[str, int]] = None) -> None:
+        players = rng.sample(self.player_ids, min(self.args.players_per_game, len(self.player_ids)))
+        game = self._timed('start_game', timings, failures, lambda: self.game_service.start_new_game(
+            rng.choice(('mahjong', 'poker', 'doudizhu')), players))
+        if not game:
+            return
+        # 零和结算：赢家拿走其他玩家输掉的分数
+        losses = [rng.randint(1, 20) for _ in players[1:]]
+        results = [(players[0], sum(losses))] + [(player_id, -loss) for player_id, loss in zip(players[1:], losses)]
+        self._timed('end_game', timings, failures,
+                    lambda: self.game_service.end_game_with_results(game.game_id, results))
+
+    @staticmethod
+    def _timed(name: str, timings: Optional[Dict[str, List[float]]], failures: Optional[Dict[str, int]],
+               call: Callable[[], Any]) -> Any:
+        started = time.perf_counter()
+        try:
+            result = call()
+        except Exception:
+            result = None
+        elapsed = time.perf_counter() - started
+        if timings is not None:
+            timings.setdefault(name, []).append(elapsed)
+            # 服务层失败时返回 False/None/空结果而不是抛出异常
+            if result is None or result is False:
+                failures[name] = failures.get(name, 0) + 1
+        return result
+
+    def _next_username(self) -> str:
+        with self._register_lock:
+            self._register_seq += 1
+            return f"{self.prefix}r{self._run_id}_{self._register_seq}"
+
+    def _operation(self, name: str, rng: random.Random, timings: Dict[str, List[float]],
+                   failures: Dict[str, int]) -> None:
+        player_id = rng.choice(self.player_ids)
+        if name == 'game':
+            self._play_game(rng, timings, failures)
+        elif name == 'award':
+            self._timed(name, timings, failures,
+                        lambda: self.score_service.award_points(player_id, rng.randint(1, 10), reason='benchmark'))
+        elif name == 'deduct':
+            self._timed(name, timings, failures,
+                        lambda: self.score_service.deduct_points(player_id, rng.randint(1, 10), reason='benchmark'))
+        elif name == 'leaderboard':
+            self._timed(name, timings, failures, lambda: self.player_service.get_leaderboard(self.args.leaderboard_size))
+        elif name == 'stats':
+            self._timed(name, timings, failures, lambda: self.player_service.get_player_stats(player_id) or None)
+        elif name == 'rank':
+            self._timed(name, timings, failures, lambda: self.player_service.get_player_rank(player_id))
+        elif name == 'register':
+            self._timed(name, timings, failures, lambda: self.player_service.register_player(self._next_username()))
+
+    # ---------- 执行 ----------
+
+    def _worker(self, seed: int, deadline: float, operations: Optional[int],
+                record_after: float) -> Tuple[Dict[str, List[float]], Dict[str, int]]:
+        rng = random.Random(seed)
+        names = list(self.args.mix)
+        weights = [self.args.mix[name] for name in names]
+        timings: Dict[str, List[float]] = {}
+        failures: Dict[str, int] = {}
+        warmup_timings: Dict[str, List[float]] = {}
+        warmup_failures: Dict[str, int] = {}
+        done = 0
+        while time.monotonic() < deadline and (operations is None or done < operations):
+            warm = time.monotonic() < record_after
+            name = rng.choices(names, weights)[0]
+            self._operation(name, rng, warmup_timings if warm else timings, warmup_failures if warm else failures)
+            if not warm:
+                done += 1
+        return timings, failures
+
+    def run(self) -> Dict[str, Any]:
+        args = self.args
+        per_worker = -(-args.operations // args.concurrency) if args.operations else None
+        started = time.monotonic()
+        record_after = started + args.warmup
+        deadline = record_after + args.duration if args.duration else float('inf')
+        self.db_manager.metrics.reset()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            futures = [executor.submit(self._worker, args.seed + index, deadline, per_worker, record_after)
+                       for index in range(args.concurrency)]
+            results = [future.result() for future in futures]
+        elapsed = time.monotonic() - record_after
+
+        timings: Dict[str, List[float]] = {}
+        failures: Dict[str, int] = {}
+        for worker_timings, worker_failures in results:
+            for name, values in worker_timings.items():
+                timings.setdefault(name, []).extend(values)
+            for name, count in worker_failures.items():
+                failures[name] = failures.get(name, 0) + count
+        return self._report(timings, failures, elapsed)
+
+    def _report(self, timings: Dict[str, List[float]], failures: Dict[str, int], elapsed: float) -> Dict[str, Any]:
+        operations = {}
+        for name in sorted(timings):
+            values = sorted(timings[name])
+            operations[name] = {
+                'count': len(values),
+                'failures': failures.get(name, 0),
+                'throughput': round(len(values) / elapsed, 2),
+                'mean_ms': round(sum(values) / len(values) * 1000, 3),
+                **{f"p{pct}_ms": round(percentile(values, pct) * 1000, 3) for pct in PERCENTILES},
+                'max_ms': round(values[-1] * 1000, 3),
+            }
+        total = sum(item['count'] for item in operations.values())
+        return {
+            'label': self.args.label,
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'config': {key: value for key, value in vars(self.args).items() if key not in ('command', 'output', 'func')},
+            'environment': self._environment(),
+            'elapsed_seconds': round(elapsed, 3),
+            'total': {'count': total, 'throughput': round(total / elapsed, 2),
+                      'failures': sum(item['failures'] for item in operations.values())},
+            'operations': operations,
+            'top_statements': self.db_manager.get_query_stats(top=10)['statements'],
+            'pool': self.db_manager.get_pool_stats(),
+        }
+
+    def _environment(self) -> Dict[str, Any]:
+        try:
+            server = self.db_manager.execute_single_query("SHOW server_version")['server_version']
+        except Exception:
+            server = None
+        return {'python': platform.python_version(), 'platform': platform.platform(), 'postgresql': server}
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n📊 压测结果（{report['elapsed_seconds']} 秒，总吞吐 {report['total']['throughput']} ops/s，"
+          f"失败 {report['total']['failures']}）")
+    print(f"{'操作':<12} {'次数':>8} {'失败':>6} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, item in report['operations'].items():
+        print(f"{name:<12} {item['count']:>8} {item['failures']:>6} {item['throughput']:>10} "
+              f"{item['p50_ms']:>9} {item['p95_ms']:>9} {item['p99_ms']:>9} {item['max_ms']:>9}")
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> int:
+    """对比两次结果：吞吐量下降或 p95/p99 上升超过 threshold% 视为回退，返回回退项数"""
+    regressions = 0
+    print(f"{'操作':<12} {'指标':<11} {'基线':>10} {'本次':>10} {'变化':>9}")
+    for name, item in current['operations'].items():
+        base = baseline['operations'].get(name)
+        if base is None:
+            continue
+        for metric, higher_is_better in (('throughput', True), ('p95_ms', False), ('p99_ms', False)):
+            old, new = base[metric], item[metric]
+            if not old:
+                continue
+            change = (new - old) / old * 100
+            regressed = (-change if higher_is_better else change) > threshold
+            regressions += regressed
+            mark = '❌' if regressed else '  '
+            print(f"{name:<12} {metric:<11} {old:>10} {new:>10} {change:>+8.1f}% {mark}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="棋牌游戏系统压测")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="执行压测")
+    run_parser.add_argument('--players', type=int, default=1000, help="压测玩家数（不足时自动创建）")
+    run_parser.add_argument('--seed-games', type=int, default=0, help="压测前预置的已结束对局数，用于扩大对局相关表")
+    run_parser.add_argument('--initial-score', type=int, default=10000, help="压测玩家的初始积分")
+    run_parser.add_argument('--players-per-game', type=int, default=4)
+    run_parser.add_argument('--leaderboard-size', type=int, default=10)
+    run_parser.add_argument('--concurrency', type=int, default=8, help="并发线程数")
+    run_parser.add_argument('--duration', type=float, default=30, help="计时阶段时长（秒），0 表示只按 --operations 结束")
+    run_parser.add_argument('--operations', type=int, help="计时阶段的总操作数（与 --duration 先到者为准）")
+    run_parser.add_argument('--warmup', type=float, default=3, help="预热时长（秒），不计入统计")
+    run_parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"操作比例，默认 {DEFAULT_MIX}")
+    run_parser.add_argument('--seed', type=int, default=42, help="随机种子")
+    run_parser.add_argument('--prefix', default='bench', help="压测玩家用户名前缀")
+    run_parser.add_argument('--label', default='', help="本次结果的标签（如分支名、提交号）")
+    run_parser.add_argument('--output', help="结果 JSON 文件路径")
+    run_parser.add_argument('--skip-prepare', action='store_true', help="跳过数据准备，直接使用已有压测玩家")
+
+    compare_parser = subparsers.add_parser('compare', help="对比两次压测结果")
+    compare_parser.add_argument('baseline', help="基线结果 JSON")
+    compare_parser.add_argument('current', help="本次结果 JSON")
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help="判定为回退的变化百分比")
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        print(f"\n{'❌ 发现 ' + str(regressions) + ' 项回退' if regressions else '✅ 未发现回退'}")
+        return 1 if regressions else 0
+
+    if not args.duration and not args.operations:
+        parser.error("--duration 为 0 时必须指定 --operations")
+    # 连接池配置在导入数据库模块时读取：并发压测需要线程安全的连接池，且连接数不少于并发数
+    os.environ.setdefault('DB_POOL_MODE', 'threaded')
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.concurrency + 2))
+
+    workload = Workload(args)
+    if args.skip_prepare:
+        workload.player_ids = [row['player_id'] for row in workload.db_manager.execute_query(
+            workload.PLAYER_IDS_SQL, (workload.prefix.replace('_', r'\_') + '%', args.players))]
+    else:
+        workload.prepare()
+    if not workload.player_ids:
+        print("❌ 没有可用的压测玩家")
+        return 1
+
+    report = workload.run()
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+        print(f"\n结果已保存到 {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+COPY 批量导入工具
+通过 COPY FROM STDIN 将 Python 可迭代对象或 CSV/文本/二进制文件批量导入 players、games、
+game_participants、score_transactions 等表；score_transactions 的行按 event_time 直接写入对应分区
+"""
+
+import argparse
+import bisect
+import csv
+import itertools
+import re
+import sys
+import time
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import psycopg2
+from psycopg2 import extensions, sql
+import logging
+from database_manager import db_manager
+
+logger = logging.getLogger(__name__)
+
+# 进度回调：(表名, 已导入行数, 已用秒数)
+ProgressCallback = Callable[[str, int, float], None]
+
+def _copy_value(value: Any) -> str:
+    """转换为 COPY 文本格式的字段值"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime, date)):
+        text = value.isoformat()
+    else:
+        text = str(value)
+    return (text.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+
+class _CopyStream:
+    """按需把行编码为 COPY 文本格式，供 copy_expert 分块读取，不在内存中拼出整批数据"""
+
+    def __init__(self, rows: Iterable[Sequence[Any]]):
+        self._lines = ('\t'.join(map(_copy_value, row)) + '\n' for row in rows)
+        self._buffer = b''
+        self.rows = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            encoded = line.encode('utf-8')
+            chunks.append(encoded)
+            length += len(encoded)
+            self.rows += 1
+        data = b''.join(chunks)
+        if size < 0:
+            self._buffer = b''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+class _ProgressFile:
+    """包装文件对象，统计已读取的字节数用于进度报告"""
+
+    def __init__(self, file, on_read: Callable[[int], None]):
+        self._file = file
+        self._on_read = on_read
+
+    def read(self, size: int = -1):
+        data = self._file.read(size)
+        self._on_read(len(data))
+        return data
+
+    def readline(self, size: int = -1):
+        data = self._file.readline(size)
+        self._on_read(len(data))
+        return data
+
+class BulkLoader:
+    """基于 COPY 的批量导入器
+
+    每批 batch_size 行一次 COPY、一次提交，内存占用与批大小有关，与总行数无关。
+    score_transactions 为分区表时，每批的行按 event_time 分组后直接 COPY 到各自的分区，
+    省去父表逐行路由；缺失的月分区按 create_partitions 自动创建。
+    """
+
+    # 各表默认导入列，与 ddl.sql 一致
+    TABLE_COLUMNS = {
+        'players': ('player_id', 'username', 'created_at'),
+        'games': ('game_id', 'game_type', 'start_time', 'end_time'),
+        'game_participants': ('game_id', 'player_id', 'initial_score', 'final_score', 'position'),
+        'score_transactions': ('transaction_id', 'player_id', 'game_id', 'points_change', 'current_total', 'event_time'),
+        'scores': ('player_id', 'current_total', 'last_updated'),
+    }
+    # 显式导入自增主键时，导入后需要同步序列
+    SERIAL_COLUMNS = {'players': 'player_id', 'games': 'game_id'}
+
+    PARTITIONS_SQL = """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = %s
+        """
+    IS_PARTITIONED_SQL = """
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = %s
+        """
+    SET_UTC_SQL = "SET LOCAL TIME ZONE 'UTC'"
+    CREATE_PARTITION_SQL = "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)"
+    SYNC_SEQUENCE_SQL = "SELECT setval(pg_get_serial_sequence(%s, %s), GREATEST(MAX({}), 1)) FROM {}"
+    _BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+    def __init__(self, batch_size: int = 50000, create_partitions: bool = True,
+                 progress_callback: Optional[ProgressCallback] = None):
+        self.batch_size = batch_size
+        self.create_partitions = create_partitions
+        self.progress_callback = progress_callback
+        self.db_manager = db_manager
+
+    def _report(self, table: str, rows: int, started: float) -> None:
+        elapsed = time.monotonic() - started
+        rate = rows / elapsed if elapsed > 0 else 0
+        logger.info(f"{table}: 已导入 {rows} 行，{rate:.0f} 行/秒")
+        if self.progress_callback:
+            self.progress_callback(table, rows, elapsed)
+
+    @staticmethod
+    def _copy_sql(table: str, columns: Sequence[str], options: str = '') -> sql.Composed:
+        return sql.SQL("COPY {} ({}) FROM STDIN{}").format(
+            sql.Identifier(table),
+            sql.SQL(', ').join(map(sql.Identifier, columns)),
+            sql.SQL(options),
+        )
+
+    def load_rows(self, table: str, rows: Iterable[Any], columns: Optional[Sequence[str]] = None) -> int:
+        """导入元组或字典序列（字典按列名取值），返回导入的行数"""
+        columns = tuple(columns or self.TABLE_COLUMNS[table])
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+        if isinstance(first, dict):
+            rows = (tuple(row.get(column) for column in columns) for row in itertools.chain([first], rows))
+        else:
+            rows = itertools.chain([first], rows)
+
+        started = time.monotonic()
+        total = 0
+        with self.db_manager.get_connection() as conn:
+            with conn.cursor() as cursor:
+                # 每批一个事务；不带时区的时间按 UTC 解释，与分区边界的比较保持一致
+                cursor.execute(self.SET_UTC_SQL)
+                router = self._partition_router(cursor, table, columns)
+                while True:
+                    batch = list(itertools.islice(rows, self.batch_size))
+                    if not batch:
+                        break
+                    cursor.execute(self.SET_UTC_SQL)
+                    groups = router(batch) if router else {table: batch}
+                    for target, group in groups.items():
+                        cursor.copy_expert(self._copy_sql(target, columns).as_string(conn), _CopyStream(group))
+                    conn.commit()
+                    total += len(batch)
+                    self._report(table, total, started)
+                self._sync_sequence(cursor, table, columns)
+                conn.commit()
+        return total
+
+    def load_file(self, table: str, path: str, file_format: str = 'csv', columns: Optional[Sequence[str]] = None,
+                  header: bool = True, delimiter: str = ',') -> int:
+        """导入 CSV、COPY 文本或 COPY 二进制文件
+
+        分区表的 CSV 文件会逐行解析后按分区分批导入；文本和二进制文件整体交给 PostgreSQL 路由。
+        返回导入的行数。
+        """
+        columns = tuple(columns or self.TABLE_COLUMNS[table])
+        if file_format == 'csv' and self._is_partitioned(table):
+            return self.load_rows(table, self._read_csv(path, header, delimiter), columns)
+
+        if file_format == 'csv':
+            options = f" WITH (FORMAT csv, HEADER {'true' if header else 'false'}, DELIMITER {extensions.QuotedString(delimiter).getquoted().decode()})"
+        elif file_format == 'binary':
+            options = " WITH (FORMAT binary)"
+        elif file_format == 'text':
+            options = ""
+        else:
+            raise ValueError("file_format 只能是 csv、text 或 binary")
+
+        started = time.monotonic()
+        progress = {'bytes': 0, 'reported': 0}
+
+        def on_read(size: int) -> None:
+            progress['bytes'] += size
+            if progress['bytes'] - progress['reported'] >= 64 * 1024 * 1024:
+                progress['reported'] = progress['bytes']
+                logger.info(f"{table}: 已读取 {progress['bytes'] // (1024 * 1024)} MB，"
+                            f"耗时 {time.monotonic() - started:.1f} 秒")
+
+        mode = 'rb' if file_format == 'binary' else 'r'
+        encoding = None if file_format == 'binary' else 'utf-8'
+        with open(path, mode, encoding=encoding) as f:
+            with self.db_manager.get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.copy_expert(self._copy_sql(table, columns, options).as_string(conn), _ProgressFile(f, on_read))
+                    rowcount = cursor.rowcount
+                    self._sync_sequence(cursor, table, columns)
+                conn.commit()
+        self._report(table, max(rowcount, 0), started)
+        return rowcount
+
+    @staticmethod
+    def _read_csv(path: str, header: bool, delimiter: str) -> Iterator[List[Optional[str]]]:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f, delimiter=delimiter)
+            if header:
+                next(reader, None)
+            for row in reader:
+                # 空字段按 NULL 处理，与 COPY CSV 对未加引号空字段的默认行为一致
+                yield [value if value != '' else None for value in row]
+
+    def _is_partitioned(self, table: str) -> bool:
+        return self.db_manager.execute_single_query(self.IS_PARTITIONED_SQL, (table,)) is not None
+
+    def _partition_router(self, cursor, table: str, columns: Sequence[str]):
+        """返回把一批行按目标分区分组的函数；非分区表或没有 event_time 列时返回 None"""
+        if table != 'score_transactions' or 'event_time' not in columns:
+            return None
+        cursor.execute(self.IS_PARTITIONED_SQL, (table,))
+        if cursor.fetchone() is None:
+            return None
+
+        time_index = columns.index('event_time')
+        ranges: List[Tuple[datetime, datetime, str]] = []
+        starts: List[datetime] = []
+
+        def refresh() -> None:
+            cursor.execute(self.PARTITIONS_SQL, (table,))
+            ranges.clear()
+            for name, bound in cursor.fetchall():
+                match = self._BOUND_RE.search(bound or '')
+                if match:
+                    ranges.append((_parse_time(match.group(1)), _parse_time(match.group(2)), name))
+            ranges.sort()
+            starts[:] = [r[0] for r in ranges]
+
+        def find(event_time: datetime) -> Optional[str]:
+            i = bisect.bisect_right(starts, event_time) - 1
+            if i >= 0 and event_time < ranges[i][1]:
+                return ranges[i][2]
+            return None
+
+        refresh()
+
+        def route(batch: List[Sequence[Any]]) -> Dict[str, List[Sequence[Any]]]:
+            groups: Dict[str, List[Sequence[Any]]] = {}
+            for row in batch:
+                event_time = _parse_time(row[time_index])
+                target = find(event_time) if event_time else None
+                if target is None and event_time and self.create_partitions:
+                    target = self._create_monthly_partition(cursor, table, event_time)
+                    if target:
+                        refresh()
+                # 无法确定分区的行交给父表路由（例如落入 DEFAULT 分区）
+                groups.setdefault(target or table, []).append(row)
+            return groups
+
+        return route
+
+    def _create_monthly_partition(self, cursor, table: str, event_time: datetime) -> Optional[str]:
+        """创建 event_time 所在月份的分区（命名与 create_monthly_partition() 一致），月份边界按 UTC 计算"""
+        start = event_time.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+        name = f"{table}_{start:%Y_%m}"
+        cursor.execute("SAVEPOINT create_partition")
+        try:
+            cursor.execute(sql.SQL(self.CREATE_PARTITION_SQL).format(sql.Identifier(name), sql.Identifier(table)),
+                           (start, end))
+            cursor.execute("RELEASE SAVEPOINT create_partition")
+            logger.info(f"已创建分区 {name}")
+            return name
+        except psycopg2.Error as e:
+            # 与已有分区重叠，或 DEFAULT 分区中已有该范围的数据
+            cursor.execute("ROLLBACK TO SAVEPOINT create_partition")
+            logger.warning(f"无法创建分区 {name}，改由父表路由: {e}")
+            return None
+
+    def _sync_sequence(self, cursor, table: str, columns: Sequence[str]) -> None:
+        column = self.SERIAL_COLUMNS.get(table)
+        if column and column in columns:
+            cursor.execute(
+                sql.SQL(self.SYNC_SEQUENCE_SQL).format(sql.Identifier(column), sql.Identifier(table)),
+                (table, column),
+            )
+
+def _parse_time(value: Any) -> Optional[datetime]:
+    """解析时间并统一转为 UTC（与 partition_manager 的分区边界一致），不带时区的按 UTC 处理"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+# 全局批量导入实例
+bulk_loader = BulkLoader()
+
+def main():
+    parser = argparse.ArgumentParser(description="COPY 批量导入")
+    parser.add_argument('table', choices=sorted(BulkLoader.TABLE_COLUMNS), help="目标表")
+    parser.add_argument('file', help="数据文件路径")
+    parser.add_argument('--format', dest='file_format', choices=('csv', 'text', 'binary'), default='csv')
+    parser.add_argument('--columns', help="逗号分隔的列名，默认使用该表的标准列")
+    parser.add_argument('--no-header', action='store_true', help="CSV 文件没有表头")
+    parser.add_argument('--delimiter', default=',', help="CSV 分隔符")
+    parser.add_argument('--batch-size', type=int, default=50000, help="分区表逐批导入时每批的行数")
+    parser.add_argument('--no-create-partitions', action='store_true', help="不自动创建缺失的月分区")
+    args = parser.parse_args()
+
+    loader = BulkLoader(batch_size=args.batch_size, create_partitions=not args.no_create_partitions)
+    columns = args.columns.split(',') if args.columns else None
+    try:
+        started = time.monotonic()
+        rows = loader.load_file(args.table, args.file, args.file_format, columns,
+                                header=not args.no_header, delimiter=args.delimiter)
+        print(f"✅ 导入完成: {rows} 行，耗时 {time.monotonic() - started:.1f} 秒")
+        return 0
+    except Exception as e:
+        print(f"❌ 导入失败: {e}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+from array import array
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import logging
+
+try:
+    import numpy
+except ImportError:  # numpy 为可选依赖，缺失时使用标准库 array
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('auto', 'numpy', 'array')
+
+# PostgreSQL 类型 OID（cursor.description 的 type_code）到列类型的映射，其余类型按 object 处理
+_KINDS = {
+    16: 'bool',
+    20: 'int', 21: 'int', 23: 'int', 26: 'int',
+    700: 'float', 701: 'float', 1700: 'float',
+    1114: 'timestamp', 1184: 'timestamp',
+    1082: 'date',
+}
+_ARRAY_TYPECODES = {'bool': 'b', 'int': 'q', 'float': 'd', 'timestamp': 'q', 'date': 'i'}
+_NUMPY_DTYPES = {'bool': 'bool', 'int': 'int64', 'float': 'float64', 'timestamp': 'datetime64[us]',
+                 'date': 'datetime64[D]'}
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_EPOCH_DATE = date(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+def resolve_backend(backend: str = 'auto') -> str:
+    if backend not in BACKENDS:
+        raise ValueError(f"backend 只能是 {BACKENDS}")
+    if backend == 'numpy' and numpy is None:
+        raise RuntimeError("numpy 未安装，请执行 pip install numpy 或使用 backend='array'")
+    if backend == 'auto':
+        return 'array' if numpy is None else 'numpy'
+    return backend
+
+def _to_numbers(values: Sequence[Any], kind: str) -> List[Any]:
+    """NULL 用 0 占位；时间戳转为距 1970-01-01 的微秒数（带时区的按 UTC），日期转为天数"""
+    if kind == 'timestamp':
+        sample = next((value for value in values if value is not None), None)
+        epoch = _EPOCH_UTC if sample is not None and sample.tzinfo is not None else _EPOCH
+        return [0 if value is None else (value - epoch) // _MICROSECOND for value in values]
+    if kind == 'date':
+        return [0 if value is None else (value - _EPOCH_DATE).days for value in values]
+    if kind == 'float':
+        return [0.0 if value is None else float(value) for value in values]
+    return [0 if value is None else value for value in values]
+
+def decode_column(values: Sequence[Any], type_code: Optional[int], backend: str):
+    """把一列值解码为紧凑数组，返回 (数组, NULL 掩码或 None)"""
+    kind = _KINDS.get(type_code, 'object')
+    has_nulls = None in values
+    mask = bytearray(value is None for value in values) if has_nulls else None
+    if backend == 'numpy':
+        if kind == 'object':
+            data = numpy.empty(len(values), dtype=object)
+            data[:] = values
+        elif kind in ('int', 'bool') and not has_nulls:
+            data = numpy.array(values, dtype=_NUMPY_DTYPES[kind])
+        else:
+            numbers = _to_numbers(values, kind)
+            data = numpy.array(numbers, dtype='int64' if kind in ('timestamp', 'date') else _NUMPY_DTYPES[kind])
+            if kind in ('timestamp', 'date'):
+                data = data.view(_NUMPY_DTYPES[kind])
+        if has_nulls:
+            nulls = numpy.frombuffer(mask, dtype=numpy.bool_)
+            return numpy.ma.MaskedArray(data, mask=nulls), nulls
+        return data, None
+    if kind == 'object':
+        return list(values), mask
+    if kind in ('int', 'bool') and not has_nulls:
+        return array(_ARRAY_TYPECODES[kind], values), None
+    return array(_ARRAY_TYPECODES[kind], _to_numbers(values, kind)), mask
+
+class ColumnarResult:
+    """按列存放的查询结果
+
+    numpy 后端：整数 int64、浮点/NUMERIC float64、布尔 bool、时间戳 datetime64[us]（带时区的转为 UTC）、
+    日期 datetime64[D]，其他类型为 object 数组；含 NULL 的列为 numpy.ma.MaskedArray，聚合时自动跳过 NULL。
+    array 后端：数值列为 array.array（时间戳为 UTC 微秒数、日期为天数），其他类型为 list；NULL 位置填 0。
+    两种后端的 nulls 都只包含有 NULL 的列，值为掩码（numpy 布尔数组或 bytearray，1 表示 NULL）。
+    """
+
+    __slots__ = ('columns', 'nulls', 'type_codes', 'backend', 'row_count')
+
+    def __init__(self, columns: Dict[str, Any], nulls: Dict[str, Any], type_codes: Dict[str, Optional[int]],
+                 backend: str, row_count: int):
+        self.columns = columns
+        self.nulls = nulls
+        self.type_codes = type_codes
+        self.backend = backend
+        self.row_count = row_count
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[tuple], description: Sequence[Any], backend: str = 'auto') -> 'ColumnarResult':
+        """由游标返回的元组行和 cursor.description 构建，不为每行生成字典"""
+        backend = resolve_backend(backend)
+        names = [desc[0] for desc in description]
+        type_codes = {desc[0]: desc[1] for desc in description}
+        transposed = list(zip(*rows)) if rows else [()] * len(names)
+        columns: Dict[str, Any] = {}
+        nulls: Dict[str, Any] = {}
+        for name, values in zip(names, transposed):
+            columns[name], mask = decode_column(values, type_codes[name], backend)
+            if mask is not None:
+                nulls[name] = mask
+        return cls(columns, nulls, type_codes, backend, len(rows))
+
+    @classmethod
+    def concat(cls, results: Iterable['ColumnarResult']) -> Optional['ColumnarResult']:
+        """合并流式读取得到的多个批次，没有批次时返回 None"""
+        results = list(results)
+        if not results:
+            return None
+        first = results[0]
+        if len(results) == 1:
+            return first
+        columns: Dict[str, Any] = {}
+        nulls: Dict[str, Any] = {}
+        for name in first.columns:
+            parts = [result.columns[name] for result in results]
+            if first.backend == 'numpy':
+                has_nulls = any(name in result.nulls for result in results)
+                columns[name] = (numpy.ma.concatenate if has_nulls else numpy.concatenate)(parts)
+                if has_nulls:
+                    nulls[name] = numpy.ma.getmaskarray(columns[name])
+            else:
+                merged = parts[0][:0]
+                for part in parts:
+                    merged += part
+                columns[name] = merged
+                if any(name in result.nulls for result in results):
+                    nulls[name] = bytearray().join(
+                        result.nulls.get(name) or bytearray(result.row_count) for result in results)
+        return cls(columns, nulls, first.type_codes, first.backend, sum(result.row_count for result in results))
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def __getitem__(self, name: str):
+        return self.columns[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def keys(self) -> List[str]:
+        return list(self.columns)
+
+    def is_null(self, name: str, index: int) -> bool:
+        mask = self.nulls.get(name)
+        return bool(mask[index]) if mask is not None else False
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """转回每行一个字典（调试或少量行时使用），NULL 还原为 None"""
+        names = list(self.columns)
+        rows = []
+        for index in range(self.row_count):
+            rows.append({name: None if self.is_null(name, index) else self._value(name, index) for name in names})
+        return rows
+
+    def _value(self, name: str, index: int) -> Any:
+        value = self.columns[name][index]
+        if self.backend == 'numpy':
+            return value.item() if hasattr(value, 'item') else value
+        kind = _KINDS.get(self.type_codes[name])
+        if kind == 'timestamp':
+            return _EPOCH + value * _MICROSECOND
+        if kind == 'date':
+            return _EPOCH_DATE + timedelta(days=value)
+        if kind == 'bool':
+            return bool(value)
+        return value
@@ -0,0 +1,233 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PoolTimeoutError(PoolError):
+    """等待连接超时"""
+
+class PoolQueueFullError(PoolError):
+    """等待队列已满"""
+
+class _PooledConnection:
+    """连接池中连接的元数据"""
+
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+class ThreadedHealthCheckedPool:
+    """线程安全、带健康检查的连接池
+
+    - 连接数达到上限时，调用方在有界等待队列中排队，超时后抛出 PoolTimeoutError
+    - 出借前检查连接状态，空闲超过 health_check_interval 秒的连接先执行 SELECT 1
+    - 连接存活超过 max_lifetime 或空闲超过 max_idle 秒后回收重建
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = 30.0,
+                 max_waiters: int = 100, max_lifetime: float = 3600.0,
+                 max_idle: float = 600.0, health_check_interval: float = 30.0,
+                 **conn_params):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("连接池大小配置无效")
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_waiters = max_waiters
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+        self._conn_params = conn_params
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle: Deque[_PooledConnection] = deque()
+        self._in_use: Dict[int, _PooledConnection] = {}
+        self._size = 0
+        self._waiters = 0
+        self._closed = False
+
+        # 统计信息
+        self._checkouts = 0
+        self._timeouts = 0
+        self._rejected = 0
+        self._recycled = 0
+        self._broken = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        for _ in range(minconn):
+            self._idle.append(self._connect())
+            self._size += 1
+
+    def _connect(self) -> _PooledConnection:
+        """建立新的物理连接"""
+        return _PooledConnection(psycopg2.connect(**self._conn_params))
+
+    def _close_quietly(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, item: _PooledConnection, now: float) -> bool:
+        if self.max_lifetime and now - item.created_at > self.max_lifetime:
+            return True
+        if self.max_idle and now - item.last_used > self.max_idle:
+            return True
+        return False
+
+    def _is_healthy(self, item: _PooledConnection, now: float) -> bool:
+        """检查连接是否可用"""
+        conn = item.conn
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if now - item.last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"连接健康检查失败: {e}")
+            return False
+
+    def getconn(self, timeout: Optional[float] = None):
+        """获取连接，连接池已满时排队等待"""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        while True:
+            item = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise PoolError("连接池已关闭")
+                if self._idle:
+                    item = self._idle.pop()
+                elif self._size < self.maxconn:
+                    self._size += 1
+                    create = True
+                else:
+                    if self._waiters >= self.max_waiters:
+                        self._rejected += 1
+                        raise PoolQueueFullError(f"等待连接的请求过多 ({self._waiters})")
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(f"等待数据库连接超时 ({timeout}s)")
+                    self._waiters += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiters -= 1
+                    continue
+
+            # 建连和健康检查都在锁外进行，避免阻塞其他线程
+            if create:
+                try:
+                    item = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                now = time.monotonic()
+                if self._is_expired(item, now):
+                    self._discard(item)
+                    continue
+                if not self._is_healthy(item, now):
+                    self._discard(item, broken=True)
+                    continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._in_use[id(item.conn)] = item
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return item.conn
+
+    def putconn(self, conn, close: bool = False) -> None:
+        """归还连接，损坏或过期的连接直接关闭"""
+        with self._cond:
+            item = self._in_use.pop(id(conn), None)
+        if item is None:
+            raise PoolError("尝试归还不属于连接池的连接")
+
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    close = True
+
+        now = time.monotonic()
+        if close or conn.closed or self._closed or (
+                self.max_lifetime and now - item.created_at > self.max_lifetime):
+            self._discard(item, broken=close or conn.closed)
+            return
+
+        item.last_used = now
+        with self._cond:
+            self._idle.append(item)
+            self._cond.notify()
+
+    def _discard(self, item: _PooledConnection, broken: bool = False) -> None:
+        """关闭连接并释放名额"""
+        self._close_quietly(item.conn)
+        with self._cond:
+            self._size -= 1
+            if broken:
+                self._broken += 1
+            else:
+                self._recycled += 1
+            self._cond.notify()
+
+    def closeall(self) -> None:
+        """关闭所有连接"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            in_use = list(self._in_use.values())
+            self._idle.clear()
+            self._in_use.clear()
+            self._size = 0
+            self._cond.notify_all()
+        for item in idle + in_use:
+            self._close_quietly(item.conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取连接池实时统计"""
+        with self._cond:
+            return {
+                'size': self._size,
+                'max_size': self.maxconn,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiters': self._waiters,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'rejected': self._rejected,
+                'recycled': self._recycled,
+                'broken': self._broken,
+                'avg_checkout_ms': round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0,
+                'max_checkout_ms': round(self._wait_max * 1000, 3),
+            }
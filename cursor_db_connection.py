@@ -4,13 +4,51 @@ Cursor 数据库连接工具
 在 Cursor 中直接连接数据库，实时执行 SQL 查询
 """
 
+import argparse
+import csv
+import time
+import unicodedata
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
 import os
 import sys
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import json
-from datetime import datetime
+from datetime import date, datetime
+from db_utils import is_read_only, stream_batches, stream_query
+from sql_script import ScriptRunner, SQLScriptError, format_report
+import query_bench
+
+EXPORT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl'}
+MAX_COLUMN_WIDTH = 40
+
+def _display_width(text: str) -> int:
+    """终端显示宽度：中文等全角字符占两列"""
+    return sum(2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1 for ch in text)
+
+def _fit(text: str, width: int) -> str:
+    """截断到 width 列（超出部分以 … 结尾）并补齐空格"""
+    if _display_width(text) > width:
+        kept, used = [], 0
+        for ch in text:
+            ch_width = _display_width(ch)
+            if used + ch_width > width - 1:
+                break
+            kept.append(ch)
+            used += ch_width
+        text = ''.join(kept) + '…'
+    return text + ' ' * (width - _display_width(text))
+
+def _cell(value: Any) -> str:
+    return str(value).replace('\r', '\\r').replace('\n', '\\n')
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return str(value)  # Decimal、UUID 等按文本输出，不丢精度
 
 class CursorDatabaseConnection:
     """Cursor 数据库连接类"""
@@ -19,6 +57,7 @@ class CursorDatabaseConnection:
         self.config_file = config_file
         self.connection = None
         self.cursor = None
+        self.page_size = 100
         self.load_config()
     
     def load_config(self):
@@ -68,6 +107,8 @@ class CursorDatabaseConnection:
             self.cursor.execute(sql)
             if self.cursor.description:  # 有返回结果的查询
                 results = self.cursor.fetchall()
+                if not is_read_only(sql):  # INSERT ... RETURNING、调用写函数的 SELECT 等
+                    self.connection.commit()
                 return [dict(row) for row in results]
             else:  # 无返回结果的查询（如 INSERT, UPDATE, DELETE）
                 self.connection.commit()
@@ -77,40 +118,178 @@ class CursorDatabaseConnection:
             self.connection.rollback()
             return None
     
-    def execute_file(self, file_path: str) -> bool:
-        """执行 SQL 文件"""
+    def stream_query(self, sql: str, batch_size: int = 1000, row_format: str = 'dict') -> Iterator[Any]:
+        """用服务端游标分批读取查询结果，大结果集不会一次性载入内存"""
+        idle = self._idle()
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                sql_content = f.read()
-            
-            # 分割多个 SQL 语句
-            statements = [stmt.strip() for stmt in sql_content.split(';') if stmt.strip()]
-            
-            success_count = 0
-            for i, statement in enumerate(statements, 1):
-                if statement.startswith('--'):  # 跳过注释
-                    continue
-                
-                print(f"\n📝 执行第 {i} 条语句:")
-                print(f"SQL: {statement[:100]}{'...' if len(statement) > 100 else ''}")
-                
-                result = self.execute_query(statement)
-                if result is not None:
-                    print(f"✅ 查询成功，返回 {len(result)} 条记录")
-                    if result:
-                        self.print_results(result[:5])  # 只显示前5条
-                        if len(result) > 5:
-                            print(f"... 还有 {len(result) - 5} 条记录")
-                else:
-                    print("✅ 执行成功")
-                    success_count += 1
-            
-            print(f"\n🎉 文件执行完成，成功执行 {success_count} 条语句")
-            return True
-            
+            yield from stream_query(self.connection, sql, batch_size=batch_size, row_format=row_format)
         except Exception as e:
+            print(f"❌ SQL 执行失败: {e}")
+        finally:
+            self._end_stream(idle)
+    
+    def _stream_rows(self, sql: str, batch_size: int) -> Iterator[Tuple[List[str], List[tuple]]]:
+        """服务端游标分批读取，产出 (列名, 本批元组行)；出错时抛出异常，结束或中途退出时关闭游标（见 _end_stream）"""
+        idle = self._idle()
+        try:
+            columns = None
+            for rows, description in stream_batches(self.connection, sql, batch_size=batch_size):
+                if columns is None:
+                    columns = [desc[0] for desc in description]
+                yield columns, rows
+        finally:
+            self._end_stream(idle)
+
+    def _idle(self) -> bool:
+        return self.connection.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+
+    def _end_stream(self, idle: bool) -> None:
+        """流式读取开始前连接空闲时回滚，结束只读事务；否则连接上有未提交的写入，保留事务由调用方决定提交或回滚"""
+        if idle:
+            self.connection.rollback()
+    
+    def print_stream(self, sql: str, page_size: Optional[int] = None, pause: bool = False) -> Optional[int]:
+        """流式分页显示查询结果
+        
+        列宽按第一页计算（单列最多 MAX_COLUMN_WIDTH 列，超出截断），取到第一页即开始输出，内存只与 page_size 有关；
+        pause 时每页后等待回车，输入 q 停止读取。返回已显示的行数，出错时返回 None。
+        """
+        page_size = page_size or self.page_size
+        started = time.perf_counter()
+        shown = 0
+        widths: Optional[List[int]] = None
+        pages = self._stream_rows(sql, page_size)
+        try:
+            for columns, rows in pages:
+                if widths is None:
+                    widths = [min(max([_display_width(column)] + [_display_width(_cell(row[i])) for row in rows]),
+                                  MAX_COLUMN_WIDTH) for i, column in enumerate(columns)]
+                    header = " | ".join(_fit(column, width) for column, width in zip(columns, widths))
+                    print(f"   {header}")
+                    print(f"   {'-' * _display_width(header)}")
+                for row in rows:
+                    print("   " + " | ".join(_fit(_cell(value), width) for value, width in zip(row, widths)))
+                shown += len(rows)
+                if pause and len(rows) == page_size:
+                    answer = input(f"-- 已显示 {shown} 条，回车继续，q 停止 -- ").strip().lower()
+                    if answer == 'q':
+                        print(f"⏹️ 已停止，显示了 {shown} 条记录")
+                        return shown
+        except (psycopg2.Error, KeyboardInterrupt) as e:
+            print(f"❌ SQL 执行失败: {e}" if isinstance(e, psycopg2.Error) else f"\n⏹️ 已中断，显示了 {shown} 条记录")
+            return None if isinstance(e, psycopg2.Error) else shown
+        finally:
+            pages.close()
+        if widths is None:
+            print("   无数据")
+        print(f"✅ 查询成功，共 {shown} 条记录 ({time.perf_counter() - started:.2f}s)")
+        return shown
+    
+    def export_query(self, sql: str, file_path: str, batch_size: int = 5000) -> Optional[int]:
+        """把查询结果流式导出为 CSV 或 JSONL（按扩展名判断），不在内存中保留整个结果集，返回导出的行数"""
+        fmt = EXPORT_FORMATS.get(os.path.splitext(file_path)[1].lower())
+        if fmt is None:
+            print(f"❌ 不支持的导出格式: {file_path}（支持 {', '.join(EXPORT_FORMATS)}）")
+            return None
+        started = time.perf_counter()
+        count = 0
+        try:
+            with open(file_path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f) if fmt == 'csv' else None
+                for columns, rows in self._stream_rows(sql, batch_size):
+                    if writer is not None:
+                        if count == 0:
+                            writer.writerow(columns)
+                        writer.writerows(['' if value is None else value for value in row] for row in rows)
+                    else:
+                        for row in rows:
+                            f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default))
+                            f.write('\n')
+                    count += len(rows)
+        except (OSError, psycopg2.Error) as e:
+            print(f"❌ 导出失败: {e}")
+            return None
+        elapsed = time.perf_counter() - started
+        print(f"✅ 已导出 {count} 条记录到 {file_path} ({elapsed:.2f}s, {count / elapsed if elapsed else 0:.0f} 行/秒)")
+        return count
+    
+    def run_sql(self, sql: str, pause: bool = False):
+        """执行一条 SQL：只读查询流式分页显示，其他语句按原方式执行并提交"""
+        if is_read_only(sql):
+            self.print_stream(sql, pause=pause)
+            return
+        result = self.execute_query(sql)
+        if result is not None:
+            print(f"✅ 查询成功，返回 {len(result)} 条记录")
+            if result:
+                self.print_results(result)
+        else:
+            print("✅ 执行成功")
+    
+    def execute_file(self, file_path: str, transaction: bool = True, batch_size: int = 500,
+                     show_results: bool = False, continue_on_error: bool = False) -> bool:
+        """执行 SQL 文件
+        
+        按 SQL 语法拆分语句（正确处理 $$ 函数体、字符串和注释，见 sql_script.py），
+        多条语句合并为一次往返发送；默认整个文件在一个事务中执行，出错时全部回滚。
+        show_results 时 SELECT 等语句单独执行并显示前 5 条结果；
+        continue_on_error 时（隐含不使用事务）跳过出错的语句继续执行。
+        """
+        transaction = transaction and not continue_on_error
+        try:
+            runner = ScriptRunner(self.connection, batch_size=batch_size, transaction=transaction,
+                                  fetch_results=show_results, continue_on_error=continue_on_error)
+            result = runner.run_file(file_path)
+        except (OSError, SQLScriptError, psycopg2.Error) as e:
             print(f"❌ 文件执行失败: {e}")
             return False
+        
+        if show_results:
+            for report in result['statements']:
+                if 'columns' not in report:
+                    continue
+                print(f"\n📝 第 {report['line']} 行: {report['sql']}")
+                print(f"✅ 查询成功，返回 {report['rowcount']} 条记录")
+                self.print_results(report['rows'])
+                if report['rowcount'] > len(report['rows']):
+                    print(f"... 还有 {report['rowcount'] - len(report['rows'])} 条记录")
+        
+        print()
+        for line in format_report(result):
+            print(line)
+        if not result['ok']:
+            if continue_on_error:
+                print(f"⚠️ 文件执行完成，成功执行 {result['executed']} 条语句，"
+                      f"{sum('error' in report for report in result['statements'])} 条失败")
+            else:
+                print("❌ 文件执行失败" + ("，事务已回滚" if transaction else ""))
+            return False
+        print(f"🎉 文件执行完成，成功执行 {result['executed']} 条语句")
+        return True
+    
+    def benchmark(self, sql: Optional[str] = None, file_path: Optional[str] = None, iterations: int = 20,
+                  concurrency: int = 1, warmup: int = 1, params: Optional[List[str]] = None,
+                  save: Optional[str] = None) -> bool:
+        """重复执行一条语句或一个 SQL 文件，报告 min/p50/p95/p99/max 延迟、每秒行数和最慢一次的执行计划
+        
+        每个并发线程使用独立连接，每次执行后回滚（见 query_bench.py）；save 时把结果保存为 JSON，便于改索引前后对比。
+        """
+        bench = query_bench.QueryBenchmark(lambda: psycopg2.connect(**self.config), iterations=iterations,
+                                           concurrency=concurrency, warmup=warmup, params=params or ())
+        print(f"⏱️ 压测 {file_path or sql}")
+        try:
+            result = bench.run_file(file_path) if file_path else bench.run(sql)
+        except (OSError, ValueError) as e:
+            print(f"❌ 压测失败: {e}")
+            return False
+        for line in query_bench.format_report(result):
+            print(line)
+        if save:
+            result.update(sql=sql, file=file_path, params=params or [], timestamp=datetime.now().isoformat())
+            with open(save, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"💾 结果已保存到 {save}")
+        return result['runs'] > 0 and not result['errors']
     
     def print_results(self, results: List[Dict[str, Any]]):
         """格式化打印查询结果"""
@@ -158,17 +337,32 @@ class CursorDatabaseConnection:
                 elif sql.lower() == 'schema':
                     self.show_schema()
                     continue
+                elif sql.lower().startswith('page '):
+                    self.page_size = max(int(sql.split()[1]), 1)
+                    print(f"✅ 每页显示 {self.page_size} 条")
+                    continue
+                elif sql.lower().startswith('bench '):
+                    parts = sql.split(None, 2)
+                    times, _, workers = parts[1].lower().partition('x') if len(parts) == 3 else ('', '', '')
+                    if not times.isdigit() or (workers and not workers.isdigit()):
+                        print("用法: bench <次数>[x<并发数>] <SQL 语句 或 @文件>")
+                    elif parts[2].startswith('@'):
+                        self.benchmark(file_path=parts[2][1:].strip(), iterations=int(times), concurrency=int(workers or 1))
+                    else:
+                        self.benchmark(parts[2], iterations=int(times), concurrency=int(workers or 1))
+                    continue
+                elif sql.lower().startswith('export '):
+                    parts = sql.split(None, 2)
+                    if len(parts) < 3:
+                        print("用法: export <文件.csv|文件.jsonl> <SELECT 语句>")
+                    else:
+                        self.export_query(parts[2].rstrip(';'), parts[1])
+                    continue
                 elif not sql:
                     continue
                 
-                # 执行 SQL
-                result = self.execute_query(sql)
-                if result is not None:
-                    print(f"✅ 查询成功，返回 {len(result)} 条记录")
-                    if result:
-                        self.print_results(result)
-                else:
-                    print("✅ 执行成功")
+                # 执行 SQL：查询语句边读边显示，每页暂停
+                self.run_sql(sql.rstrip(';'), pause=sys.stdin.isatty())
                     
             except KeyboardInterrupt:
                 print("\n👋 退出交互模式")
@@ -183,6 +377,11 @@ class CursorDatabaseConnection:
   help     - 显示此帮助信息
   tables   - 显示所有表
   schema   - 显示表结构
+  page N   - 查询结果每页显示 N 条（默认 100，回车翻页，q 停止）
+  export <文件.csv|文件.jsonl> <SELECT 语句>
+           - 把查询结果流式导出到文件
+  bench <次数>[x<并发数>] <SQL 语句 或 @文件>
+           - 重复执行并报告延迟分位数和执行计划，如 bench 100x4 SELECT ...
   quit     - 退出程序
 
 📝 SQL 示例:
@@ -231,11 +430,32 @@ class CursorDatabaseConnection:
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="Cursor 数据库连接工具")
+    parser.add_argument('sql', nargs='*', help="要执行的 SQL（不带参数时进入交互模式）")
+    parser.add_argument('--file', help="执行 SQL 文件")
+    parser.add_argument('--interactive', action='store_true', help="进入交互模式")
+    parser.add_argument('--no-transaction', action='store_true',
+                        help="文件不在单个事务中执行（每批自动提交，允许 VACUUM、CONCURRENTLY 等语句）")
+    parser.add_argument('--batch-size', type=int, default=500, help="每次往返发送的语句数")
+    parser.add_argument('--show-results', action='store_true', help="显示文件中查询语句的结果")
+    parser.add_argument('--continue-on-error', action='store_true',
+                        help="跳过出错的语句继续执行（隐含 --no-transaction）")
+    parser.add_argument('--export', metavar='FILE', help="把查询结果流式导出为 CSV 或 JSONL（按扩展名判断）")
+    parser.add_argument('--page-size', type=int, default=100, help="查询结果每次从服务端读取的行数")
+    parser.add_argument('--bench', type=int, metavar='N', help="压测模式：把 SQL 或 --file 重复执行 N 次并报告延迟分位数")
+    parser.add_argument('--concurrency', type=int, default=1, help="压测并发连接数")
+    parser.add_argument('--warmup', type=int, default=1, help="压测时每条连接的预热次数（不计入统计）")
+    parser.add_argument('--param', action='append', default=[], metavar='VALUE',
+                        help="压测语句中 $1、$2 ... 的值，按顺序重复指定，NULL 表示空值")
+    parser.add_argument('--save', metavar='FILE', help="把压测结果保存为 JSON")
+    args = parser.parse_args()
+    
     print("🎯 Cursor 数据库连接工具")
     print("=" * 50)
     
     # 创建连接实例
     db = CursorDatabaseConnection()
+    db.page_size = max(args.page_size, 1)
     
     # 连接数据库
     if not db.connect():
@@ -243,37 +463,38 @@ def main():
         print("   1. PostgreSQL 是否已启动")
         print("   2. 数据库配置是否正确")
         print("   3. 网络连接是否正常")
-        return
+        return 1
     
     try:
-        # 检查命令行参数
-        if len(sys.argv) > 1:
-            if sys.argv[1] == '--file' and len(sys.argv) > 2:
-                # 执行 SQL 文件
-                file_path = sys.argv[2]
-                if os.path.exists(file_path):
-                    db.execute_file(file_path)
-                else:
-                    print(f"❌ 文件不存在: {file_path}")
-            elif sys.argv[1] == '--interactive':
-                # 交互模式
-                db.interactive_mode()
-            else:
-                # 执行单条 SQL
-                sql = ' '.join(sys.argv[1:])
-                result = db.execute_query(sql)
-                if result is not None:
-                    print(f"✅ 查询成功，返回 {len(result)} 条记录")
-                    if result:
-                        db.print_results(result)
-                else:
-                    print("✅ 执行成功")
+        if args.bench:
+            if not args.file and not args.sql:
+                print("❌ 压测需要 SQL 语句或 --file")
+                return 1
+            ok = db.benchmark(' '.join(args.sql) or None, file_path=args.file, iterations=args.bench,
+                              concurrency=args.concurrency, warmup=args.warmup, params=args.param, save=args.save)
+            return 0 if ok else 1
+        if args.file:
+            # 执行 SQL 文件
+            if not os.path.exists(args.file):
+                print(f"❌ 文件不存在: {args.file}")
+                return 1
+            ok = db.execute_file(args.file, transaction=not args.no_transaction,
+                                 batch_size=args.batch_size, show_results=args.show_results,
+                                 continue_on_error=args.continue_on_error)
+            return 0 if ok else 1
+        if args.sql and not args.interactive:
+            # 执行单条 SQL
+            sql = ' '.join(args.sql).rstrip().rstrip(';')
+            if args.export:
+                return 0 if db.export_query(sql, args.export, batch_size=max(args.page_size, 1000)) is not None else 1
+            db.run_sql(sql)
         else:
             # 默认进入交互模式
             db.interactive_mode()
+        return 0
     
     finally:
         db.disconnect()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main())
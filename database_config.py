@@ -1,9 +1,12 @@
 import os
-from typing import Optional
+import threading
+from typing import Any, Dict, List, Optional, Union
 import psycopg2
+from psycopg2.extensions import parse_dsn
 from psycopg2.pool import SimpleConnectionPool
 from psycopg2.extras import RealDictCursor
 import logging
+from connection_pool import ThreadedHealthCheckedPool
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -26,46 +29,154 @@ class DatabaseConfig:
         # 连接池配置
         self.pool_min_size = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
         self.pool_max_size = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+        # simple: psycopg2 SimpleConnectionPool（单线程）；threaded: 线程安全、带排队和健康检查的连接池
+        self.pool_mode = os.getenv('DB_POOL_MODE', 'simple')
+        self.pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+        self.pool_max_waiters = int(os.getenv('DB_POOL_MAX_WAITERS', '100'))
+        self.pool_max_lifetime = float(os.getenv('DB_POOL_MAX_LIFETIME', '3600'))
+        self.pool_max_idle = float(os.getenv('DB_POOL_MAX_IDLE', '600'))
+        self.pool_health_check_interval = float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))
         
-        # 连接池实例
-        self._pool: Optional[SimpleConnectionPool] = None
+        # 热点语句使用服务端预备语句（经 PgBouncer 事务池连接时需关闭）
+        self.use_prepared_statements = os.getenv('DB_PREPARED_STATEMENTS', 'true').lower() in ('1', 'true', 'yes')
+        
+        # 模型查询缓存配置（max_size 为 0 时关闭缓存）
+        self.model_cache_max_size = int(os.getenv('DB_MODEL_CACHE_MAX_SIZE', '10000'))
+        self.player_cache_ttl = float(os.getenv('DB_PLAYER_CACHE_TTL', '3600'))
+        self.game_cache_ttl = float(os.getenv('DB_GAME_CACHE_TTL', '60'))
+        
+        # 积分流水冷归档：超过保留月数的分区导出到 archive_dir（见 ledger_archive.py）
+        self.archive_dir = os.getenv('DB_ARCHIVE_DIR', 'archive')
+        self.archive_retention_months = int(os.getenv('DB_ARCHIVE_RETENTION_MONTHS', '12'))
+        # DETACH/DROP 分区时等待父表锁的上限（毫秒）和重试次数，需低于 deadlock_timeout（默认 1 秒）
+        self.archive_lock_timeout_ms = int(os.getenv('DB_ARCHIVE_LOCK_TIMEOUT_MS', '500'))
+        self.archive_lock_retries = int(os.getenv('DB_ARCHIVE_LOCK_RETRIES', '5'))
+        
+        # 积分流水写后缓冲：积分变动攒批后在一个事务中提交（见 ledger_writer.py）
+        self.ledger_write_behind = os.getenv('DB_LEDGER_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+        self.ledger_batch_size = int(os.getenv('DB_LEDGER_BATCH_SIZE', '500'))
+        self.ledger_flush_interval = float(os.getenv('DB_LEDGER_FLUSH_INTERVAL', '0.005'))
+        self.ledger_queue_size = int(os.getenv('DB_LEDGER_QUEUE_SIZE', '10000'))
+        
+        # 语句耗时统计与慢查询日志（见 db_metrics.py）
+        self.metrics_enabled = os.getenv('DB_METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        self.slow_query_ms = float(os.getenv('DB_SLOW_QUERY_MS', '500'))
+        self.metrics_max_statements = int(os.getenv('DB_METRICS_MAX_STATEMENTS', '500'))
+        
+        # 只读副本：逗号分隔的 DSN 列表，DSN 中未给出的参数沿用主库配置（见 replica_router.py）
+        self.replica_params: List[dict] = [
+            self._replica_params(dsn) for dsn in os.getenv('DB_REPLICA_DSNS', '').split(',') if dsn.strip()
+        ]
+        self.replica_max_lag = float(os.getenv('DB_REPLICA_MAX_LAG', '5'))
+        self.replica_check_interval = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', '5'))
+        
+        # 连接池实例（主库一个，每个副本各一个）
+        self._pool: Optional[Union[SimpleConnectionPool, ThreadedHealthCheckedPool]] = None
+        self._replica_pools: Dict[int, Union[SimpleConnectionPool, ThreadedHealthCheckedPool]] = {}
+        self._pool_lock = threading.Lock()
+    
+    def _replica_params(self, dsn: str) -> dict:
+        params = parse_dsn(dsn.strip())
+        if 'dbname' in params:
+            params['database'] = params.pop('dbname')
+        return {**self.db_params, **params}
     
     def get_connection_params(self) -> dict:
         """获取数据库连接参数"""
         return self.db_params.copy()
     
-    def create_pool(self) -> SimpleConnectionPool:
+    def create_pool(self) -> Union[SimpleConnectionPool, ThreadedHealthCheckedPool]:
         """创建数据库连接池"""
+        with self._pool_lock:
+            return self._create_pool_locked()
+    
+    def _create_pool_locked(self) -> Union[SimpleConnectionPool, ThreadedHealthCheckedPool]:
         if self._pool is None:
             try:
-                self._pool = SimpleConnectionPool(
-                    minconn=self.pool_min_size,
-                    maxconn=self.pool_max_size,
-                    **self.db_params
-                )
-                logger.info("数据库连接池创建成功")
+                self._pool = self._new_pool(self.db_params)
+                logger.info(f"数据库连接池创建成功 (模式: {self.pool_mode})")
             except Exception as e:
                 logger.error(f"创建数据库连接池失败: {e}")
                 raise
         return self._pool
     
+    def _new_pool(self, params: dict) -> Union[SimpleConnectionPool, ThreadedHealthCheckedPool]:
+        if self.pool_mode == 'threaded':
+            return ThreadedHealthCheckedPool(
+                minconn=self.pool_min_size,
+                maxconn=self.pool_max_size,
+                timeout=self.pool_timeout,
+                max_waiters=self.pool_max_waiters,
+                max_lifetime=self.pool_max_lifetime,
+                max_idle=self.pool_max_idle,
+                health_check_interval=self.pool_health_check_interval,
+                **params
+            )
+        return SimpleConnectionPool(
+            minconn=self.pool_min_size,
+            maxconn=self.pool_max_size,
+            **params
+        )
+    
     def get_connection(self):
         """从连接池获取连接"""
         if self._pool is None:
             self.create_pool()
         return self._pool.getconn()
     
-    def return_connection(self, conn):
-        """归还连接到连接池"""
+    def return_connection(self, conn, close: bool = False):
+        """归还连接到连接池，close=True 时直接关闭损坏的连接"""
         if self._pool:
-            self._pool.putconn(conn)
+            self._pool.putconn(conn, close=close)
+    
+    def get_replica_connection(self, index: int):
+        """从第 index 个副本的连接池获取连接，连接池按需创建"""
+        pool = self._replica_pools.get(index)
+        if pool is None:
+            with self._pool_lock:
+                pool = self._replica_pools.get(index)
+                if pool is None:
+                    pool = self._replica_pools[index] = self._new_pool(self.replica_params[index])
+                    logger.info(f"副本 {index} 连接池创建成功 (模式: {self.pool_mode})")
+        return pool.getconn()
+    
+    def return_replica_connection(self, index: int, conn, close: bool = False):
+        """归还副本连接"""
+        pool = self._replica_pools.get(index)
+        if pool:
+            pool.putconn(conn, close=close)
+    
+    @staticmethod
+    def _pool_stats(pool) -> Dict[str, Any]:
+        if isinstance(pool, ThreadedHealthCheckedPool):
+            return pool.stats()
+        if isinstance(pool, SimpleConnectionPool):
+            return {
+                'size': len(pool._pool) + len(pool._used),
+                'max_size': pool.maxconn,
+                'in_use': len(pool._used),
+                'idle': len(pool._pool),
+            }
+        return {}
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """获取连接池统计信息（in_use / idle / waiters / 出借等待耗时）"""
+        return self._pool_stats(self._pool)
+    
+    def get_replica_pool_stats(self) -> Dict[int, Dict[str, Any]]:
+        """获取各副本连接池的统计信息"""
+        return {index: self._pool_stats(pool) for index, pool in self._replica_pools.items()}
     
     def close_pool(self):
-        """关闭连接池"""
+        """关闭连接池（包括副本连接池）"""
         if self._pool:
             self._pool.closeall()
             self._pool = None
             logger.info("数据库连接池已关闭")
+        with self._pool_lock:
+            pools, self._replica_pools = self._replica_pools, {}
+        for pool in pools.values():
+            pool.closeall()
 
 # 全局数据库配置实例
 db_config = DatabaseConfig() 
\ No newline at end of file
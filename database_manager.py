@@ -1,9 +1,19 @@
+import re
+import threading
+import time
+import weakref
 import psycopg2
+from psycopg2 import errors, extensions
 from psycopg2.extras import RealDictCursor, execute_values
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterator, Optional, Tuple, Union
 import logging
 from contextlib import contextmanager
 from database_config import db_config
+from columnar import ColumnarResult
+from db_utils import stream_query
+from db_metrics import query_metrics
+from replica_router import ReplicaRouter
+from async_database_manager import to_asyncpg_query
 
 logger = logging.getLogger(__name__)
 
@@ -12,40 +22,234 @@ class DatabaseManager:
     
     def __init__(self):
         self.config = db_config
+        # 预备语句注册表：SQL 文本 -> 语句名；按连接记录已 PREPARE 的语句名
+        self._prepared_names: Dict[str, str] = {}
+        self._prepared_sql: Dict[str, Tuple[str, str]] = {}
+        self._conn_prepared: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+        self._prepared_lock = threading.Lock()
+        self.prepared_stats = {'prepares': 0, 'executions': 0, 'reprepares': 0, 'fallbacks': 0}
+        self.metrics = query_metrics
+        self.replicas = ReplicaRouter(self.config)
+    
+    def register_prepared(self, name: str, query: str) -> None:
+        """注册热点语句，之后以相同 SQL 文本调用 execute_* 时改为按名称 EXECUTE
+
+        每条连接在第一次用到时 PREPARE 一次；连接池回收重建连接后会自动重新准备。
+        """
+        placeholders = sum(1 for token in re.findall(r"%%|%s", query) if token == '%s')
+        execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * placeholders)})" if placeholders else f"EXECUTE {name}"
+        prepare_sql = f"PREPARE {name} AS {to_asyncpg_query(query)}"
+        with self._prepared_lock:
+            self._prepared_names[query] = name
+            self._prepared_sql[name] = (prepare_sql, execute_sql)
+    
+    def _connection_prepared(self, conn) -> set:
+        """返回该连接已准备的语句名集合；后端进程变化（连接被重建）时清空"""
+        pid = conn.get_backend_pid()
+        with self._prepared_lock:
+            state = self._conn_prepared.get(conn)
+            if state is None or state[0] != pid:
+                state = (pid, set())
+                self._conn_prepared[conn] = state
+            return state[1]
+    
+    def _forget_prepared(self, conn) -> None:
+        with self._prepared_lock:
+            self._conn_prepared.pop(conn, None)
+    
+    def _count_prepared(self, key: str) -> None:
+        with self._prepared_lock:
+            self.prepared_stats[key] += 1
+    
+    @staticmethod
+    def _prepare(conn, prepare_sql: str) -> None:
+        """执行 PREPARE；失败时只撤销这一步：连接空闲时回滚，已在调用方事务中时回滚到保存点，不丢弃之前的语句"""
+        in_transaction = conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+        with conn.cursor() as cursor:
+            if not in_transaction:
+                try:
+                    cursor.execute(prepare_sql)
+                except psycopg2.Error:
+                    conn.rollback()
+                    raise
+                return
+            cursor.execute("SAVEPOINT prepare_statement")
+            try:
+                cursor.execute(prepare_sql)
+            except psycopg2.Error:
+                cursor.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+                raise
+            finally:
+                if conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INTRANS:
+                    cursor.execute("RELEASE SAVEPOINT prepare_statement")
+    
+    def _resolve_prepared(self, conn, query: str, params: Optional[Tuple]) -> Tuple[str, Optional[Tuple]]:
+        """已注册的语句改写为 EXECUTE，必要时先在该连接上 PREPARE；失败时退回文本语句"""
+        name = self._prepared_names.get(query)
+        if name is None or not self.config.use_prepared_statements:
+            return query, params
+        prepare_sql, execute_sql = self._prepared_sql[name]
+        prepared = self._connection_prepared(conn)
+        if name not in prepared:
+            try:
+                self._prepare(conn, prepare_sql)
+                self._count_prepared('prepares')
+            except errors.DuplicatePreparedStatement:
+                pass  # 会话中已存在（例如重新准备前登记被清空），直接使用
+            except psycopg2.Error as e:
+                self._count_prepared('fallbacks')
+                logger.warning(f"预备语句 {name} 准备失败，改用文本语句: {e}")
+                return query, params
+            prepared.add(name)
+        self._count_prepared('executions')
+        return execute_sql, params
+    
+    def _execute(self, conn, cursor, query: str, params: Optional[Tuple]) -> None:
+        """执行语句并记录耗时和行数（按原始 SQL 归一化后统计，不区分是否走预备语句）"""
+        if not self.metrics.enabled:
+            self._execute_statement(conn, cursor, query, params)
+            return
+        started = time.perf_counter()
+        try:
+            self._execute_statement(conn, cursor, query, params)
+        except Exception:
+            self.metrics.observe_query(query, time.perf_counter() - started, error=True)
+            raise
+        self.metrics.observe_query(query, time.perf_counter() - started, max(cursor.rowcount, 0))
+    
+    def _execute_statement(self, conn, cursor, query: str, params: Optional[Tuple]) -> None:
+        """执行语句；预备语句在服务端丢失（DISCARD/DEALLOCATE）时重新准备并重试一次
+
+        只有执行前连接空闲（这条语句自成一个事务）时才回滚重试；已在调用方事务中时不能回滚，
+        清除登记后把错误抛给调用方，由调用方整体回滚，下次执行时重新准备。
+        """
+        sql, args = self._resolve_prepared(conn, query, params)
+        idle = conn.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+        try:
+            cursor.execute(sql, args)
+        except errors.InvalidSqlStatementName:
+            self._forget_prepared(conn)
+            if not idle:
+                raise
+            conn.rollback()
+            self._count_prepared('reprepares')
+            sql, args = self._resolve_prepared(conn, query, params)
+            cursor.execute(sql, args)
     
     @contextmanager
-    def get_connection(self):
-        """获取数据库连接的上下文管理器"""
+    def get_connection(self, replica: Optional[int] = None):
+        """获取数据库连接的上下文管理器，replica 为副本编号时从该副本的连接池获取"""
         conn = None
+        broken = False
         try:
-            conn = self.config.get_connection()
+            started = time.perf_counter()
+            conn = self.config.get_connection() if replica is None else self.config.get_replica_connection(replica)
+            if self.metrics.enabled:
+                self.metrics.observe_pool_wait(time.perf_counter() - started)
             yield conn
         except Exception as e:
             if conn:
-                conn.rollback()
+                if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)) or conn.closed:
+                    # 连接已损坏，不再放回连接池
+                    broken = True
+                else:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        broken = True
             logger.error(f"数据库操作失败: {e}")
             raise
         finally:
             if conn:
-                self.config.return_connection(conn)
+                if replica is None:
+                    self.config.return_connection(conn, close=broken)
+                else:
+                    self.config.return_replica_connection(replica, conn, close=broken)
     
-    def execute_query(self, query: str, params: Optional[Tuple] = None) -> List[Dict[str, Any]]:
-        """执行查询语句，返回结果列表"""
+    @contextmanager
+    def transaction(self, cursor_factory=RealDictCursor):
+        """在单个事务中执行多条语句，正常退出时提交，出现异常时回滚；启用统计时游标上的每条语句都计入 metrics"""
+        if self.metrics.enabled:
+            cursor_factory = self.metrics.cursor_factory(cursor_factory)
         with self.get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(query, params)
-                return [dict(row) for row in cursor.fetchall()]
+            with conn.cursor(cursor_factory=cursor_factory) as cursor:
+                yield cursor
+            conn.commit()
+    
+    def execute_query(self, query: str, params: Optional[Tuple] = None,
+                      read_your_writes: bool = False) -> List[Dict[str, Any]]:
+        """执行查询语句，返回结果列表
+
+        配置了只读副本时，只读语句发往复制延迟在允许范围内的副本，副本不可用时回退到主库；
+        需要立即看到自己刚提交的写入时传 read_your_writes=True，直接查询主库。
+        """
+        return self._routed_fetch(query, params, read_your_writes, 'dict')
     
-    def execute_single_query(self, query: str, params: Optional[Tuple] = None) -> Optional[Dict[str, Any]]:
+    def execute_query_tuples(self, query: str, params: Optional[Tuple] = None,
+                             read_your_writes: bool = False) -> List[tuple]:
+        """执行查询语句，按列顺序返回元组行（不构建字典，配合模型的 from_rows 批量构建对象）"""
+        return self._routed_fetch(query, params, read_your_writes, 'tuple')
+    
+    def execute_columnar(self, query: str, params: Optional[Tuple] = None, read_your_writes: bool = False,
+                         backend: str = 'auto') -> ColumnarResult:
+        """执行查询语句，结果按列解码为 numpy 数组（未安装 numpy 时为 array.array），见 columnar.ColumnarResult
+
+        适合统计、报表类的大结果集：不为每行构建字典，取到的元组直接转置为列。路由规则与 execute_query 相同。
+        """
+        return self._routed_fetch(query, params, read_your_writes, 'columnar', backend)
+    
+    def _routed_fetch(self, query: str, params: Optional[Tuple], read_your_writes: bool, row_format: str,
+                      backend: str = 'auto') -> Union[List[Any], ColumnarResult]:
+        replica = None if read_your_writes else self.replicas.choose(query)
+        if replica is not None:
+            try:
+                return self._fetch_all(query, params, replica, row_format, backend)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError, errors.SerializationFailure) as e:
+                # 连接失败，或热备上查询因回放冲突被取消：改用主库
+                self.replicas.mark_failed(replica, e)
+        return self._fetch_all(query, params, None, row_format, backend)
+    
+    def _fetch_all(self, query: str, params: Optional[Tuple], replica: Optional[int] = None,
+                   row_format: str = 'dict', backend: str = 'auto') -> Union[List[Any], ColumnarResult]:
+        with self.get_connection(replica) as conn:
+            with conn.cursor(cursor_factory=RealDictCursor if row_format == 'dict' else None) as cursor:
+                self._execute(conn, cursor, query, params)
+                if row_format == 'columnar':
+                    rows = ColumnarResult.from_rows(cursor.fetchall(), cursor.description, backend)
+                elif row_format == 'tuple':
+                    rows = cursor.fetchall()
+                else:
+                    rows = [dict(row) for row in cursor.fetchall()]
+            if replica is not None:
+                # 结束只读事务，避免副本连接长时间持有快照阻塞 WAL 回放
+                conn.rollback()
+            return rows
+    
+    def execute_stream(self, query: str, params: Optional[Tuple] = None, batch_size: int = 1000,
+                       row_format: str = 'dict') -> Iterator[Union[List[Any], Dict[str, List[Any]]]]:
+        """流式执行查询，按 batch_size 分批返回结果（见 stream_query），迭代结束或中途退出时归还连接"""
+        with self.get_connection() as conn:
+            try:
+                yield from stream_query(conn, query, params, batch_size, row_format)
+            finally:
+                # 只读游标，回滚即可释放快照；提前退出（GeneratorExit）时也要保证连接干净地回到连接池
+                if not conn.closed:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        pass
+    
+    def execute_single_query(self, query: str, params: Optional[Tuple] = None,
+                             read_your_writes: bool = False) -> Optional[Dict[str, Any]]:
         """执行查询语句，返回单条结果"""
-        results = self.execute_query(query, params)
+        results = self.execute_query(query, params, read_your_writes)
         return results[0] if results else None
     
     def execute_update(self, query: str, params: Optional[Tuple] = None) -> int:
         """执行更新语句，返回影响的行数"""
         with self.get_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query, params)
+                self._execute(conn, cursor, query, params)
                 conn.commit()
                 return cursor.rowcount
     
@@ -53,15 +257,27 @@ class DatabaseManager:
         """执行插入语句，返回插入的ID或结果"""
         with self.get_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query, params)
+                self._execute(conn, cursor, query, params)
                 conn.commit()
                 return cursor.fetchone()[0] if cursor.description else None
     
+    def execute_single_write(self, query: str, params: Optional[Tuple] = None) -> Optional[Dict[str, Any]]:
+        """执行带 RETURNING 的写入语句并提交，返回单条结果"""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                self._execute(conn, cursor, query, params)
+                row = cursor.fetchone() if cursor.description else None
+                conn.commit()
+                return dict(row) if row else None
+    
     def execute_batch_insert(self, query: str, params_list: List[Tuple]) -> None:
         """批量插入数据"""
         with self.get_connection() as conn:
             with conn.cursor() as cursor:
+                started = time.perf_counter()
                 execute_values(cursor, query, params_list)
+                if self.metrics.enabled:
+                    self.metrics.observe_query(query, time.perf_counter() - started, len(params_list))
                 conn.commit()
     
     def execute_transaction(self, queries: List[Tuple[str, Optional[Tuple]]]) -> bool:
@@ -70,7 +286,7 @@ class DatabaseManager:
             try:
                 with conn.cursor() as cursor:
                     for query, params in queries:
-                        cursor.execute(query, params)
+                        self._execute(conn, cursor, query, params)
                 conn.commit()
                 return True
             except Exception as e:
@@ -78,6 +294,26 @@ class DatabaseManager:
                 logger.error(f"事务执行失败: {e}")
                 return False
     
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """获取连接池统计信息"""
+        return self.config.get_pool_stats()
+    
+    def get_replica_stats(self) -> Dict[str, Any]:
+        """获取只读副本的路由、延迟和连接池统计信息"""
+        return self.replicas.get_stats()
+    
+    def get_prepared_stats(self) -> Dict[str, Any]:
+        """获取预备语句统计信息"""
+        return dict(self.prepared_stats, registered=len(self._prepared_sql))
+    
+    def get_query_stats(self, top: Optional[int] = None) -> Dict[str, Any]:
+        """获取语句耗时、连接池等待和慢查询统计"""
+        return self.metrics.get_stats(top)
+    
+    def render_metrics(self) -> str:
+        """以 Prometheus 文本格式导出语句统计"""
+        return self.metrics.render_prometheus()
+    
     def test_connection(self) -> bool:
         """测试数据库连接"""
         try:
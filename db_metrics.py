@@ -0,0 +1,284 @@
+import bisect
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional
+import logging
+from psycopg2 import extensions
+from database_config import db_config
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger('db_metrics.slow_query')
+
+# 直方图桶上界（秒），与 Prometheus 客户端默认桶相近，补充了亚毫秒级
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+OTHER_STATEMENT = 'other'
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"%s|\$\d+")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+@lru_cache(maxsize=2048)
+def normalize_sql(query: str) -> str:
+    """归一化 SQL 作为统计键：合并空白，字面量和占位符替换为 ?，IN 列表折叠为 (...)"""
+    text = _STRING_RE.sub('?', query)
+    text = _NUMBER_RE.sub('?', text)
+    text = _PLACEHOLDER_RE.sub('?', text)
+    text = _IN_LIST_RE.sub('(...)', text)
+    return _SPACE_RE.sub(' ', text).strip()
+
+class _Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max', 'rows', 'errors')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.errors = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """按桶估算分位数（取所在桶的上界），只用于人工查看"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(LATENCY_BUCKETS[index], self.max) if index < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+class QueryMetrics:
+    """语句耗时直方图、连接池等待时间、返回行数和慢查询日志
+
+    每次记录只有一次加锁、一次二分查找；归一化 SQL 按原始文本缓存，业务 SQL 都是常量，几乎总是命中缓存。
+    不同语句数超过 max_statements 后新语句计入 'other'，避免动态拼接的 SQL 让内存无限增长。
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, slow_query_ms: Optional[float] = None,
+                 max_statements: Optional[int] = None, slow_log_size: int = 100):
+        self.enabled = db_config.metrics_enabled if enabled is None else enabled
+        self.slow_query_seconds = (db_config.slow_query_ms if slow_query_ms is None else slow_query_ms) / 1000.0
+        self.max_statements = max_statements or db_config.metrics_max_statements
+        self._lock = threading.Lock()
+        self._statements: Dict[str, _Histogram] = {}
+        self._pool_wait = _Histogram()
+        self._slow_queries: Deque[Dict[str, Any]] = deque(maxlen=slow_log_size)
+        self._slow_count = 0
+        self._started = time.time()
+        self._cursor_classes: Dict[type, type] = {}
+
+    def cursor_factory(self, base: Optional[type] = None) -> type:
+        """返回 base 游标类的计时子类，execute/executemany 自动记录（供 transaction() 等直接使用游标的代码）"""
+        base = base or extensions.cursor
+        cls = self._cursor_classes.get(base)
+        if cls is None:
+            metrics = self
+
+            class TimedCursor(base):
+                def execute(self, query, vars=None):
+                    started = time.perf_counter()
+                    try:
+                        result = super().execute(query, vars)
+                    except Exception:
+                        metrics.observe_query(_query_text(query, self), time.perf_counter() - started, error=True)
+                        raise
+                    metrics.observe_query(_query_text(query, self), time.perf_counter() - started, max(self.rowcount, 0))
+                    return result
+
+                def executemany(self, query, vars_list):
+                    started = time.perf_counter()
+                    try:
+                        result = super().executemany(query, vars_list)
+                    except Exception:
+                        metrics.observe_query(_query_text(query, self), time.perf_counter() - started, error=True)
+                        raise
+                    metrics.observe_query(_query_text(query, self), time.perf_counter() - started, max(self.rowcount, 0))
+                    return result
+
+            TimedCursor.__name__ = TimedCursor.__qualname__ = f"Timed{base.__name__}"
+            cls = self._cursor_classes[base] = TimedCursor
+        return cls
+
+    def observe_query(self, query: str, seconds: float, rows: int = 0, error: bool = False) -> None:
+        """记录一次语句执行"""
+        key = normalize_sql(query)
+        with self._lock:
+            histogram = self._statements.get(key)
+            if histogram is None:
+                if len(self._statements) >= self.max_statements:
+                    key = OTHER_STATEMENT
+                    histogram = self._statements.get(key)
+                if histogram is None:
+                    histogram = self._statements[key] = _Histogram()
+            histogram.observe(seconds)
+            if rows > 0:
+                histogram.rows += rows
+            if error:
+                histogram.errors += 1
+        if seconds >= self.slow_query_seconds:
+            self._log_slow(key, seconds, rows, error)
+
+    def observe_pool_wait(self, seconds: float) -> None:
+        """记录一次从连接池获取连接的等待时间"""
+        with self._lock:
+            self._pool_wait.observe(seconds)
+
+    def _log_slow(self, key: str, seconds: float, rows: int, error: bool) -> None:
+        entry = {'sql': key, 'duration_ms': round(seconds * 1000, 3), 'rows': rows, 'error': error,
+                 'time': time.time()}
+        with self._lock:
+            self._slow_queries.append(entry)
+            self._slow_count += 1
+        slow_query_logger.warning(f"慢查询 {entry['duration_ms']}ms rows={rows}: {key[:500]}")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._statements.clear()
+            self._pool_wait = _Histogram()
+            self._slow_queries.clear()
+            self._slow_count = 0
+            self._started = time.time()
+
+    @staticmethod
+    def _summary(histogram: _Histogram) -> Dict[str, Any]:
+        return {
+            'count': histogram.count,
+            'total_ms': round(histogram.total * 1000, 3),
+            'avg_ms': round(histogram.total / histogram.count * 1000, 3) if histogram.count else 0.0,
+            'p50_ms': round(histogram.quantile(0.5) * 1000, 3),
+            'p95_ms': round(histogram.quantile(0.95) * 1000, 3),
+            'p99_ms': round(histogram.quantile(0.99) * 1000, 3),
+            'max_ms': round(histogram.max * 1000, 3),
+        }
+
+    def get_stats(self, top: Optional[int] = None) -> Dict[str, Any]:
+        """统计快照：语句按总耗时降序排列，top 限制返回条数"""
+        with self._lock:
+            statements = [
+                dict(self._summary(histogram), sql=key, rows=histogram.rows, errors=histogram.errors)
+                for key, histogram in self._statements.items()
+            ]
+            pool_wait = self._summary(self._pool_wait)
+            slow_queries = list(self._slow_queries)
+            slow_count = self._slow_count
+        statements.sort(key=lambda item: item['total_ms'], reverse=True)
+        return {
+            'enabled': self.enabled,
+            'since': self._started,
+            'slow_query_ms': self.slow_query_seconds * 1000,
+            'statements': statements[:top] if top else statements,
+            'pool_wait': pool_wait,
+            'slow_query_count': slow_count,
+            'slow_queries': slow_queries,
+        }
+
+    def render_prometheus(self, prefix: str = 'qipai_db') -> str:
+        """Prometheus 文本格式导出"""
+        lines: List[str] = []
+
+        def histogram_lines(name: str, histogram: _Histogram, labels: str) -> None:
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {histogram.count}')
+            suffix = f'{{{labels.rstrip(",")}}}' if labels else ''
+            lines.append(f'{name}_sum{suffix} {histogram.total}')
+            lines.append(f'{name}_count{suffix} {histogram.count}')
+
+        with self._lock:
+            statements = list(self._statements.items())
+            pool_wait = self._pool_wait
+            lines.append(f"# HELP {prefix}_query_duration_seconds 语句执行耗时")
+            lines.append(f"# TYPE {prefix}_query_duration_seconds histogram")
+            for key, histogram in statements:
+                histogram_lines(f"{prefix}_query_duration_seconds", histogram, f'statement="{_escape_label(key)}",')
+            lines.append(f"# HELP {prefix}_query_rows_total 语句返回或影响的行数")
+            lines.append(f"# TYPE {prefix}_query_rows_total counter")
+            for key, histogram in statements:
+                lines.append(f'{prefix}_query_rows_total{{statement="{_escape_label(key)}"}} {histogram.rows}')
+            lines.append(f"# HELP {prefix}_query_errors_total 语句执行失败次数")
+            lines.append(f"# TYPE {prefix}_query_errors_total counter")
+            for key, histogram in statements:
+                lines.append(f'{prefix}_query_errors_total{{statement="{_escape_label(key)}"}} {histogram.errors}')
+            lines.append(f"# HELP {prefix}_pool_wait_seconds 从连接池获取连接的等待时间")
+            lines.append(f"# TYPE {prefix}_pool_wait_seconds histogram")
+            histogram_lines(f"{prefix}_pool_wait_seconds", pool_wait, '')
+            lines.append(f"# HELP {prefix}_slow_queries_total 超过慢查询阈值的语句次数")
+            lines.append(f"# TYPE {prefix}_slow_queries_total counter")
+            lines.append(f"{prefix}_slow_queries_total {self._slow_count}")
+        return '\n'.join(lines) + '\n'
+
+class TimedAsyncConnection:
+    """asyncpg 连接的计时代理：fetch/fetchrow/fetchval/execute/executemany 计入 QueryMetrics，其他属性（如 transaction()）透传
+
+    asyncpg 的 $1 占位符与 psycopg2 的 %s 归一化后相同，同一条 SQL 的同步和异步执行计入同一统计项。
+    """
+
+    __slots__ = ('_conn', '_metrics')
+
+    def __init__(self, conn, metrics: QueryMetrics):
+        self._conn = conn
+        self._metrics = metrics
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    async def _timed(self, method, query: str, args, kwargs, rows_of):
+        started = time.perf_counter()
+        try:
+            result = await method(query, *args, **kwargs)
+        except Exception:
+            self._metrics.observe_query(query, time.perf_counter() - started, error=True)
+            raise
+        self._metrics.observe_query(query, time.perf_counter() - started, rows_of(result))
+        return result
+
+    async def fetch(self, query: str, *args, **kwargs):
+        return await self._timed(self._conn.fetch, query, args, kwargs, len)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        return await self._timed(self._conn.fetchrow, query, args, kwargs, lambda row: int(row is not None))
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        return await self._timed(self._conn.fetchval, query, args, kwargs, lambda value: int(value is not None))
+
+    async def execute(self, query: str, *args, **kwargs):
+        return await self._timed(self._conn.execute, query, args, kwargs, status_rowcount)
+
+    async def executemany(self, query: str, args, **kwargs):
+        return await self._timed(self._conn.executemany, query, (args,), kwargs, lambda _: len(args))
+
+def _query_text(query: Any, cursor) -> str:
+    if isinstance(query, str):
+        return query
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    return query.as_string(cursor)  # psycopg2.sql.Composed
+
+def status_rowcount(status: Any) -> int:
+    """从 asyncpg 命令状态（如 'UPDATE 3'）中解析影响行数"""
+    try:
+        return int(status.rsplit(' ', 1)[-1])
+    except (ValueError, AttributeError):
+        return 0
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+# 全局查询统计实例
+query_metrics = QueryMetrics()
@@ -0,0 +1,79 @@
+import itertools
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+import psycopg2
+from columnar import ColumnarResult
+
+# 与连接池、配置无关的 SQL 辅助函数（流式读取、只读判断），独立的命令行工具也可以直接使用
+
+_WRITE_RE = re.compile(
+    r"\b(?:INSERT|UPDATE|DELETE|MERGE|TRUNCATE|CREATE|ALTER|DROP|GRANT|REVOKE|COPY|CALL|LOCK|NOTIFY"
+    r"|SKIP\s+LOCKED|NOWAIT|FOR\s+(?:NO\s+KEY\s+)?UPDATE|FOR\s+(?:KEY\s+)?SHARE"
+    r"|nextval|setval|pg_(?:try_)?advisory\w*|pg_notify)\b",
+    re.IGNORECASE,
+)
+# ddl.sql / function.sql 中会写数据的函数，SELECT 调用它们时不能发往副本
+WRITE_FUNCTIONS = (
+    'join_game', 'create_game_room', 'update_player_score', 'transfer_points_between_players', 'end_game',
+    'update_participant_status', 'leave_game', 'kick_player', 'rejoin_game', 'create_monthly_partition',
+    'drop_old_partition', 'maintain_partitions', 'apply_player_stats_delta', 'rebuild_player_stats_summary',
+)
+_WRITE_FUNCTION_RE = re.compile(r"\b(?:%s)\s*\(" % '|'.join(WRITE_FUNCTIONS), re.IGNORECASE)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+@lru_cache(maxsize=2048)
+def is_read_only(query: str) -> bool:
+    """判断语句能否发往只读副本：以 SELECT/WITH 开头，且不含写操作、行锁、序列和咨询锁"""
+    text = _STRING_RE.sub("''", _COMMENT_RE.sub(' ', query)).lstrip().lstrip('(')
+    if not re.match(r"(?:SELECT|WITH)\b", text, re.IGNORECASE):
+        return False
+    return not (_WRITE_RE.search(text) or _WRITE_FUNCTION_RE.search(text))
+
+STREAM_ROW_FORMATS = ('dict', 'tuple', 'columns', 'columnar')
+_stream_ids = itertools.count(1)
+
+def _format_batch(rows: List[tuple], description, row_format: str) -> Union[List[Any], Dict[str, List[Any]], ColumnarResult]:
+    if row_format == 'tuple':
+        return rows
+    if row_format == 'columnar':
+        return ColumnarResult.from_rows(rows, description)
+    columns = [desc[0] for desc in description]
+    if row_format == 'columns':
+        return {column: list(values) for column, values in zip(columns, zip(*rows))}
+    return [dict(zip(columns, row)) for row in rows]
+
+def stream_batches(conn, query: str, params: Optional[Tuple] = None,
+                   batch_size: int = 1000) -> Iterator[Tuple[List[tuple], Any]]:
+    """在给定连接上用服务端命名游标分批读取，产出 (元组行列表, cursor.description)，内存占用只与 batch_size 有关
+
+    连接须处于事务中（psycopg2 默认行为），事务的提交或回滚由调用方负责。
+    """
+    cursor = conn.cursor(name=f"stream_{next(_stream_ids)}")
+    try:
+        cursor.itersize = batch_size
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows, cursor.description
+    finally:
+        if not conn.closed:
+            try:
+                cursor.close()
+            except psycopg2.Error:
+                pass
+
+def stream_query(conn, query: str, params: Optional[Tuple] = None, batch_size: int = 1000,
+                 row_format: str = 'dict') -> Iterator[Union[List[Any], Dict[str, List[Any]]]]:
+    """在给定连接上用服务端命名游标分批读取结果（见 stream_batches），每批按 row_format 转换
+
+    row_format: dict 每行一个字典；tuple 每行一个元组；columns 每批一个 {列名: 值列表}；
+    columnar 每批一个 ColumnarResult（numpy 或 array 数组，见 columnar.py，可用 ColumnarResult.concat 合并）。
+    """
+    if row_format not in STREAM_ROW_FORMATS:
+        raise ValueError(f"row_format 只能是 {STREAM_ROW_FORMATS}")
+    for rows, description in stream_batches(conn, query, params, batch_size):
+        yield _format_batch(rows, description, row_format)
@@ -59,4 +59,7 @@ CREATE INDEX idx_score_transactions_event_time ON score_transactions(event_time)
 CREATE INDEX idx_game_participants_game_id ON game_participants(game_id);
 CREATE INDEX idx_game_participants_player_id ON game_participants(player_id);
 CREATE INDEX idx_games_start_time ON games(start_time);
-CREATE INDEX idx_games_end_time ON games(end_time);
\ No newline at end of file
+CREATE INDEX idx_games_end_time ON games(end_time);
+-- 键集分页：玩家积分流水按 (event_time, transaction_id) 倒序翻页，玩家对局历史按 game_id 倒序翻页
+CREATE INDEX idx_score_transactions_player_time_id ON score_transactions(player_id, event_time DESC, transaction_id DESC);
+CREATE INDEX idx_game_participants_player_game ON game_participants(player_id, game_id DESC);
\ No newline at end of file
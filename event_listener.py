@@ -0,0 +1,326 @@
+import json
+import queue
+import select
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type
+import psycopg2
+from psycopg2 import extensions
+import logging
+from database_config import db_config
+
+logger = logging.getLogger(__name__)
+
+def _parse_time(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime) or value is None:
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+@dataclass(frozen=True)
+class ScoreChangeEvent:
+    """积分变动事件（score_update 通道，notify_score_change 触发器）"""
+    player_id: int
+    points_change: int
+    current_total: int
+    game_id: Optional[int] = None
+    transaction_type: Optional[str] = None
+    related_player_id: Optional[int] = None
+    description: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    replayed: bool = False
+
+@dataclass(frozen=True)
+class ParticipantEvent:
+    """参与者变动事件（game_update 通道，notify_participant_update 触发器）"""
+    game_id: int
+    player_id: int
+    action: str
+    timestamp: Optional[datetime] = None
+
+@dataclass(frozen=True)
+class TransferEvent:
+    """积分转移广播事件（transfer_broadcast 通道，broadcast_transfer_record 触发器）"""
+    transfer_id: str
+    from_player_id: int
+    to_player_id: int
+    points: int
+    game_id: Optional[int] = None
+    from_username: Optional[str] = None
+    to_username: Optional[str] = None
+    description: Optional[str] = None
+    status: Optional[str] = None
+    transfer_time: Optional[datetime] = None
+
+@dataclass(frozen=True)
+class ResyncEvent:
+    """重连或丢弃事件后发出，订阅者应重新从数据库加载无法补发的状态"""
+    reason: str
+    since: Optional[datetime] = None
+
+def _decode_score_change(data: Dict[str, Any]) -> ScoreChangeEvent:
+    return ScoreChangeEvent(
+        player_id=data['player_id'],
+        points_change=data['points_change'],
+        current_total=data['current_total'],
+        game_id=data.get('game_id'),
+        transaction_type=data.get('transaction_type'),
+        related_player_id=data.get('related_player_id'),
+        description=data.get('description'),
+        timestamp=_parse_time(data.get('timestamp')),
+    )
+
+def _decode_participant(data: Dict[str, Any]) -> ParticipantEvent:
+    return ParticipantEvent(
+        game_id=data['game_id'],
+        player_id=data['player_id'],
+        action=data['action'],
+        timestamp=_parse_time(data.get('timestamp')),
+    )
+
+def _decode_transfer(data: Dict[str, Any]) -> TransferEvent:
+    return TransferEvent(
+        transfer_id=data['transfer_id'],
+        from_player_id=data['from_player_id'],
+        to_player_id=data['to_player_id'],
+        points=data['points'],
+        game_id=data.get('game_id'),
+        from_username=data.get('from_username'),
+        to_username=data.get('to_username'),
+        description=data.get('description'),
+        status=data.get('status'),
+        transfer_time=_parse_time(data.get('transfer_time')),
+    )
+
+# 通道名 -> 负载解码函数
+DECODERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    'score_update': _decode_score_change,
+    'game_update': _decode_participant,
+    'transfer_broadcast': _decode_transfer,
+}
+
+class Subscription:
+    """订阅者：独立的有界队列和投递线程，慢订阅者不会阻塞其他订阅者
+
+    overflow='block' 时队列满会阻塞监听线程，未读取的通知积压在 PostgreSQL 的通知队列中（背压）；
+    overflow='drop' 时丢弃最旧的事件，并在恢复后补发一个 ResyncEvent。
+    """
+
+    def __init__(self, callback: Callable[[Any], None], event_types: Tuple[Type, ...],
+                 queue_size: int = 1000, overflow: str = 'block'):
+        if overflow not in ('block', 'drop'):
+            raise ValueError("overflow 只能是 'block' 或 'drop'")
+        self.callback = callback
+        self.event_types = event_types
+        self.overflow = overflow
+        self.dropped = 0
+        self.delivered = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._needs_resync = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._worker, name="event-subscriber", daemon=True)
+        self._thread.start()
+
+    def accepts(self, event: Any) -> bool:
+        return isinstance(event, ResyncEvent) or isinstance(event, self.event_types)
+
+    def offer(self, event: Any, stop: threading.Event) -> None:
+        """投递事件，按 overflow 策略处理队列已满的情况"""
+        if self.overflow == 'block':
+            while not stop.is_set() and not self._stopped.is_set():
+                try:
+                    self._queue.put(event, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                    self._needs_resync = True
+                except queue.Empty:
+                    pass
+
+    def _worker(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._deliver(self._queue.get(timeout=0.5))
+            except queue.Empty:
+                pass
+            # 队列追上后再通知订阅者重新同步被丢弃的状态
+            if self._needs_resync and self._queue.empty():
+                self._needs_resync = False
+                self._deliver(ResyncEvent(reason='overflow'))
+
+    def _deliver(self, event: Any) -> None:
+        try:
+            self.callback(event)
+            self.delivered += 1
+        except Exception as e:
+            logger.error(f"事件订阅者处理失败: {e}")
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._thread.join(timeout=2)
+
+class NotificationListener:
+    """PostgreSQL LISTEN/NOTIFY 事件消费服务
+
+    使用一条独立连接监听通道，解码负载后分发给订阅者。连接断开后按指数退避重连，
+    并从 score_transactions 补发断线期间的积分变动（至少一次投递，current_total 为绝对值，重复投递无害）。
+    """
+
+    REPLAY_SQL = """
+        SELECT player_id, game_id, points_change, current_total, event_time
+        FROM score_transactions
+        WHERE event_time >= %s
+        ORDER BY event_time
+        """
+
+    def __init__(self, channels: Iterable[str] = ('score_update', 'game_update', 'transfer_broadcast'),
+                 poll_interval: float = 1.0, max_backoff: float = 30.0, replay_overlap: float = 5.0):
+        self.channels = list(channels)
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        # 补发时向前多取的时间窗口，覆盖 event_time 早于提交时间的事务
+        self.replay_overlap = timedelta(seconds=replay_overlap)
+        self._subscriptions: List[Subscription] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._conn = None
+        self._last_score_time: Optional[datetime] = None
+        self.stats = {'received': 0, 'decode_errors': 0, 'reconnects': 0, 'replayed': 0}
+
+    def subscribe(self, callback: Callable[[Any], None], event_types: Iterable[Type] = (),
+                  queue_size: int = 1000, overflow: str = 'block') -> Subscription:
+        """注册订阅者，event_types 为空时接收所有事件"""
+        event_types = tuple(event_types) or (ScoreChangeEvent, ParticipantEvent, TransferEvent)
+        subscription = Subscription(callback, event_types, queue_size, overflow)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+        subscription.close()
+
+    def start(self) -> None:
+        """启动后台监听线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pg-notify-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止监听并关闭所有订阅者"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval + 2)
+        self._close_connection()
+        with self._lock:
+            subscriptions, self._subscriptions = self._subscriptions, []
+        for subscription in subscriptions:
+            subscription.close()
+
+    def _connect(self) -> None:
+        conn = psycopg2.connect(**db_config.get_connection_params())
+        conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            for channel in self.channels:
+                cursor.execute(f"LISTEN {extensions.quote_ident(channel, conn)}")
+        self._conn = conn
+        logger.info(f"事件监听已连接，通道: {self.channels}")
+
+    def _close_connection(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _run(self) -> None:
+        backoff = 1.0
+        connected_before = False
+        while not self._stop.is_set():
+            try:
+                self._connect()
+                if connected_before:
+                    self.stats['reconnects'] += 1
+                    self._replay_missed()
+                    self._dispatch(ResyncEvent(reason='reconnect', since=self._last_score_time))
+                connected_before = True
+                backoff = 1.0
+                self._poll_loop()
+            except (psycopg2.Error, OSError) as e:
+                logger.warning(f"事件监听连接异常，{backoff:.0f} 秒后重连: {e}")
+                self._close_connection()
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        self._close_connection()
+
+    def _poll_loop(self) -> None:
+        conn = self._conn
+        while not self._stop.is_set():
+            if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                self._handle(notify.channel, notify.payload)
+
+    def _replay_missed(self) -> None:
+        """补发断线期间写入的积分流水"""
+        if self._last_score_time is None:
+            return
+        since = self._last_score_time - self.replay_overlap
+        with self._conn.cursor() as cursor:
+            cursor.execute(self.REPLAY_SQL, (since,))
+            for player_id, game_id, points_change, current_total, event_time in cursor:
+                self.stats['replayed'] += 1
+                self._dispatch(ScoreChangeEvent(
+                    player_id=player_id, points_change=points_change, current_total=current_total,
+                    game_id=game_id, timestamp=event_time, replayed=True,
+                ))
+                self._last_score_time = max(self._last_score_time, event_time)
+
+    def _handle(self, channel: str, payload: str) -> None:
+        self.stats['received'] += 1
+        decoder = DECODERS.get(channel)
+        if decoder is None and channel.startswith('game_'):
+            decoder = _decode_transfer
+        if decoder is None:
+            return
+        try:
+            event = decoder(json.loads(payload))
+        except (ValueError, KeyError, TypeError) as e:
+            self.stats['decode_errors'] += 1
+            logger.warning(f"无法解析通道 {channel} 的通知: {e}")
+            return
+        if isinstance(event, ScoreChangeEvent) and event.timestamp is not None:
+            if self._last_score_time is None or event.timestamp > self._last_score_time:
+                self._last_score_time = event.timestamp
+        self._dispatch(event)
+
+    def _dispatch(self, event: Any) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.accepts(event):
+                subscription.offer(event, self._stop)
+
+# 全局事件监听实例（需调用 start() 启动）
+event_listener = NotificationListener()
@@ -0,0 +1,169 @@
+import bisect
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+from database_manager import db_manager
+from async_database_manager import async_db_manager
+from event_listener import NotificationListener, ResyncEvent, ScoreChangeEvent
+
+logger = logging.getLogger(__name__)
+
+class LeaderboardCache:
+    """进程内 Top-K 积分排行榜
+
+    用一次查询预热前 size + margin 名，之后由积分变动事件增量更新（已 attach 时不再定时重载，
+    只在事件积压或重新同步时重载），未订阅事件时按 refresh_interval 定时重载。
+    limit 不超过 size 的排行榜请求直接从内存返回，不访问数据库。
+    重载查询在锁外执行，同一时间只有一个调用方重载，其他调用方继续读旧数据（尚未加载过时返回 None，由调用方查库）；
+    异步代码使用 aget()，重载走 async_db_manager，不会阻塞事件循环。
+    """
+
+    LOAD_SQL = """
+        SELECT p.player_id, p.username, s.current_total, s.last_updated
+        FROM scores s
+        JOIN players p ON s.player_id = p.player_id
+        ORDER BY s.current_total DESC, s.player_id
+        LIMIT %s
+        """
+    USERNAME_SQL = "SELECT username FROM players WHERE player_id = %s"
+
+    def __init__(self, size: int = 100, refresh_interval: float = 30.0, margin: Optional[int] = None):
+        self.size = size
+        # 多缓存一部分名次，前 size 名中有玩家掉出时不必立即重载
+        self.capacity = size + (margin if margin is not None else max(size // 2, 10))
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._order: List[Tuple[int, int]] = []
+        # 预热结果少于 capacity 时说明已缓存全部玩家，任何新分数都可以直接插入
+        self._exhaustive = False
+        self._loaded_at = 0.0
+        self._stale = True
+        self._loaded = False
+        self._listening = False
+        self._reload_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'reloads': 0, 'events': 0}
+
+    @staticmethod
+    def _key(player_id: int, current_total: int) -> Tuple[int, int]:
+        return (-current_total, player_id)
+
+    def reload(self) -> None:
+        """从数据库重新加载前 capacity 名"""
+        self._install(db_manager.execute_query(self.LOAD_SQL, (self.capacity,)))
+
+    async def areload(self) -> None:
+        """从数据库重新加载前 capacity 名（异步）"""
+        self._install(await async_db_manager.execute_query(self.LOAD_SQL, (self.capacity,)))
+
+    def _install(self, rows: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._entries = {row['player_id']: row for row in rows}
+            self._order = [self._key(row['player_id'], row['current_total']) for row in rows]
+            self._exhaustive = len(rows) < self.capacity
+            self._loaded_at = time.monotonic()
+            self._stale = False
+            self._loaded = True
+            self.stats['reloads'] += 1
+
+    def _needs_reload(self) -> bool:
+        if self._stale:
+            return True
+        return not self._listening and time.monotonic() - self._loaded_at > self.refresh_interval
+
+    def invalidate(self) -> None:
+        """标记缓存失效，下次读取时重载"""
+        with self._lock:
+            self._stale = True
+
+    def get(self, limit: int = 10) -> Optional[List[Dict[str, Any]]]:
+        """返回前 limit 名；limit 超出缓存范围时返回 None，由调用方回退到数据库查询"""
+        if limit > self.size:
+            self.stats['misses'] += 1
+            return None
+        if self._needs_reload() and self._reload_lock.acquire(blocking=False):
+            try:
+                self.reload()
+            finally:
+                self._reload_lock.release()
+        return self._read(limit)
+
+    async def aget(self, limit: int = 10) -> Optional[List[Dict[str, Any]]]:
+        """返回前 limit 名（异步）；需要重载时用异步查询，不阻塞事件循环"""
+        if limit > self.size:
+            self.stats['misses'] += 1
+            return None
+        if self._needs_reload() and self._reload_lock.acquire(blocking=False):
+            try:
+                await self.areload()
+            finally:
+                self._reload_lock.release()
+        return self._read(limit)
+
+    def _read(self, limit: int) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            if not self._loaded:
+                # 其他调用方正在首次加载
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            return [dict(self._entries[player_id]) for _, player_id in self._order[:limit]]
+
+    def apply(self, player_id: int, current_total: int, last_updated: Optional[datetime] = None) -> None:
+        """应用一次积分变动（current_total 为变动后的绝对值）"""
+        key = self._key(player_id, current_total)
+        username = None
+        # 新进榜玩家需要用户名，查询放在锁外，避免阻塞读请求
+        if player_id not in self._entries and self._may_enter(key):
+            username = self._lookup_username(player_id)
+            if username is None:
+                return
+
+        with self._lock:
+            self.stats['events'] += 1
+            entry = self._entries.get(player_id)
+            if entry is not None:
+                if last_updated and entry['last_updated'] and last_updated < entry['last_updated']:
+                    return  # 乱序或补发的旧事件
+                username = entry['username']
+                self._order.remove(self._key(player_id, entry['current_total']))
+                del self._entries[player_id]
+
+            if not self._may_enter(key) or username is None:
+                # 新分数落在已缓存名次之外，未缓存玩家可能排在它前面，只能丢弃
+                if len(self._order) < self.size:
+                    self._stale = True
+                return
+
+            bisect.insort(self._order, key)
+            self._entries[player_id] = {
+                'player_id': player_id,
+                'username': username,
+                'current_total': current_total,
+                'last_updated': last_updated or datetime.now().astimezone(),
+            }
+            if len(self._order) > self.capacity:
+                _, evicted = self._order.pop()
+                del self._entries[evicted]
+                self._exhaustive = False
+
+    def _may_enter(self, key: Tuple[int, int]) -> bool:
+        return self._exhaustive or not self._order or key < self._order[-1]
+
+    def _lookup_username(self, player_id: int) -> Optional[str]:
+        row = db_manager.execute_single_query(self.USERNAME_SQL, (player_id,))
+        return row['username'] if row else None
+
+    def handle_event(self, event: Any) -> None:
+        """事件订阅回调"""
+        if isinstance(event, ScoreChangeEvent):
+            self.apply(event.player_id, event.current_total, event.timestamp)
+        elif isinstance(event, ResyncEvent):
+            self.invalidate()
+
+    def attach(self, listener: NotificationListener) -> None:
+        """订阅积分变动事件，事件积压时丢弃旧事件并整体重载"""
+        listener.subscribe(self.handle_event, (ScoreChangeEvent,), overflow='drop')
+        self._listening = True
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+积分流水冷归档
+将超过保留期的 score_transactions 分区导出为 Parquet（zstd 压缩）文件，校验行数和校验和后删除分区；
+历史查询通过 score_transaction_archive_players 按玩家定位归档文件中的行区间，透明读取归档数据。
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from psycopg2 import errorcodes, errors, sql
+from psycopg2.extras import execute_values
+import logging
+from database_config import db_config
+from database_manager import db_manager
+from db_utils import stream_query
+from async_database_manager import async_db_manager
+from partition_manager import PartitionManager
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow 为可选依赖，仅归档和读取归档数据需要
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ledger_archive.sql')
+COLUMNS = ('transaction_id', 'player_id', 'game_id', 'points_change', 'current_total', 'event_time')
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("积分流水归档需要安装 pyarrow: pip install pyarrow")
+
+def _arrow_schema():
+    return pa.schema([
+        ('transaction_id', pa.string()),
+        ('player_id', pa.int64()),
+        ('game_id', pa.int64()),
+        ('points_change', pa.int32()),
+        ('current_total', pa.int32()),
+        ('event_time', pa.timestamp('us', tz='UTC')),
+    ])
+
+def _row_digest(digest, transaction_id: Any, player_id: int, game_id: Optional[int],
+                points_change: int, current_total: int, event_time: datetime) -> None:
+    """校验和按整数微秒计时间，与会话时区无关"""
+    micros = (event_time - _EPOCH) // timedelta(microseconds=1)
+    digest.update(f"{transaction_id}|{player_id}|{game_id}|{points_change}|{current_total}|{micros}\n".encode())
+
+def merge_history(live: List[Dict[str, Any]], archived: List[Dict[str, Any]],
+                  limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """合并在线与归档流水，按 (event_time, transaction_id) 从新到旧排序"""
+    if not archived:
+        return live
+    rows = sorted(live + archived, key=lambda row: (row['event_time'], str(row['transaction_id'])), reverse=True)
+    return rows[:limit] if limit is not None else rows
+
+class ArchiveLockTimeout(RuntimeError):
+    """多次重试后仍拿不到 DETACH/DROP 所需的锁，本次跳过该分区（事务已回滚，下次归档时重试）"""
+
+class LedgerArchiver:
+    """按分区归档积分流水
+
+    DETACH PARTITION 需要父表的 ACCESS EXCLUSIVE 锁，排队期间会挡住所有新的流水读写；
+    因此 DETACH/DROP 前设置 lock_timeout（DB_ARCHIVE_LOCK_TIMEOUT_MS），超时回滚到保存点后退避重试，
+    仍拿不到锁时放弃本次归档。超时低于 deadlock_timeout，与迟到写入（已持有父表锁、在等分区的 SHARE 锁）
+    相遇时由本任务先让出，而不是触发死锁检测。
+    """
+
+    PARTITION_STATS_SQL = "SELECT COUNT(*), COALESCE(SUM(points_change), 0) FROM {}"
+    EXPORT_SQL = """
+        SELECT transaction_id::text, player_id, game_id, points_change, current_total, event_time
+        FROM {}
+        ORDER BY player_id, event_time DESC, transaction_id DESC
+        """
+    INSERT_ARCHIVE_SQL = """
+        INSERT INTO score_transaction_archives (
+            partition_name, range_start, range_end, file_path, row_count, points_sum, checksum, file_bytes
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING archive_id
+        """
+    INSERT_PLAYERS_SQL = """
+        INSERT INTO score_transaction_archive_players (
+            player_id, archive_id, first_row, row_count, min_event_time, max_event_time
+        ) VALUES %s
+        """
+
+    def __init__(self, archive_dir: Optional[str] = None, table: str = 'score_transactions',
+                 batch_size: int = 50000, row_group_size: int = 16384, lock_timeout_ms: Optional[int] = None,
+                 lock_retries: Optional[int] = None):
+        self.db_manager = db_manager
+        self.archive_dir = archive_dir or db_config.archive_dir
+        self.table = table
+        self.batch_size = batch_size
+        self.row_group_size = row_group_size
+        self.lock_timeout_ms = db_config.archive_lock_timeout_ms if lock_timeout_ms is None else lock_timeout_ms
+        self.lock_retries = db_config.archive_lock_retries if lock_retries is None else lock_retries
+
+    def install(self, schema_file: str = SCHEMA_FILE) -> bool:
+        """创建归档目录表（可重复执行）"""
+        try:
+            with open(schema_file, 'r', encoding='utf-8') as f:
+                script = f.read()
+            with self.db_manager.transaction() as cursor:
+                cursor.execute(script)
+            logger.info("积分流水归档目录表安装完成")
+            return True
+        except Exception as e:
+            logger.error(f"安装积分流水归档目录表失败: {e}")
+            return False
+
+    def expired_partitions(self, retention_months: Optional[int] = None,
+                           today: Optional[date] = None) -> List[Dict[str, Any]]:
+        """结束时间早于保留期起点（当月往前 retention_months 个月的 1 号）的分区，DEFAULT 分区除外"""
+        retention_months = db_config.archive_retention_months if retention_months is None else retention_months
+        today = today or datetime.now(timezone.utc).date()
+        month_index = today.year * 12 + today.month - 1 - retention_months
+        cutoff = datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=timezone.utc)
+        manager = PartitionManager(self.table)
+        try:
+            partitions = manager.list_partitions()
+        finally:
+            manager.close()
+        return [p for p in partitions if p['to'] and datetime.fromisoformat(p['to']) <= cutoff]
+
+    def archive_expired(self, retention_months: Optional[int] = None) -> List[Dict[str, Any]]:
+        """归档所有过期分区，单个分区失败不影响其余分区"""
+        results = []
+        for partition in self.expired_partitions(retention_months):
+            try:
+                results.append(self.archive_partition(
+                    partition['name'], datetime.fromisoformat(partition['from']), datetime.fromisoformat(partition['to'])))
+            except ArchiveLockTimeout as e:
+                logger.warning(f"归档分区 {partition['name']} 已跳过: {e}")
+                results.append({'partition': partition['name'], 'skipped': str(e)})
+            except Exception as e:
+                logger.error(f"归档分区 {partition['name']} 失败: {e}")
+                results.append({'partition': partition['name'], 'error': str(e)})
+        return results
+
+    def archive_partition(self, name: str, range_start: datetime, range_end: datetime) -> Dict[str, Any]:
+        """导出一个分区并校验，成功后在同一事务中写入归档目录、DETACH 并 DROP 该分区"""
+        _require_pyarrow()
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.abspath(os.path.join(self.archive_dir, f"{name}.parquet"))
+        tmp_path = f"{path}.tmp"
+        partition = sql.Identifier(name)
+        began = time.monotonic()
+
+        with self.db_manager.get_connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    # 阻止导出期间仍有写入（迟到的补录），读取不受影响
+                    cursor.execute(sql.SQL("LOCK TABLE {} IN SHARE MODE").format(partition))
+                    cursor.execute(sql.SQL(self.PARTITION_STATS_SQL).format(partition))
+                    expected_rows, expected_sum = cursor.fetchone()
+
+                export = stream_query(conn, sql.SQL(self.EXPORT_SQL).format(partition).as_string(conn),
+                                      batch_size=self.batch_size, row_format='columns')
+                written, checksum, players = self._write_file(export, tmp_path)
+                if written != expected_rows:
+                    raise RuntimeError(f"导出行数 {written} 与分区行数 {expected_rows} 不一致")
+                self._verify_file(tmp_path, expected_rows, expected_sum, checksum)
+                os.replace(tmp_path, path)
+
+                with conn.cursor() as cursor:
+                    cursor.execute(self.INSERT_ARCHIVE_SQL, (
+                        name, range_start, range_end, path, expected_rows, expected_sum, checksum, os.path.getsize(path)))
+                    archive_id = cursor.fetchone()[0]
+                    execute_values(cursor, self.INSERT_PLAYERS_SQL,
+                                   [(player_id, archive_id, *segment) for player_id, segment in players.items()],
+                                   page_size=5000)
+                    self._detach_and_drop(cursor, partition)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                for leftover in (tmp_path, path):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+                raise
+
+        ledger_archive.invalidate()
+        logger.info(f"分区 {name} 已归档到 {path}：{expected_rows} 行，{len(players)} 名玩家，"
+                    f"耗时 {time.monotonic() - began:.1f} 秒")
+        return {'partition': name, 'file_path': path, 'rows': expected_rows, 'players': len(players),
+                'file_bytes': os.path.getsize(path)}
+
+    def _detach_and_drop(self, cursor, partition: sql.Identifier) -> None:
+        """限时等待锁执行 DETACH 和 DROP，超时回滚到保存点后退避重试（lock_timeout 只在本事务内生效）"""
+        cursor.execute("SELECT set_config('lock_timeout', %s, true)", (f"{self.lock_timeout_ms}ms",))
+        for attempt in range(self.lock_retries + 1):
+            cursor.execute("SAVEPOINT detach_partition")
+            try:
+                cursor.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                    sql.Identifier(self.table), partition))
+                cursor.execute(sql.SQL("DROP TABLE {}").format(partition))
+                cursor.execute("RELEASE SAVEPOINT detach_partition")
+                break
+            except errors.LockNotAvailable:
+                cursor.execute("ROLLBACK TO SAVEPOINT detach_partition")
+                if attempt == self.lock_retries:
+                    raise ArchiveLockTimeout(
+                        f"{self.lock_retries + 1} 次等待 {self.table} 的锁均超过 {self.lock_timeout_ms}ms")
+                logger.info(f"DETACH 等待锁超时，{0.2 * 2 ** attempt:.1f} 秒后重试")
+                time.sleep(0.2 * 2 ** attempt)
+
+    def _write_file(self, batches: Iterable[Dict[str, List[Any]]],
+                    path: str) -> Tuple[int, str, Dict[int, List[Any]]]:
+        """写入 Parquet 文件，同时计算校验和并记录每个玩家的行区间 [first_row, row_count, min_time, max_time]"""
+        schema = _arrow_schema()
+        digest = hashlib.sha256()
+        players: Dict[int, List[Any]] = {}
+        written = 0
+        with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+            for batch in batches:
+                for offset, row in enumerate(zip(*(batch[column] for column in COLUMNS))):
+                    _row_digest(digest, *row)
+                    player_id, event_time = row[1], row[5]
+                    segment = players.get(player_id)
+                    if segment is None:
+                        # 同一玩家的行按 event_time 降序排列，第一行即最大时间
+                        players[player_id] = [written + offset, 1, event_time, event_time]
+                    else:
+                        segment[1] += 1
+                        segment[2] = event_time
+                batch_table = pa.Table.from_pydict({column: batch[column] for column in COLUMNS}, schema=schema)
+                writer.write_table(batch_table, row_group_size=self.row_group_size)
+                written += batch_table.num_rows
+        return written, digest.hexdigest(), players
+
+    def _verify_file(self, path: str, expected_rows: int, expected_sum: int, checksum: str) -> None:
+        """重新读取文件，核对行数、积分变动总和与逐行校验和"""
+        parquet_file = pq.ParquetFile(path)
+        digest = hashlib.sha256()
+        rows = points_sum = 0
+        for record_batch in parquet_file.iter_batches(batch_size=self.batch_size):
+            columns = record_batch.to_pydict()
+            for row in zip(*(columns[column] for column in COLUMNS)):
+                _row_digest(digest, *row)
+                points_sum += row[3]
+            rows += record_batch.num_rows
+        if rows != expected_rows or points_sum != expected_sum or digest.hexdigest() != checksum:
+            raise RuntimeError(f"归档文件 {path} 校验失败：行数 {rows}/{expected_rows}，"
+                               f"积分总和 {points_sum}/{expected_sum}")
+
+class LedgerArchiveReader:
+    """读取已归档的积分流水"""
+
+    HORIZON_SQL = "SELECT MAX(range_end) AS horizon FROM score_transaction_archives"
+    SEGMENTS_SQL = """
+        SELECT a.file_path, p.first_row, p.row_count
+        FROM score_transaction_archive_players p
+        JOIN score_transaction_archives a ON a.archive_id = p.archive_id
+        WHERE p.player_id = %s AND p.max_event_time >= %s
+        ORDER BY a.range_start DESC
+        """
+
+    def __init__(self, horizon_ttl: float = 60.0):
+        self.horizon_ttl = horizon_ttl
+        self._horizon: Optional[datetime] = None
+        self._horizon_checked = 0.0
+        # 归档文件不可变，缓存每个文件的行组起始行号
+        self._row_groups: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+        # 查询时发现未安装归档目录表后置为 False，不再重复查询
+        self.catalog_installed = True
+
+    def invalidate(self) -> None:
+        """归档新分区后清除归档边界缓存"""
+        self.catalog_installed = True
+        self._horizon_checked = 0.0
+
+    def _horizon_expired(self) -> bool:
+        return self.catalog_installed and time.monotonic() - self._horizon_checked >= self.horizon_ttl
+
+    def _catalog_missing(self) -> None:
+        logger.warning("未安装积分流水归档目录表，历史查询只读取在线数据")
+        self.catalog_installed = False
+        self._set_horizon(None)
+
+    def _set_horizon(self, horizon: Optional[datetime]) -> None:
+        self._horizon = horizon
+        self._horizon_checked = time.monotonic()
+
+    def horizon(self) -> Optional[datetime]:
+        """已归档数据的结束时间（之后的数据都还在在线表中），没有归档或未安装目录表时为 None"""
+        if self._horizon_expired():
+            try:
+                row = db_manager.execute_single_query(self.HORIZON_SQL)
+                self._set_horizon(row['horizon'] if row else None)
+            except errors.UndefinedTable:
+                self._catalog_missing()
+            except Exception as e:
+                logger.error(f"查询归档边界失败: {e}")
+                return self._horizon
+        return self._horizon
+
+    async def ahorizon(self) -> Optional[datetime]:
+        """已归档数据的结束时间（异步）"""
+        if self._horizon_expired():
+            try:
+                row = await async_db_manager.execute_single_query(self.HORIZON_SQL)
+                self._set_horizon(row['horizon'] if row else None)
+            except Exception as e:
+                if getattr(e, 'sqlstate', None) == errorcodes.UNDEFINED_TABLE:
+                    self._catalog_missing()
+                else:
+                    logger.error(f"查询归档边界失败: {e}")
+        return self._horizon
+
+    @staticmethod
+    def needed(horizon: Optional[datetime], since: Optional[datetime] = None,
+               live: Optional[List[Any]] = None, limit: Optional[int] = None) -> bool:
+        """判断本次查询是否需要读取归档：按时间范围查询时看起点是否早于归档边界；
+        按条数查询时看在线数据是否不足 limit 条，或最旧一条已早于归档边界（live 为行字典或 ScoreTransaction）"""
+        if horizon is None:
+            return False
+        if since is not None:
+            return since < horizon
+        if limit is not None and live is not None:
+            if len(live) < limit:
+                return True
+            oldest = live[-1] if live else None
+            event_time = oldest['event_time'] if isinstance(oldest, dict) else getattr(oldest, 'event_time', None)
+            return event_time is not None and event_time < horizon
+        return True
+
+    def read_player(self, player_id: int, since: Optional[datetime] = None,
+                    limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """读取玩家的归档流水（从新到旧），since 为时间下限（含）"""
+        try:
+            segments = db_manager.execute_query(self.SEGMENTS_SQL, (player_id, since or _EPOCH))
+            return self.read_segments(segments, since, limit)
+        except Exception as e:
+            logger.error(f"读取玩家 {player_id} 的归档流水失败: {e}")
+            return []
+
+    async def aread_player(self, player_id: int, since: Optional[datetime] = None,
+                           limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """读取玩家的归档流水（异步），文件读取在线程池中执行"""
+        try:
+            segments = await async_db_manager.execute_query(self.SEGMENTS_SQL, (player_id, since or _EPOCH))
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.read_segments, segments, since, limit)
+        except Exception as e:
+            logger.error(f"读取玩家 {player_id} 的归档流水失败: {e}")
+            return []
+
+    def read_segments(self, segments: List[Dict[str, Any]], since: Optional[datetime] = None,
+                      limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按目录给出的行区间读取，只解压覆盖这些行的行组"""
+        if segments and pq is None:
+            logger.error("存在归档数据但未安装 pyarrow，历史查询不包含归档部分")
+            return []
+        rows: List[Dict[str, Any]] = []
+        for segment in segments:
+            for row in self._read_rows(segment['file_path'], segment['first_row'], segment['row_count']):
+                if since is not None and row['event_time'] < since:
+                    break
+                row['transaction_id'] = uuid.UUID(row['transaction_id'])
+                rows.append(row)
+                if limit is not None and len(rows) >= limit:
+                    return rows
+        return rows
+
+    def _row_group_starts(self, path: str, parquet_file) -> List[int]:
+        with self._lock:
+            starts = self._row_groups.get(path)
+            if starts is None:
+                starts, offset = [], 0
+                for index in range(parquet_file.num_row_groups):
+                    starts.append(offset)
+                    offset += parquet_file.metadata.row_group(index).num_rows
+                starts.append(offset)
+                self._row_groups[path] = starts
+            return starts
+
+    def _read_rows(self, path: str, first_row: int, row_count: int) -> List[Dict[str, Any]]:
+        parquet_file = pq.ParquetFile(path)
+        starts = self._row_group_starts(path, parquet_file)
+        groups = [index for index in range(len(starts) - 1)
+                  if starts[index] < first_row + row_count and first_row < starts[index + 1]]
+        if not groups:
+            return []
+        table = parquet_file.read_row_groups(groups, columns=list(COLUMNS))
+        return table.slice(first_row - starts[groups[0]], row_count).to_pylist()
+
+# 全局归档读取实例
+ledger_archive = LedgerArchiveReader()
+
+def main():
+    parser = argparse.ArgumentParser(description="积分流水冷归档")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('install', help="创建归档目录表")
+    archive_parser = subparsers.add_parser('archive', help="归档超过保留期的分区")
+    archive_parser.add_argument('--retention-months', type=int, help="保留的月数（默认 DB_ARCHIVE_RETENTION_MONTHS）")
+    archive_parser.add_argument('--archive-dir', help="归档文件目录（默认 DB_ARCHIVE_DIR）")
+    archive_parser.add_argument('--dry-run', action='store_true', help="只列出将要归档的分区")
+    args = parser.parse_args()
+
+    if args.command == 'install':
+        return 0 if LedgerArchiver().install() else 1
+
+    archiver = LedgerArchiver(archive_dir=args.archive_dir)
+    if args.dry_run:
+        for partition in archiver.expired_partitions(args.retention_months):
+            print(f"{partition['name']}: [{partition['from']}, {partition['to']}) ~{partition['rows']} 行")
+        return 0
+    results = archiver.archive_expired(args.retention_months)
+    for result in results:
+        if 'error' in result:
+            print(f"❌ {result['partition']}: {result['error']}")
+        elif 'skipped' in result:
+            print(f"⏭️ {result['partition']}: 已跳过，{result['skipped']}")
+        else:
+            print(f"✅ {result['partition']}: {result['rows']} 行 -> {result['file_path']} ({result['file_bytes']} 字节)")
+    return 1 if any('error' in result for result in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+-- ========================================
+-- 积分流水冷归档目录
+-- ========================================
+-- 超过保留期的 score_transactions 分区导出为本地 Parquet 文件后删除（见 ledger_archive.py archive），
+-- 这里记录每个归档文件及文件内每个玩家的行区间，历史查询按玩家直接定位到需要读取的行组。
+-- 导出、校验、写目录、DETACH/DROP 分区在同一事务中完成，目录中存在的归档即对应已删除的分区。
+
+-- 1. 归档文件（一个分区一个文件）
+CREATE TABLE IF NOT EXISTS score_transaction_archives (
+    archive_id SERIAL PRIMARY KEY,
+    partition_name VARCHAR(63) NOT NULL UNIQUE,
+    range_start TIMESTAMPTZ NOT NULL,
+    range_end TIMESTAMPTZ NOT NULL,
+    file_path TEXT NOT NULL,
+    row_count BIGINT NOT NULL,
+    points_sum BIGINT NOT NULL,
+    checksum CHAR(64) NOT NULL,      -- 按导出顺序对每行内容计算的 SHA-256
+    file_bytes BIGINT NOT NULL,
+    archived_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_score_transaction_archives_range
+    ON score_transaction_archives(range_end);
+
+-- 2. 玩家索引：文件按 (player_id, event_time DESC, transaction_id DESC) 排序，每个玩家占连续的一段行
+CREATE TABLE IF NOT EXISTS score_transaction_archive_players (
+    player_id BIGINT NOT NULL,
+    archive_id INTEGER NOT NULL REFERENCES score_transaction_archives(archive_id) ON DELETE CASCADE,
+    first_row BIGINT NOT NULL,
+    row_count INTEGER NOT NULL,
+    min_event_time TIMESTAMPTZ NOT NULL,
+    max_event_time TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (player_id, archive_id)
+);
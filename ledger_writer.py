@@ -0,0 +1,269 @@
+import asyncio
+import atexit
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+import logging
+from database_config import db_config
+from database_manager import db_manager
+from models import ScoreTransaction
+
+logger = logging.getLogger(__name__)
+
+class LedgerEvent:
+    """待写入的积分变动"""
+
+    __slots__ = ('player_id', 'points_change', 'game_id', 'future')
+
+    def __init__(self, player_id: int, points_change: int, game_id: Optional[int]):
+        self.player_id = player_id
+        self.points_change = points_change
+        self.game_id = game_id
+        self.future: Future = Future()
+
+_STOP = object()
+
+class LedgerWriter:
+    """积分流水写后缓冲（group commit）
+
+    submit() 把积分变动放入有界队列并立即返回 Future；后台线程攒够 batch_size 条或等待 flush_interval 秒后，
+    在一个事务中写入整批流水并更新总分，提交成功后 Future 才得到结果（ScoreTransaction，积分不足时为 None）。
+
+    - 顺序：只有一个写入线程按入队顺序处理，同一玩家的变动按 submit 顺序生效，余额检查逐条进行。
+    - 背压：队列满时 submit 阻塞（可设 timeout，超时抛出 queue.Full），阻塞期间不持有锁，不影响 flush()/close()；
+      异步代码使用 asubmit()，队列满时改在线程池中等待，不阻塞事件循环。
+    - 关闭：close() 后不再接受新事件，已入队的事件全部写完（或其 Future 得到异常）后返回；进程正常退出时自动调用。
+    - 整批事务失败（如 game_id 不存在）时逐条重试，只有出错的事件得到异常。
+    """
+
+    ENSURE_SCORES_SQL = """
+        INSERT INTO scores (player_id, current_total, last_updated)
+        SELECT player_id, 0, NOW() FROM unnest(%s::bigint[]) AS t(player_id)
+        ORDER BY player_id
+        ON CONFLICT (player_id) DO NOTHING
+        """
+    # 按 player_id 顺序加锁，与其他批量写入保持一致，避免死锁
+    LOCK_SCORES_SQL = """
+        SELECT player_id, current_total FROM scores
+        WHERE player_id = ANY(%s::bigint[])
+        ORDER BY player_id
+        FOR UPDATE
+        """
+    UPDATE_SCORES_SQL = """
+        UPDATE scores s SET current_total = t.current_total, last_updated = NOW()
+        FROM unnest(%s::bigint[], %s::integer[]) AS t(player_id, current_total)
+        WHERE s.player_id = t.player_id
+        """
+    # 同一事务内 NOW() 相同，按批内顺序加微秒偏移，保证 (event_time, transaction_id) 排序与写入顺序一致
+    INSERT_TRANSACTIONS_SQL = """
+        INSERT INTO score_transactions (transaction_id, player_id, game_id, points_change, current_total, event_time)
+        SELECT t.transaction_id, t.player_id, t.game_id, t.points_change, t.current_total,
+               NOW() + (t.ord - 1) * INTERVAL '1 microsecond'
+        FROM unnest(%s::uuid[], %s::bigint[], %s::bigint[], %s::integer[], %s::integer[])
+            WITH ORDINALITY AS t(transaction_id, player_id, game_id, points_change, current_total, ord)
+        RETURNING transaction_id, event_time
+        """
+
+    def __init__(self, batch_size: Optional[int] = None, flush_interval: Optional[float] = None,
+                 queue_size: Optional[int] = None):
+        self.batch_size = batch_size or db_config.ledger_batch_size
+        self.flush_interval = db_config.ledger_flush_interval if flush_interval is None else flush_interval
+        self.db_manager = db_manager
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size or db_config.ledger_queue_size)
+        self._lock = threading.Lock()
+        # 正在入队的生产者数；close() 等它们入队完毕再放入停止标记，保证停止标记之后不会再有事件
+        self._producers = 0
+        self._producers_done = threading.Condition(self._lock)
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {'submitted': 0, 'written': 0, 'rejected': 0, 'failed': 0, 'batches': 0,
+                      'fallback_batches': 0, 'max_batch': 0}
+
+    def start(self) -> None:
+        """启动写入线程（submit 时自动调用）"""
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, player_id: int, points_change: int, game_id: Optional[int] = None,
+               timeout: Optional[float] = None, block: bool = True) -> Future:
+        """提交一次积分变动，返回在事件持久化后完成的 Future；block=False 且队列已满时立即抛出 queue.Full"""
+        event = LedgerEvent(player_id, points_change, game_id)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("积分流水写入器已关闭")
+            self._start_locked()
+            self._producers += 1
+        self._put(event, block, timeout)
+        with self._lock:
+            self.stats['submitted'] += 1
+        return event.future
+
+    async def asubmit(self, player_id: int, points_change: int, game_id: Optional[int] = None,
+                      timeout: Optional[float] = None) -> Optional[ScoreTransaction]:
+        """提交一次积分变动并等待写入结果（异步）；队列满时在线程池中等待入队，不阻塞事件循环"""
+        try:
+            future = self.submit(player_id, points_change, game_id, block=False)
+        except queue.Full:
+            loop = asyncio.get_running_loop()
+            future = await loop.run_in_executor(
+                None, lambda: self.submit(player_id, points_change, game_id, timeout=timeout))
+        return await asyncio.wrap_future(future)
+
+    def _put(self, item: Any, block: bool = True, timeout: Optional[float] = None) -> None:
+        """在锁外入队（队列满时可能阻塞）；调用方已在锁内确认写入器未关闭并登记为生产者"""
+        try:
+            self._queue.put(item, block, timeout)
+        finally:
+            with self._lock:
+                self._producers -= 1
+                if not self._producers:
+                    self._producers_done.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待此前提交的事件全部写入，超时返回 False"""
+        barrier = threading.Event()
+        with self._lock:
+            if self._closed or not (self._thread and self._thread.is_alive()):
+                return self._queue.empty()
+            self._producers += 1
+        try:
+            self._put(barrier, timeout=timeout)
+        except queue.Full:
+            return False
+        return barrier.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """停止接受新事件，写完队列中已有的事件后退出写入线程"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return
+            # 写入线程仍在消费，等待中的生产者很快能入队
+            self._producers_done.wait_for(lambda: not self._producers)
+        # 已关闭且没有生产者，停止标记一定是最后一个元素
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error("积分流水写入线程未在超时前退出，仍有事件未写入")
+        else:
+            logger.info(f"积分流水写入器已关闭，累计写入 {self.stats['written']} 条")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, 'queued': self._queue.qsize()}
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch: List[LedgerEvent] = []
+            deadline = time.monotonic() + self.flush_interval
+            # 攒批：遇到 flush 屏障或停止标记时立即写出当前批次
+            while isinstance(item, LedgerEvent):
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    item = None
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    item = None
+            if batch:
+                self._write_batch(batch)
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+    def _write_batch(self, batch: List[LedgerEvent]) -> None:
+        # 调用方已取消的事件不再写入
+        batch = [event for event in batch if event.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            results = self._apply(batch)
+        except Exception as e:
+            logger.warning(f"积分流水批量写入失败，改为逐条写入: {e}")
+            self.stats['fallback_batches'] += 1
+            self._apply_one_by_one(batch)
+            return
+        self.stats['batches'] += 1
+        self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+        for event, result in zip(batch, results):
+            if result is None:
+                self.stats['rejected'] += 1
+                logger.error(f"玩家 {event.player_id} 积分不足，无法扣除 {event.points_change} 分")
+            else:
+                self.stats['written'] += 1
+            event.future.set_result(result)
+
+    def _apply(self, batch: List[LedgerEvent]) -> List[Optional[ScoreTransaction]]:
+        """一个事务内写入整批：锁定涉及的总分行，按顺序逐条做余额检查，再批量更新总分和写入流水"""
+        player_ids = sorted({event.player_id for event in batch})
+        credited = sorted({event.player_id for event in batch if event.points_change >= 0})
+        with self.db_manager.transaction() as cursor:
+            if credited:
+                cursor.execute(self.ENSURE_SCORES_SQL, (credited,))
+            cursor.execute(self.LOCK_SCORES_SQL, (player_ids,))
+            totals = {row['player_id']: row['current_total'] for row in cursor.fetchall()}
+
+            accepted = []
+            for event in batch:
+                current = totals.get(event.player_id)
+                new_total = (current or 0) + event.points_change
+                # 与 ScoreTransaction.APPLY_CHANGE_SQL 相同：没有总分记录时不能扣分，余额不能为负
+                if current is None or new_total < 0:
+                    accepted.append(None)
+                    continue
+                totals[event.player_id] = new_total
+                accepted.append((str(uuid.uuid4()), event, new_total))
+
+            rows = [entry for entry in accepted if entry is not None]
+            if not rows:
+                return [None] * len(batch)
+            changed = sorted({event.player_id for _, event, _ in rows})
+            cursor.execute(self.UPDATE_SCORES_SQL, (changed, [totals[player_id] for player_id in changed]))
+            cursor.execute(self.INSERT_TRANSACTIONS_SQL, (
+                [transaction_id for transaction_id, _, _ in rows],
+                [event.player_id for _, event, _ in rows],
+                [event.game_id for _, event, _ in rows],
+                [event.points_change for _, event, _ in rows],
+                [total for _, _, total in rows],
+            ))
+            event_times = {str(row['transaction_id']): row['event_time'] for row in cursor.fetchall()}
+
+        return [
+            None if entry is None else ScoreTransaction(
+                transaction_id=entry[0], player_id=entry[1].player_id, game_id=entry[1].game_id,
+                points_change=entry[1].points_change, current_total=entry[2], event_time=event_times[entry[0]])
+            for entry in accepted
+        ]
+
+    def _apply_one_by_one(self, batch: List[LedgerEvent]) -> None:
+        """逐条提交，保持顺序；出错的事件以异常结束其 Future"""
+        for event in batch:
+            try:
+                result = self.db_manager.execute_single_write(
+                    ScoreTransaction.APPLY_CHANGE_SQL, (event.player_id, event.points_change, event.game_id))
+            except Exception as e:
+                self.stats['failed'] += 1
+                event.future.set_exception(e)
+                continue
+            if result:
+                self.stats['written'] += 1
+                event.future.set_result(ScoreTransaction(**result))
+            else:
+                self.stats['rejected'] += 1
+                logger.error(f"玩家 {event.player_id} 积分不足，无法扣除 {event.points_change} 分")
+                event.future.set_result(None)
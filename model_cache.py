@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+import logging
+from database_config import db_config
+
+logger = logging.getLogger(__name__)
+
+class ModelCache:
+    """有界 LRU + TTL 缓存，保存模型查询返回的行
+
+    缓存的是行字典的副本，每次读取都返回新副本，调用方修改模型对象不会影响缓存。
+    只缓存查到的行，不缓存"不存在"，新建的记录无需等待过期即可被查到。
+    """
+
+    def __init__(self, name: str, max_size: int = 10000, ttl: float = 60.0):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """读取缓存行，不存在或已过期时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            expires_at, row = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return dict(row)
+
+    def put(self, key: Hashable, row: Dict[str, Any]) -> None:
+        """写入缓存行，超出容量时淘汰最久未使用的条目"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, dict(row))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """删除指定条目"""
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.stats['invalidations'] += 1
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回计数器和命中率"""
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats, name=self.name, size=len(self._entries),
+                        hit_rate=round(self.stats['hits'] / lookups, 4) if lookups else 0.0)
+
+# players 行创建后不再修改，可以长期缓存
+player_cache = ModelCache('players', db_config.model_cache_max_size, db_config.player_cache_ttl)
+# games 行的 end_time 会在结束时更新，结束/结算时主动失效，TTL 兜底
+game_cache = ModelCache('games', db_config.model_cache_max_size, db_config.game_cache_ttl)
@@ -1,6 +1,11 @@
-from typing import List, Dict, Any, Optional
+from itertools import starmap
+from typing import Iterable, List, Dict, Any, Optional, Sequence, Tuple
 from datetime import datetime
 from database_manager import db_manager
+from async_database_manager import async_db_manager
+from model_cache import player_cache, game_cache
+from pagination import decode_cursor, split_page
+from ledger_archive import ledger_archive, merge_history
 import logging
 
 logger = logging.getLogger(__name__)
@@ -8,22 +13,44 @@ logger = logging.getLogger(__name__)
 class Player:
     """玩家模型类"""
     
+    # 不使用实例 __dict__；字段顺序与查询的列顺序一致，from_rows 按位置直接构建
+    __slots__ = ('player_id', 'username', 'created_at')
+    
+    CREATE_SQL = """
+        INSERT INTO players (username, created_at) 
+        VALUES (%s, %s) 
+        RETURNING player_id, username, created_at
+        """
+    GET_BY_ID_SQL = "SELECT player_id, username, created_at FROM players WHERE player_id = %s"
+    GET_BY_USERNAME_SQL = "SELECT player_id, username, created_at FROM players WHERE username = %s"
+    CURRENT_SCORE_SQL = "SELECT current_total FROM scores WHERE player_id = %s"
+    
     def __init__(self, player_id: Optional[int] = None, username: str = "", created_at: Optional[datetime] = None):
         self.player_id = player_id
         self.username = username
         self.created_at = created_at or datetime.now()
     
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[Any]]) -> List['Player']:
+        """由按 __slots__ 顺序排列的元组行（或 asyncpg Record）批量构建，不经过逐行字典"""
+        return list(starmap(cls, rows))
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.__slots__}
+    
+    @staticmethod
+    def _cache_row(row: Dict[str, Any]) -> None:
+        """按 ID 和用户名两个键缓存玩家行"""
+        player_cache.put(('id', row['player_id']), row)
+        player_cache.put(('username', row['username']), row)
+    
     @classmethod
     def create(cls, username: str) -> Optional['Player']:
         """创建新玩家"""
-        query = """
-        INSERT INTO players (username, created_at) 
-        VALUES (%s, %s) 
-        RETURNING player_id, username, created_at
-        """
         try:
-            result = db_manager.execute_single_query(query, (username, datetime.now()))
+            result = db_manager.execute_single_write(cls.CREATE_SQL, (username, datetime.now()))
             if result:
+                cls._cache_row(result)
                 return cls(**result)
         except Exception as e:
             logger.error(f"创建玩家失败: {e}")
@@ -32,32 +59,88 @@ class Player:
     @classmethod
     def get_by_id(cls, player_id: int) -> Optional['Player']:
         """根据ID获取玩家"""
-        query = "SELECT player_id, username, created_at FROM players WHERE player_id = %s"
+        cached = player_cache.get(('id', player_id))
+        if cached is not None:
+            return cls(**cached)
+        try:
+            result = db_manager.execute_single_query(cls.GET_BY_ID_SQL, (player_id,))
+            if result:
+                cls._cache_row(result)
+                return cls(**result)
+        except Exception as e:
+            logger.error(f"获取玩家失败: {e}")
+        return None
+    
+    @classmethod
+    def get_by_username(cls, username: str, read_your_writes: bool = False) -> Optional['Player']:
+        """根据用户名获取玩家，read_your_writes=True 时查询主库（见 DatabaseManager.execute_query）"""
+        cached = player_cache.get(('username', username))
+        if cached is not None:
+            return cls(**cached)
+        try:
+            result = db_manager.execute_single_query(cls.GET_BY_USERNAME_SQL, (username,), read_your_writes)
+            if result:
+                cls._cache_row(result)
+                return cls(**result)
+        except Exception as e:
+            logger.error(f"获取玩家失败: {e}")
+        return None
+    
+    def get_current_score(self, read_your_writes: bool = False) -> int:
+        """获取玩家当前积分，刚变动过积分需要立即看到结果时传 read_your_writes=True"""
+        try:
+            result = db_manager.execute_single_query(self.CURRENT_SCORE_SQL, (self.player_id,), read_your_writes)
+            return result['current_total'] if result else 0
+        except Exception as e:
+            logger.error(f"获取玩家积分失败: {e}")
+            return 0
+    
+    @classmethod
+    async def acreate(cls, username: str) -> Optional['Player']:
+        """创建新玩家（异步）"""
+        try:
+            result = await async_db_manager.execute_single_write(cls.CREATE_SQL, (username, datetime.now()))
+            if result:
+                cls._cache_row(result)
+                return cls(**result)
+        except Exception as e:
+            logger.error(f"创建玩家失败: {e}")
+        return None
+    
+    @classmethod
+    async def aget_by_id(cls, player_id: int) -> Optional['Player']:
+        """根据ID获取玩家（异步）"""
+        cached = player_cache.get(('id', player_id))
+        if cached is not None:
+            return cls(**cached)
         try:
-            result = db_manager.execute_single_query(query, (player_id,))
+            result = await async_db_manager.execute_single_query(cls.GET_BY_ID_SQL, (player_id,))
             if result:
+                cls._cache_row(result)
                 return cls(**result)
         except Exception as e:
             logger.error(f"获取玩家失败: {e}")
         return None
     
     @classmethod
-    def get_by_username(cls, username: str) -> Optional['Player']:
-        """根据用户名获取玩家"""
-        query = "SELECT player_id, username, created_at FROM players WHERE username = %s"
+    async def aget_by_username(cls, username: str) -> Optional['Player']:
+        """根据用户名获取玩家（异步）"""
+        cached = player_cache.get(('username', username))
+        if cached is not None:
+            return cls(**cached)
         try:
-            result = db_manager.execute_single_query(query, (username,))
+            result = await async_db_manager.execute_single_query(cls.GET_BY_USERNAME_SQL, (username,))
             if result:
+                cls._cache_row(result)
                 return cls(**result)
         except Exception as e:
             logger.error(f"获取玩家失败: {e}")
         return None
     
-    def get_current_score(self) -> int:
-        """获取玩家当前积分"""
-        query = "SELECT current_total FROM scores WHERE player_id = %s"
+    async def aget_current_score(self) -> int:
+        """获取玩家当前积分（异步）"""
         try:
-            result = db_manager.execute_single_query(query, (self.player_id,))
+            result = await async_db_manager.execute_single_query(self.CURRENT_SCORE_SQL, (self.player_id,))
             return result['current_total'] if result else 0
         except Exception as e:
             logger.error(f"获取玩家积分失败: {e}")
@@ -66,6 +149,45 @@ class Player:
 class Game:
     """游戏模型类"""
     
+    __slots__ = ('game_id', 'game_type', 'start_time', 'end_time')
+    
+    CREATE_SQL = """
+        INSERT INTO games (game_type, start_time) 
+        VALUES (%s, %s) 
+        RETURNING game_id, game_type, start_time, end_time
+        """
+    GET_BY_ID_SQL = "SELECT game_id, game_type, start_time, end_time FROM games WHERE game_id = %s"
+    END_GAME_SQL = "UPDATE games SET end_time = %s WHERE game_id = %s"
+    # 未指定 initial_score 时与 CREATE_BATCH_SQL 相同，取玩家当前的总分
+    ADD_PARTICIPANT_SQL = """
+        INSERT INTO game_participants (game_id, player_id, initial_score, position)
+        SELECT p.game_id, p.player_id, COALESCE(p.initial_score, sc.current_total, 0), p.position
+        FROM (VALUES (%s::bigint, %s::bigint, %s::integer, %s::smallint)) AS p(game_id, player_id, initial_score, position)
+        LEFT JOIN scores sc ON sc.player_id = p.player_id
+        """
+    # 单条语句批量创建房间：预分配 game_id，多行插入 games 和 game_participants；
+    # 未指定 initial_score 时与 join_game 相同，取玩家开局时的总分，结算回填的 final_score 为结束时的总分
+    CREATE_BATCH_SQL = """
+        WITH rooms AS (
+            SELECT nextval(pg_get_serial_sequence('games', 'game_id')) AS game_id, r.game_type, r.room_no
+            FROM unnest(%s::varchar[]) WITH ORDINALITY AS r(game_type, room_no)
+        ), new_games AS (
+            INSERT INTO games (game_id, game_type, start_time)
+            SELECT game_id, game_type, NOW() FROM rooms
+            RETURNING game_id, game_type, start_time, end_time
+        ), seats AS (
+            INSERT INTO game_participants (game_id, player_id, initial_score, position)
+            SELECT rooms.game_id, s.player_id, COALESCE(s.initial_score, sc.current_total, 0), s.position
+            FROM unnest(%s::bigint[], %s::bigint[], %s::integer[], %s::smallint[])
+                AS s(room_no, player_id, initial_score, position)
+            JOIN rooms ON rooms.room_no = s.room_no
+            LEFT JOIN scores sc ON sc.player_id = s.player_id
+        )
+        SELECT g.game_id, g.game_type, g.start_time, g.end_time
+        FROM new_games g JOIN rooms USING (game_id)
+        ORDER BY rooms.room_no
+        """
+    
     def __init__(self, game_id: Optional[int] = None, game_type: str = "", 
                  start_time: Optional[datetime] = None, end_time: Optional[datetime] = None):
         self.game_id = game_id
@@ -73,17 +195,21 @@ class Game:
         self.start_time = start_time or datetime.now()
         self.end_time = end_time
     
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[Any]]) -> List['Game']:
+        """由按 __slots__ 顺序排列的元组行批量构建"""
+        return list(starmap(cls, rows))
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.__slots__}
+    
     @classmethod
     def create(cls, game_type: str) -> Optional['Game']:
         """创建新游戏"""
-        query = """
-        INSERT INTO games (game_type, start_time) 
-        VALUES (%s, %s) 
-        RETURNING game_id, game_type, start_time, end_time
-        """
         try:
-            result = db_manager.execute_single_query(query, (game_type, datetime.now()))
+            result = db_manager.execute_single_write(cls.CREATE_SQL, (game_type, datetime.now()))
             if result:
+                game_cache.put(result['game_id'], result)
                 return cls(**result)
         except Exception as e:
             logger.error(f"创建游戏失败: {e}")
@@ -92,10 +218,13 @@ class Game:
     @classmethod
     def get_by_id(cls, game_id: int) -> Optional['Game']:
         """根据ID获取游戏"""
-        query = "SELECT game_id, game_type, start_time, end_time FROM games WHERE game_id = %s"
+        cached = game_cache.get(game_id)
+        if cached is not None:
+            return cls(**cached)
         try:
-            result = db_manager.execute_single_query(query, (game_id,))
+            result = db_manager.execute_single_query(cls.GET_BY_ID_SQL, (game_id,))
             if result:
+                game_cache.put(game_id, result)
                 return cls(**result)
         except Exception as e:
             logger.error(f"获取游戏失败: {e}")
@@ -103,9 +232,9 @@ class Game:
     
     def end_game(self) -> bool:
         """结束游戏"""
-        query = "UPDATE games SET end_time = %s WHERE game_id = %s"
         try:
-            affected_rows = db_manager.execute_update(query, (datetime.now(), self.game_id))
+            affected_rows = db_manager.execute_update(self.END_GAME_SQL, (datetime.now(), self.game_id))
+            game_cache.invalidate(self.game_id)
             if affected_rows > 0:
                 self.end_time = datetime.now()
                 return True
@@ -113,22 +242,165 @@ class Game:
             logger.error(f"结束游戏失败: {e}")
         return False
     
-    def add_participant(self, player_id: int, initial_score: int = 0, position: Optional[int] = None) -> bool:
+    def add_participant(self, player_id: int, initial_score: Optional[int] = None, position: Optional[int] = None) -> bool:
         """添加游戏参与者"""
-        query = """
-        INSERT INTO game_participants (game_id, player_id, initial_score, position) 
-        VALUES (%s, %s, %s, %s)
-        """
         try:
-            db_manager.execute_insert(query, (self.game_id, player_id, initial_score, position))
+            db_manager.execute_insert(self.ADD_PARTICIPANT_SQL, (self.game_id, player_id, initial_score, position))
+            return True
+        except Exception as e:
+            logger.error(f"添加游戏参与者失败: {e}")
+            return False
+    
+    @classmethod
+    def _batch_params(cls, rooms: List[Tuple[str, List[int], Optional[List[int]]]]) -> Tuple:
+        """将房间列表展开为按列组织的数组参数，座位号从 1 开始"""
+        game_types, room_nos, player_ids, initial_scores, positions = [], [], [], [], []
+        for room_no, (game_type, room_player_ids, room_initial_scores) in enumerate(rooms, 1):
+            game_types.append(game_type)
+            room_initial_scores = room_initial_scores or []
+            for i, player_id in enumerate(room_player_ids):
+                room_nos.append(room_no)
+                player_ids.append(player_id)
+                initial_scores.append(room_initial_scores[i] if i < len(room_initial_scores) else None)
+                positions.append(i + 1)
+        return (game_types, room_nos, player_ids, initial_scores, positions)
+    
+    @classmethod
+    def create_batch(cls, rooms: List[Tuple[str, List[int], Optional[List[int]]]]) -> List['Game']:
+        """批量创建房间及其参与者，一条语句、一次提交；任一房间失败则全部回滚"""
+        if not rooms:
+            return []
+        try:
+            with db_manager.transaction(cursor_factory=None) as cursor:
+                cursor.execute(cls.CREATE_BATCH_SQL, cls._batch_params(rooms))
+                rows = cursor.fetchall()
+            for row in rows:
+                game_cache.put(row[0], dict(zip(cls.__slots__, row)))
+            return cls.from_rows(rows)
+        except Exception as e:
+            logger.error(f"批量创建游戏失败: {e}")
+            return []
+    
+    @classmethod
+    def create_with_participants(cls, game_type: str, player_ids: List[int],
+                                 initial_scores: Optional[List[int]] = None) -> Optional['Game']:
+        """创建游戏并在同一事务中加入所有参与者"""
+        games = cls.create_batch([(game_type, player_ids, initial_scores)])
+        return games[0] if games else None
+    
+    @classmethod
+    async def acreate(cls, game_type: str) -> Optional['Game']:
+        """创建新游戏（异步）"""
+        try:
+            result = await async_db_manager.execute_single_write(cls.CREATE_SQL, (game_type, datetime.now()))
+            if result:
+                game_cache.put(result['game_id'], result)
+                return cls(**result)
+        except Exception as e:
+            logger.error(f"创建游戏失败: {e}")
+        return None
+    
+    @classmethod
+    async def aget_by_id(cls, game_id: int) -> Optional['Game']:
+        """根据ID获取游戏（异步）"""
+        cached = game_cache.get(game_id)
+        if cached is not None:
+            return cls(**cached)
+        try:
+            result = await async_db_manager.execute_single_query(cls.GET_BY_ID_SQL, (game_id,))
+            if result:
+                game_cache.put(game_id, result)
+                return cls(**result)
+        except Exception as e:
+            logger.error(f"获取游戏失败: {e}")
+        return None
+    
+    async def aend_game(self) -> bool:
+        """结束游戏（异步）"""
+        try:
+            affected_rows = await async_db_manager.execute_update(self.END_GAME_SQL, (datetime.now(), self.game_id))
+            game_cache.invalidate(self.game_id)
+            if affected_rows > 0:
+                self.end_time = datetime.now()
+                return True
+        except Exception as e:
+            logger.error(f"结束游戏失败: {e}")
+        return False
+    
+    async def aadd_participant(self, player_id: int, initial_score: Optional[int] = None, position: Optional[int] = None) -> bool:
+        """添加游戏参与者（异步）"""
+        try:
+            await async_db_manager.execute_insert(self.ADD_PARTICIPANT_SQL, (self.game_id, player_id, initial_score, position))
             return True
         except Exception as e:
             logger.error(f"添加游戏参与者失败: {e}")
             return False
+    
+    @classmethod
+    async def acreate_batch(cls, rooms: List[Tuple[str, List[int], Optional[List[int]]]]) -> List['Game']:
+        """批量创建房间及其参与者（异步）"""
+        if not rooms:
+            return []
+        try:
+            rows = await async_db_manager.execute_query(cls.CREATE_BATCH_SQL, cls._batch_params(rooms))
+            for row in rows:
+                game_cache.put(row['game_id'], row)
+            return [cls(**row) for row in rows]
+        except Exception as e:
+            logger.error(f"批量创建游戏失败: {e}")
+            return []
+    
+    @classmethod
+    async def acreate_with_participants(cls, game_type: str, player_ids: List[int],
+                                        initial_scores: Optional[List[int]] = None) -> Optional['Game']:
+        """创建游戏并在同一事务中加入所有参与者（异步）"""
+        games = await cls.acreate_batch([(game_type, player_ids, initial_scores)])
+        return games[0] if games else None
 
 class ScoreTransaction:
     """积分交易模型类"""
     
+    __slots__ = ('transaction_id', 'player_id', 'game_id', 'points_change', 'current_total', 'event_time')
+    
+    # 单条语句完成余额检查、积分更新和流水写入：
+    # ON CONFLICT DO UPDATE 对 scores 行加锁，并发变更按行串行化；余额不足时不返回任何行
+    APPLY_CHANGE_SQL = """
+        WITH change AS (
+            SELECT %s::bigint AS player_id, %s::integer AS delta, %s::bigint AS game_id
+        ), updated AS (
+            INSERT INTO scores (player_id, current_total, last_updated)
+            SELECT c.player_id, GREATEST(c.delta, 0), NOW()
+            FROM change c
+            WHERE c.delta >= 0 OR EXISTS (SELECT 1 FROM scores s WHERE s.player_id = c.player_id)
+            ON CONFLICT (player_id) DO UPDATE
+                SET current_total = scores.current_total + (SELECT delta FROM change),
+                    last_updated = EXCLUDED.last_updated
+                WHERE scores.current_total + (SELECT delta FROM change) >= 0
+            RETURNING player_id, current_total
+        )
+        INSERT INTO score_transactions (player_id, game_id, points_change, current_total, event_time)
+        SELECT u.player_id, c.game_id, c.delta, u.current_total, NOW()
+        FROM updated u CROSS JOIN change c
+        RETURNING transaction_id, player_id, game_id, points_change, current_total, event_time
+        """
+    PLAYER_HISTORY_SQL = """
+        SELECT transaction_id, player_id, game_id, points_change, current_total, event_time 
+        FROM score_transactions 
+        WHERE player_id = %s 
+        ORDER BY event_time DESC, transaction_id DESC 
+        LIMIT %s
+        """
+    # 键集分页：从上一页最后一行 (event_time, transaction_id) 之后继续，
+    # 走 idx_score_transactions_player_time_id 索引范围扫描，翻页深度不影响代价
+    PLAYER_HISTORY_AFTER_SQL = """
+        SELECT transaction_id, player_id, game_id, points_change, current_total, event_time 
+        FROM score_transactions 
+        WHERE player_id = %s AND (event_time, transaction_id) < (%s::timestamptz, %s::uuid)
+        ORDER BY event_time DESC, transaction_id DESC 
+        LIMIT %s
+        """
+    PAGE_KEY = ('event_time', 'transaction_id')
+    
     def __init__(self, transaction_id: Optional[str] = None, player_id: int = 0, 
                  game_id: Optional[int] = None, points_change: int = 0, 
                  current_total: int = 0, event_time: Optional[datetime] = None):
@@ -139,65 +411,112 @@ class ScoreTransaction:
         self.current_total = current_total
         self.event_time = event_time or datetime.now()
     
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[Any]]) -> List['ScoreTransaction']:
+        """由按 __slots__ 顺序排列的元组行批量构建，积分历史等大结果集使用"""
+        return list(starmap(cls, rows))
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.__slots__}
+    
+    @classmethod
+    def _apply_change_params(cls, player_id: int, points_change: int, game_id: Optional[int]) -> Tuple:
+        return (player_id, points_change, game_id)
+    
     @classmethod
     def create(cls, player_id: int, points_change: int, game_id: Optional[int] = None) -> Optional['ScoreTransaction']:
-        """创建积分交易"""
-        # 首先获取玩家当前积分
-        current_score = Player.get_by_id(player_id).get_current_score() if player_id else 0
-        new_total = current_score + points_change
-        
-        # 检查积分是否足够（如果是扣分）
-        if new_total < 0:
+        """创建积分交易，一次往返内完成余额检查、流水写入和总分更新"""
+        try:
+            result = db_manager.execute_single_write(
+                cls.APPLY_CHANGE_SQL, cls._apply_change_params(player_id, points_change, game_id)
+            )
+            if result:
+                return cls(**result)
             logger.error(f"玩家 {player_id} 积分不足，无法扣除 {points_change} 分")
-            return None
-        
-        # 开始事务
-        queries = [
-            # 插入积分交易记录
-            ("""
-            INSERT INTO score_transactions (player_id, game_id, points_change, current_total, event_time) 
-            VALUES (%s, %s, %s, %s, %s) 
-            RETURNING transaction_id
-            """, (player_id, game_id, points_change, new_total, datetime.now())),
-            
-            # 更新玩家总积分
-            ("UPDATE scores SET current_total = %s, last_updated = %s WHERE player_id = %s", 
-             (new_total, datetime.now(), player_id))
-        ]
-        
-        # 如果玩家没有积分记录，先创建
-        if current_score == 0:
-            queries.insert(1, (
-                "INSERT INTO scores (player_id, current_total, last_updated) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
-                (player_id, new_total, datetime.now())
-            ))
-        
-        try:
-            if db_manager.execute_transaction(queries):
-                return cls(
-                    player_id=player_id,
-                    game_id=game_id,
-                    points_change=points_change,
-                    current_total=new_total,
-                    event_time=datetime.now()
-                )
         except Exception as e:
             logger.error(f"创建积分交易失败: {e}")
         return None
     
     @classmethod
     def get_player_history(cls, player_id: int, limit: int = 50) -> List['ScoreTransaction']:
-        """获取玩家积分历史"""
-        query = """
-        SELECT transaction_id, player_id, game_id, points_change, current_total, event_time 
-        FROM score_transactions 
-        WHERE player_id = %s 
-        ORDER BY event_time DESC 
-        LIMIT %s
-        """
+        """获取玩家积分历史，在线数据不足 limit 条时从归档中补齐"""
+        try:
+            history = cls.from_rows(db_manager.execute_query_tuples(cls.PLAYER_HISTORY_SQL, (player_id, limit)))
+            if ledger_archive.needed(ledger_archive.horizon(), live=history, limit=limit):
+                live = [transaction.to_dict() for transaction in history]
+                results = merge_history(live, ledger_archive.read_player(player_id, limit=limit), limit)
+                return [cls(**result) for result in results]
+            return history
+        except Exception as e:
+            logger.error(f"获取玩家积分历史失败: {e}")
+            return []
+    
+    @classmethod
+    def _history_page_query(cls, player_id: int, limit: int, cursor: Optional[str]) -> Tuple[str, Tuple]:
+        """按是否带游标选择首页或后续页的查询，多取一行用于判断是否还有下一页"""
+        if cursor is None:
+            return cls.PLAYER_HISTORY_SQL, (player_id, limit + 1)
+        event_time, transaction_id = decode_cursor(cursor, 2)
+        return cls.PLAYER_HISTORY_AFTER_SQL, (player_id, event_time, str(transaction_id), limit + 1)
+    
+    @classmethod
+    def get_player_history_page(cls, player_id: int, limit: int = 50,
+                                cursor: Optional[str] = None) -> Tuple[List['ScoreTransaction'], Optional[str]]:
+        """分页获取玩家积分历史（新到旧），返回本页记录和下一页游标（没有更多时为 None）"""
         try:
-            results = db_manager.execute_query(query, (player_id, limit))
-            return [cls(**result) for result in results]
+            query, params = cls._history_page_query(player_id, limit, cursor)
+            rows, next_cursor = split_page(db_manager.execute_query(query, params), limit, cls.PAGE_KEY)
+            return [cls(**row) for row in rows], next_cursor
         except Exception as e:
             logger.error(f"获取玩家积分历史失败: {e}")
-            return [] 
\ No newline at end of file
+            return [], None
+    
+    @classmethod
+    async def acreate(cls, player_id: int, points_change: int, game_id: Optional[int] = None) -> Optional['ScoreTransaction']:
+        """创建积分交易（异步）"""
+        try:
+            result = await async_db_manager.execute_single_write(
+                cls.APPLY_CHANGE_SQL, cls._apply_change_params(player_id, points_change, game_id)
+            )
+            if result:
+                return cls(**result)
+            logger.error(f"玩家 {player_id} 积分不足，无法扣除 {points_change} 分")
+        except Exception as e:
+            logger.error(f"创建积分交易失败: {e}")
+        return None
+    
+    @classmethod
+    async def aget_player_history(cls, player_id: int, limit: int = 50) -> List['ScoreTransaction']:
+        """获取玩家积分历史（异步）"""
+        try:
+            history = cls.from_rows(await async_db_manager.execute_query_tuples(cls.PLAYER_HISTORY_SQL, (player_id, limit)))
+            if ledger_archive.needed(await ledger_archive.ahorizon(), live=history, limit=limit):
+                live = [transaction.to_dict() for transaction in history]
+                results = merge_history(live, await ledger_archive.aread_player(player_id, limit=limit), limit)
+                return [cls(**result) for result in results]
+            return history
+        except Exception as e:
+            logger.error(f"获取玩家积分历史失败: {e}")
+            return []
+    
+    @classmethod
+    async def aget_player_history_page(cls, player_id: int, limit: int = 50,
+                                       cursor: Optional[str] = None) -> Tuple[List['ScoreTransaction'], Optional[str]]:
+        """分页获取玩家积分历史（异步）"""
+        try:
+            query, params = cls._history_page_query(player_id, limit, cursor)
+            rows, next_cursor = split_page(await async_db_manager.execute_query(query, params), limit, cls.PAGE_KEY)
+            return [cls(**row) for row in rows], next_cursor
+        except Exception as e:
+            logger.error(f"获取玩家积分历史失败: {e}")
+            return [], None
+
+# 热点语句注册为服务端预备语句，每条连接只解析和规划一次
+db_manager.register_prepared('player_get_by_id', Player.GET_BY_ID_SQL)
+db_manager.register_prepared('player_get_by_username', Player.GET_BY_USERNAME_SQL)
+db_manager.register_prepared('player_current_score', Player.CURRENT_SCORE_SQL)
+db_manager.register_prepared('game_get_by_id', Game.GET_BY_ID_SQL)
+db_manager.register_prepared('game_add_participant', Game.ADD_PARTICIPANT_SQL)
+db_manager.register_prepared('score_apply_change', ScoreTransaction.APPLY_CHANGE_SQL)
+db_manager.register_prepared('score_player_history', ScoreTransaction.PLAYER_HISTORY_SQL)
+db_manager.register_prepared('score_player_history_after', ScoreTransaction.PLAYER_HISTORY_AFTER_SQL)
@@ -0,0 +1,47 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+class InvalidCursorError(ValueError):
+    """分页游标无法解析"""
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, uuid.UUID):
+        return {'uuid': str(value)}
+    return value
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'uuid' in value:
+            return uuid.UUID(value['uuid'])
+    return value
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """将最后一行的排序键编码为不透明的游标字符串"""
+    payload = json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token: str, size: int) -> Tuple[Any, ...]:
+    """解析游标，返回排序键元组；格式不对时抛出 InvalidCursorError"""
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = [_decode_value(value) for value in json.loads(payload)]
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"无效的分页游标: {token}") from e
+    if len(values) != size:
+        raise InvalidCursorError(f"无效的分页游标: {token}")
+    return tuple(values)
+
+def split_page(rows: List[Any], limit: int, key: Sequence[str]) -> Tuple[List[Any], Optional[str]]:
+    """rows 按 limit + 1 条查询；多出一条说明还有下一页，用本页最后一行的排序键生成游标"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([last[column] for column in key])
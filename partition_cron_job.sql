@@ -3,6 +3,8 @@
 -- ========================================
 
 -- 注意：需要安装 pg_cron 扩展
+-- 没有 pg_cron 时可改用系统 cron 调度 partition_manager.py（可重复执行，带咨询锁，会修复分区索引）：
+--   0 2 * * * python partition_manager.py maintain --months-ahead 3
 -- CREATE EXTENSION IF NOT EXISTS pg_cron;
 
 -- 1. 每月自动创建新分区的任务
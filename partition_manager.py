@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+score_transactions 分区管理工具
+预建未来分区、修复分区索引、输出各分区行数和大小；可重复执行，适合由 cron 定时调度
+"""
+
+import argparse
+import json
+import re
+import sys
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import psycopg2
+from psycopg2 import extensions, sql
+import logging
+from database_config import db_config
+
+logger = logging.getLogger(__name__)
+
+_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+_INDEXDEF_RE = re.compile(r"^CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ (USING .*)$")
+
+def parse_partition_bound(bound: Optional[str]) -> Optional[Tuple[datetime, datetime]]:
+    """解析 pg_get_expr(relpartbound) 的范围边界，DEFAULT 或 MINVALUE/MAXVALUE 分区返回 None"""
+    match = _BOUND_RE.search(bound or '')
+    if not match:
+        return None
+    start, end = (datetime.fromisoformat(value) for value in match.groups())
+    if start.tzinfo is None:
+        start, end = start.replace(tzinfo=timezone.utc), end.replace(tzinfo=timezone.utc)
+    return start, end
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def _next_month(day: date) -> date:
+    return day.replace(year=day.year + 1, month=1, day=1) if day.month == 12 else day.replace(month=day.month + 1, day=1)
+
+class PartitionManager:
+    """滚动维护按 event_time 范围分区的表
+
+    默认按月分区（命名 score_transactions_YYYY_MM，与 create_monthly_partition() 一致），
+    当最近一个月分区的估算行数超过 daily_threshold，或月份列在 daily_months 中时，改为按日分区
+    （score_transactions_YYYY_MM_DD）。所有操作都检查已有分区，重复执行不会报错或重复创建。
+    """
+
+    PARTITIONS_SQL = """
+        SELECT c.relname AS name,
+               pg_get_expr(c.relpartbound, c.oid) AS bound,
+               c.reltuples::bigint AS estimated_rows,
+               pg_total_relation_size(c.oid) AS total_bytes
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+        """
+    PARENT_INDEXES_SQL = """
+        SELECT ic.relname AS name, pg_get_indexdef(i.indexrelid) AS definition
+        FROM pg_index i
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass
+        """
+    # 分区上已挂接到父索引的子索引
+    ATTACHED_INDEXES_SQL = """
+        SELECT pi.relname AS parent_index, t.relname AS partition, ci.relname AS index_name, x.indisvalid AS valid
+        FROM pg_inherits inh
+        JOIN pg_class pi ON pi.oid = inh.inhparent
+        JOIN pg_class ci ON ci.oid = inh.inhrelid
+        JOIN pg_index x ON x.indexrelid = ci.oid
+        JOIN pg_class t ON t.oid = x.indrelid
+        JOIN pg_index px ON px.indexrelid = pi.oid
+        WHERE px.indrelid = %s::regclass
+        """
+    CREATE_PARTITION_SQL = "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)"
+    # DEFAULT 分区已有该范围的数据时：先建独立表，把数据从 DEFAULT 分区搬过去，再挂接为分区
+    DEFAULT_HAS_ROWS_SQL = "SELECT EXISTS (SELECT 1 FROM {} WHERE event_time >= %s AND event_time < %s)"
+    CREATE_DETACHED_SQL = "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    MOVE_FROM_DEFAULT_SQL = """
+        WITH moved AS (
+            DELETE FROM {} WHERE event_time >= %s AND event_time < %s RETURNING *
+        )
+        INSERT INTO {} SELECT * FROM moved
+        """
+    ATTACH_PARTITION_SQL = "ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)"
+    ADVISORY_LOCK_SQL = "SELECT pg_try_advisory_lock(hashtext(%s))"
+    ADVISORY_UNLOCK_SQL = "SELECT pg_advisory_unlock(hashtext(%s))"
+
+    def __init__(self, table: str = 'score_transactions'):
+        self.table = table
+        self._conn = None
+
+    # ---------- 连接与锁 ----------
+
+    def connect(self):
+        """使用独立的自动提交连接，每条 DDL 单独生效，CREATE INDEX CONCURRENTLY 也可以执行"""
+        if self._conn is None or self._conn.closed:
+            conn = psycopg2.connect(**db_config.get_connection_params())
+            conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                # 分区边界统一按 UTC 零点划分，与 bulk_loader 自动建分区的口径一致
+                cursor.execute("SET TIME ZONE 'UTC'")
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None and not self._conn.closed:
+            self._conn.close()
+        self._conn = None
+
+    def _lock_name(self) -> str:
+        return f"partition_manager:{self.table}"
+
+    def acquire_lock(self) -> bool:
+        """获取会话级咨询锁，防止多个调度实例同时维护同一张表"""
+        with self.connect().cursor() as cursor:
+            cursor.execute(self.ADVISORY_LOCK_SQL, (self._lock_name(),))
+            return cursor.fetchone()[0]
+
+    def release_lock(self) -> None:
+        with self.connect().cursor() as cursor:
+            cursor.execute(self.ADVISORY_UNLOCK_SQL, (self._lock_name(),))
+
+    # ---------- 查询 ----------
+
+    def list_partitions(self, exact_counts: bool = False) -> List[Dict[str, Any]]:
+        """列出所有分区的边界、行数（默认为统计信息估算值）和总大小"""
+        conn = self.connect()
+        with conn.cursor() as cursor:
+            cursor.execute(self.PARTITIONS_SQL, (self.table,))
+            rows = cursor.fetchall()
+            partitions = []
+            for name, bound, estimated_rows, total_bytes in rows:
+                bounds = parse_partition_bound(bound)
+                info = {
+                    'name': name,
+                    'from': bounds[0].isoformat() if bounds else None,
+                    'to': bounds[1].isoformat() if bounds else None,
+                    'is_default': bound == 'DEFAULT',
+                    'rows': max(estimated_rows, 0),
+                    'rows_exact': False,
+                    'total_bytes': total_bytes,
+                }
+                if exact_counts:
+                    cursor.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(name)))
+                    info['rows'] = cursor.fetchone()[0]
+                    info['rows_exact'] = True
+                partitions.append(info)
+        return partitions
+
+    # ---------- 分区创建 ----------
+
+    def _partition_name(self, start: date, daily: bool) -> str:
+        return f"{self.table}_{start:%Y_%m_%d}" if daily else f"{self.table}_{start:%Y_%m}"
+
+    def _create_partition(self, name: str, start: datetime, end: datetime,
+                          default_partition: Optional[str] = None) -> Optional[str]:
+        """创建分区，返回 None 表示成功，否则返回错误信息"""
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                if default_partition:
+                    cursor.execute(
+                        sql.SQL(self.DEFAULT_HAS_ROWS_SQL).format(sql.Identifier(default_partition)), (start, end))
+                    if cursor.fetchone()[0]:
+                        return self._create_from_default(name, start, end, default_partition)
+                cursor.execute(
+                    sql.SQL(self.CREATE_PARTITION_SQL).format(sql.Identifier(name), sql.Identifier(self.table)),
+                    (start, end),
+                )
+            logger.info(f"已创建分区 {name} [{start:%Y-%m-%d}, {end:%Y-%m-%d})")
+            return None
+        except psycopg2.Error as e:
+            logger.error(f"创建分区 {name} 失败: {e}")
+            return str(e).strip()
+
+    def _create_from_default(self, name: str, start: datetime, end: datetime, default_partition: str) -> None:
+        """在一个事务中建表、从 DEFAULT 分区搬移数据并挂接，失败时整体回滚"""
+        conn = self.connect()
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL(self.CREATE_DETACHED_SQL).format(
+                    sql.Identifier(name), sql.Identifier(self.table)))
+                cursor.execute(sql.SQL(self.MOVE_FROM_DEFAULT_SQL).format(
+                    sql.Identifier(default_partition), sql.Identifier(name)), (start, end))
+                moved = cursor.rowcount
+                cursor.execute(sql.SQL(self.ATTACH_PARTITION_SQL).format(
+                    sql.Identifier(self.table), sql.Identifier(name)), (start, end))
+            conn.commit()
+            logger.info(f"已创建分区 {name} [{start:%Y-%m-%d}, {end:%Y-%m-%d})，并从 {default_partition} 迁入 {moved} 行")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+
+    def _high_volume(self, partitions: List[Dict[str, Any]], today: date, daily_threshold: Optional[int]) -> bool:
+        """以已开始的最近一个月分区的行数判断写入量（未来分区还是空的）"""
+        if not daily_threshold:
+            return False
+        monthly = [
+            p for p in partitions
+            if p['from'] and p['from'][:10] <= today.isoformat()
+            and re.fullmatch(rf"{re.escape(self.table)}_\d{{4}}_\d{{2}}", p['name'])
+        ]
+        if not monthly:
+            return False
+        return max(monthly, key=lambda p: p['from'])['rows'] >= daily_threshold
+
+    def ensure_partitions(self, months_ahead: int = 3, daily_months: Tuple[str, ...] = (),
+                          daily_threshold: Optional[int] = None, today: Optional[date] = None) -> Dict[str, List[str]]:
+        """确保当月及之后 months_ahead 个月都有分区，已被现有分区覆盖的时间段跳过"""
+        today = today or datetime.now(timezone.utc).date()
+        partitions = self.list_partitions()
+        ranges = sorted(
+            (datetime.fromisoformat(p['from']), datetime.fromisoformat(p['to']), p['name'])
+            for p in partitions if p['from']
+        )
+        default_partition = next((p['name'] for p in partitions if p['is_default']), None)
+        high_volume = self._high_volume(partitions, today, daily_threshold)
+        result: Dict[str, List[str]] = {'created': [], 'existing': [], 'errors': []}
+
+        month = _month_start(today)
+        for _ in range(months_ahead + 1):
+            end_of_month = _next_month(month)
+            daily = high_volume or f"{month:%Y-%m}" in daily_months
+            if daily:
+                periods = []
+                day = month
+                while day < end_of_month:
+                    periods.append((day, day + timedelta(days=1)))
+                    day += timedelta(days=1)
+            else:
+                periods = [(month, end_of_month)]
+
+            for start, end in periods:
+                name = self._partition_name(start, daily)
+                start_ts = datetime.combine(start, datetime.min.time(), timezone.utc)
+                end_ts = datetime.combine(end, datetime.min.time(), timezone.utc)
+                overlapping = [r[2] for r in ranges if r[0] < end_ts and start_ts < r[1]]
+                if overlapping:
+                    result['existing'].extend(n for n in overlapping if n not in result['existing'])
+                    continue
+                error = self._create_partition(name, start_ts, end_ts, default_partition)
+                if error:
+                    result['errors'].append(f"{name}: {error}")
+                else:
+                    result['created'].append(name)
+                    ranges.append((start_ts, end_ts, name))
+            month = end_of_month
+        return result
+
+    def split_month_to_daily(self, month: str) -> Dict[str, List[str]]:
+        """把一个尚无数据的月分区替换为按日分区（month 形如 2024-07）；已有数据的月分区不做修改"""
+        start = datetime.strptime(month, '%Y-%m').date()
+        name = self._partition_name(start, daily=False)
+        if not self.acquire_lock():
+            return {'created': [], 'existing': [], 'errors': [f"{self.table} 的分区维护正在其他进程中执行"]}
+        try:
+            with self.connect().cursor() as cursor:
+                cursor.execute("SELECT to_regclass(%s)", (name,))
+                if cursor.fetchone()[0] is not None:
+                    cursor.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {})").format(sql.Identifier(name)))
+                    if cursor.fetchone()[0]:
+                        return {'created': [], 'existing': [name], 'errors': [f"{name}: 分区已有数据，不能拆分"]}
+                    cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+                    logger.info(f"已删除空的月分区 {name}")
+            return self.ensure_partitions(months_ahead=0, daily_months=(month,), today=start)
+        finally:
+            self.release_lock()
+
+    # ---------- 索引一致性 ----------
+
+    def ensure_indexes(self, concurrently: bool = True) -> Dict[str, List[str]]:
+        """为缺少父表分区索引的分区补建索引并挂接；无效（INVALID）的子索引重建"""
+        conn = self.connect()
+        result: Dict[str, List[str]] = {'created': [], 'rebuilt': [], 'errors': []}
+        with conn.cursor() as cursor:
+            cursor.execute(self.PARENT_INDEXES_SQL, (self.table,))
+            parent_indexes = cursor.fetchall()
+            cursor.execute(self.ATTACHED_INDEXES_SQL, (self.table,))
+            attached = {(row[0], row[1]): (row[2], row[3]) for row in cursor.fetchall()}
+        partitions = [p['name'] for p in self.list_partitions()]
+
+        for parent_index, definition in parent_indexes:
+            match = _INDEXDEF_RE.match(definition)
+            if not match:
+                continue
+            unique, using = match.groups()
+            for partition in partitions:
+                existing = attached.get((parent_index, partition))
+                if existing and existing[1]:
+                    continue
+                try:
+                    if existing:
+                        self._execute(sql.SQL("REINDEX INDEX {}{}").format(
+                            sql.SQL("CONCURRENTLY ") if concurrently else sql.SQL(''), sql.Identifier(existing[0])))
+                        result['rebuilt'].append(existing[0])
+                        continue
+                    index_name = f"{partition}_{parent_index}"[:63]
+                    self._execute(sql.SQL("CREATE {}INDEX {}IF NOT EXISTS {} ON {} {}").format(
+                        sql.SQL(unique or ''),
+                        sql.SQL("CONCURRENTLY ") if concurrently else sql.SQL(''),
+                        sql.Identifier(index_name), sql.Identifier(partition), sql.SQL(using)))
+                    self._execute(sql.SQL("ALTER INDEX {} ATTACH PARTITION {}").format(
+                        sql.Identifier(parent_index), sql.Identifier(index_name)))
+                    result['created'].append(index_name)
+                    logger.info(f"已为分区 {partition} 补建索引 {index_name}")
+                except psycopg2.Error as e:
+                    logger.error(f"修复分区 {partition} 的索引 {parent_index} 失败: {e}")
+                    result['errors'].append(f"{partition}.{parent_index}: {str(e).strip()}")
+        return result
+
+    def _execute(self, statement) -> None:
+        with self.connect().cursor() as cursor:
+            cursor.execute(statement)
+
+    # ---------- 组合入口 ----------
+
+    def maintain(self, months_ahead: int = 3, daily_months: Tuple[str, ...] = (),
+                 daily_threshold: Optional[int] = None, concurrently: bool = True) -> Dict[str, Any]:
+        """一次完整维护：预建分区、修复索引；拿不到咨询锁时直接返回"""
+        if not self.acquire_lock():
+            logger.warning(f"{self.table} 的分区维护正在其他进程中执行，本次跳过")
+            return {'skipped': True}
+        try:
+            return {
+                'skipped': False,
+                'partitions': self.ensure_partitions(months_ahead, daily_months, daily_threshold),
+                'indexes': self.ensure_indexes(concurrently),
+            }
+        finally:
+            self.release_lock()
+
+def _format_bytes(size: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def print_report(partitions: List[Dict[str, Any]]) -> None:
+    """打印分区报告"""
+    print(f"{'分区':<36} {'起始':<26} {'结束':<26} {'行数':>12} {'大小':>10}")
+    for p in partitions:
+        rows = f"{p['rows']}" if p['rows_exact'] else f"~{p['rows']}"
+        start = 'DEFAULT' if p['is_default'] else (p['from'] or '')
+        print(f"{p['name']:<36} {start:<26} {p['to'] or '':<26} {rows:>12} {_format_bytes(p['total_bytes']):>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="score_transactions 分区管理")
+    parser.add_argument('--table', default='score_transactions')
+    subparsers = parser.add_subparsers(dest='command')
+
+    maintain_parser = subparsers.add_parser('maintain', help="预建未来分区并修复索引（默认命令）")
+    maintain_parser.add_argument('--months-ahead', type=int, default=3, help="除当月外预建的月数")
+    maintain_parser.add_argument('--daily-month', action='append', default=[], help="按日分区的月份（YYYY-MM，可重复）")
+    maintain_parser.add_argument('--daily-threshold', type=int, help="最近月分区行数达到该值后，新月份改为按日分区")
+    maintain_parser.add_argument('--no-concurrently', action='store_true', help="补建索引时不使用 CONCURRENTLY")
+
+    report_parser = subparsers.add_parser('report', help="输出各分区行数和大小")
+    report_parser.add_argument('--exact', action='store_true', help="使用 COUNT(*) 精确计数（较慢）")
+    report_parser.add_argument('--json', action='store_true', help="以 JSON 输出")
+
+    split_parser = subparsers.add_parser('split-daily', help="将尚无数据的月分区改为按日分区")
+    split_parser.add_argument('month', help="月份，格式 YYYY-MM")
+
+    args = parser.parse_args()
+    manager = PartitionManager(args.table)
+    try:
+        if args.command == 'report':
+            result: Any = manager.list_partitions(exact_counts=args.exact)
+            if not args.json:
+                print_report(result)
+                return 0
+        elif args.command == 'split-daily':
+            result = manager.split_month_to_daily(args.month)
+        else:
+            result = manager.maintain(
+                months_ahead=getattr(args, 'months_ahead', 3),
+                daily_months=tuple(getattr(args, 'daily_month', ())),
+                daily_threshold=getattr(args, 'daily_threshold', None),
+                concurrently=not getattr(args, 'no_concurrently', False),
+            )
+        print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+        sections = [result] if args.command == 'split-daily' else [result.get('partitions', {}), result.get('indexes', {})]
+        return 1 if any(section.get('errors') for section in sections) else 0
+    except psycopg2.Error as e:
+        logger.error(f"分区维护失败: {e}")
+        return 1
+    finally:
+        manager.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
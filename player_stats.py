@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+玩家统计汇总表维护工具
+安装 player_stats_summary 表和触发器，或按 player_id 区间分批重建汇总（回填历史数据）
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Optional
+import logging
+from database_manager import db_manager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'player_stats_summary.sql')
+
+class PlayerStatsSummaryMaintainer:
+    """player_stats_summary 安装与重建"""
+
+    PLAYER_ID_RANGE_SQL = "SELECT MIN(player_id) AS min_id, MAX(player_id) AS max_id FROM players"
+    REBUILD_SQL = "SELECT rebuild_player_stats_summary(%s, %s) AS rebuilt"
+
+    def __init__(self):
+        self.db_manager = db_manager
+
+    def install(self, schema_file: str = SCHEMA_FILE) -> bool:
+        """执行建表和触发器脚本（可重复执行）"""
+        try:
+            with open(schema_file, 'r', encoding='utf-8') as f:
+                script = f.read()
+            with self.db_manager.transaction() as cursor:
+                cursor.execute(script)
+            logger.info("玩家统计汇总表及触发器安装完成")
+            return True
+        except Exception as e:
+            logger.error(f"安装玩家统计汇总表失败: {e}")
+            return False
+
+    def rebuild(self, from_player: Optional[int] = None, to_player: Optional[int] = None,
+                batch_size: int = 10000) -> int:
+        """按 player_id 区间分批重建，每批一个事务，避免长事务长时间持有锁；返回重建的玩家数"""
+        bounds = self.db_manager.execute_single_query(self.PLAYER_ID_RANGE_SQL)
+        if not bounds or bounds['min_id'] is None:
+            return 0
+        start = max(from_player or bounds['min_id'], bounds['min_id'])
+        end = min(to_player or bounds['max_id'], bounds['max_id'])
+
+        total = 0
+        began = time.monotonic()
+        while start <= end:
+            batch_end = min(start + batch_size - 1, end)
+            with self.db_manager.transaction() as cursor:
+                cursor.execute(self.REBUILD_SQL, (start, batch_end))
+                total += cursor.fetchone()['rebuilt']
+            logger.info(f"已重建 player_id {start}-{batch_end}，累计 {total} 名玩家")
+            start = batch_end + 1
+        logger.info(f"玩家统计汇总重建完成，共 {total} 名玩家，耗时 {time.monotonic() - began:.1f} 秒")
+        return total
+
+def main():
+    parser = argparse.ArgumentParser(description="玩家统计汇总表维护")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('install', help="安装汇总表和触发器")
+    rebuild_parser = subparsers.add_parser('rebuild', help="重建汇总（回填）")
+    rebuild_parser.add_argument('--from-player', type=int, help="起始 player_id（含）")
+    rebuild_parser.add_argument('--to-player', type=int, help="结束 player_id（含）")
+    rebuild_parser.add_argument('--batch-size', type=int, default=10000, help="每个事务重建的 player_id 区间大小")
+    args = parser.parse_args()
+
+    maintainer = PlayerStatsSummaryMaintainer()
+    if args.command == 'install':
+        return 0 if maintainer.install() else 1
+    try:
+        maintainer.rebuild(args.from_player, args.to_player, args.batch_size)
+        return 0
+    except Exception as e:
+        logger.error(f"重建玩家统计汇总失败: {e}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
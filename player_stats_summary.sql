@@ -0,0 +1,217 @@
+-- ========================================
+-- 玩家统计汇总表（增量维护）
+-- ========================================
+-- 由触发器在写入参与者、结束游戏、写入积分流水时增量更新，
+-- 玩家统计页直接读取汇总行，不再扫描玩家全部对局历史。
+-- 首次安装或数据修复后执行 rebuild_player_stats_summary() 回填（见 player_stats.py rebuild）。
+-- 触发器均为语句级并使用转换表，批量开局/结算时每条语句只更新一次汇总。
+
+-- 1. 汇总表
+CREATE TABLE IF NOT EXISTS player_stats_summary (
+    player_id BIGINT PRIMARY KEY REFERENCES players(player_id),
+    total_games INTEGER NOT NULL DEFAULT 0,
+    completed_games INTEGER NOT NULL DEFAULT 0,
+    score_delta_sum BIGINT NOT NULL DEFAULT 0,   -- 已有 final_score 的对局的 final_score - initial_score 之和
+    score_delta_count INTEGER NOT NULL DEFAULT 0, -- 已有 final_score 的对局数（平均分变化的分母）
+    last_activity TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- 2. 将一组增量合并进汇总表（按 player_id 排序加锁，避免并发事务死锁）
+CREATE OR REPLACE FUNCTION apply_player_stats_delta(
+    p_player_ids BIGINT[],
+    p_total_games INTEGER[],
+    p_completed_games INTEGER[],
+    p_delta_sum BIGINT[],
+    p_delta_count INTEGER[],
+    p_last_activity TIMESTAMPTZ[]
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO player_stats_summary AS s (
+        player_id, total_games, completed_games, score_delta_sum, score_delta_count, last_activity, updated_at
+    )
+    SELECT d.player_id, SUM(d.total_games), SUM(d.completed_games), SUM(d.delta_sum), SUM(d.delta_count),
+           MAX(d.last_activity), NOW()
+    FROM unnest(p_player_ids, p_total_games, p_completed_games, p_delta_sum, p_delta_count, p_last_activity)
+        AS d(player_id, total_games, completed_games, delta_sum, delta_count, last_activity)
+    GROUP BY d.player_id
+    ORDER BY d.player_id
+    ON CONFLICT (player_id) DO UPDATE SET
+        total_games = s.total_games + EXCLUDED.total_games,
+        completed_games = s.completed_games + EXCLUDED.completed_games,
+        score_delta_sum = s.score_delta_sum + EXCLUDED.score_delta_sum,
+        score_delta_count = s.score_delta_count + EXCLUDED.score_delta_count,
+        last_activity = GREATEST(s.last_activity, EXCLUDED.last_activity),
+        updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+-- 3. 参与者变动：新增、删除或 final_score 回填
+-- 更新按"减去旧行贡献、加上新行贡献"处理；游戏被级联删除时已无法得知是否完成，completed_games 以重建为准
+CREATE OR REPLACE FUNCTION player_stats_on_participants()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_player_ids BIGINT[] := '{}';
+    v_total INTEGER[] := '{}';
+    v_completed INTEGER[] := '{}';
+    v_delta_sum BIGINT[] := '{}';
+    v_delta_count INTEGER[] := '{}';
+    v_last_activity TIMESTAMPTZ[] := '{}';
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT v_player_ids || array_agg(o.player_id),
+               v_total || array_agg(-1),
+               v_completed || array_agg(-(g.end_time IS NOT NULL)::int),
+               v_delta_sum || array_agg(-COALESCE(o.final_score - o.initial_score, 0)::bigint),
+               v_delta_count || array_agg(-(o.final_score IS NOT NULL)::int),
+               v_last_activity || array_agg(NULL::timestamptz)
+        INTO v_player_ids, v_total, v_completed, v_delta_sum, v_delta_count, v_last_activity
+        FROM old_rows o LEFT JOIN games g ON g.game_id = o.game_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT v_player_ids || array_agg(n.player_id),
+               v_total || array_agg(1),
+               v_completed || array_agg((g.end_time IS NOT NULL)::int),
+               v_delta_sum || array_agg(COALESCE(n.final_score - n.initial_score, 0)::bigint),
+               v_delta_count || array_agg((n.final_score IS NOT NULL)::int),
+               v_last_activity || array_agg(COALESCE(n.updated_at, n.created_at))
+        INTO v_player_ids, v_total, v_completed, v_delta_sum, v_delta_count, v_last_activity
+        FROM new_rows n LEFT JOIN games g ON g.game_id = n.game_id;
+    END IF;
+
+    IF cardinality(v_player_ids) > 0 THEN
+        PERFORM apply_player_stats_delta(v_player_ids, v_total, v_completed, v_delta_sum, v_delta_count, v_last_activity);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 4. 游戏结束（end_time 由空变为非空）或重新打开
+CREATE OR REPLACE FUNCTION player_stats_on_games()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_player_ids BIGINT[];
+    v_zero INTEGER[];
+    v_completed INTEGER[];
+    v_zero_sum BIGINT[];
+    v_last_activity TIMESTAMPTZ[];
+BEGIN
+    SELECT array_agg(gp.player_id),
+           array_agg(0),
+           array_agg(CASE WHEN n.end_time IS NOT NULL THEN 1 ELSE -1 END),
+           array_agg(0::bigint),
+           array_agg(n.end_time)
+    INTO v_player_ids, v_zero, v_completed, v_zero_sum, v_last_activity
+    FROM new_rows n
+    JOIN old_rows o ON o.game_id = n.game_id
+    JOIN game_participants gp ON gp.game_id = n.game_id
+    WHERE (o.end_time IS NULL) <> (n.end_time IS NULL);
+
+    IF v_player_ids IS NOT NULL THEN
+        PERFORM apply_player_stats_delta(v_player_ids, v_zero, v_completed, v_zero_sum, v_zero, v_last_activity);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 5. 积分流水写入：只推进最后活跃时间
+CREATE OR REPLACE FUNCTION player_stats_on_transactions()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO player_stats_summary AS s (player_id, last_activity, updated_at)
+    SELECT player_id, MAX(event_time), NOW()
+    FROM new_rows
+    GROUP BY player_id
+    ORDER BY player_id
+    ON CONFLICT (player_id) DO UPDATE SET
+        last_activity = GREATEST(s.last_activity, EXCLUDED.last_activity),
+        updated_at = NOW()
+    WHERE s.last_activity IS NULL OR s.last_activity < EXCLUDED.last_activity;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_player_stats_participants_insert ON game_participants;
+CREATE TRIGGER trigger_player_stats_participants_insert
+    AFTER INSERT ON game_participants
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION player_stats_on_participants();
+
+DROP TRIGGER IF EXISTS trigger_player_stats_participants_update ON game_participants;
+CREATE TRIGGER trigger_player_stats_participants_update
+    AFTER UPDATE ON game_participants
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION player_stats_on_participants();
+
+DROP TRIGGER IF EXISTS trigger_player_stats_participants_delete ON game_participants;
+CREATE TRIGGER trigger_player_stats_participants_delete
+    AFTER DELETE ON game_participants
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION player_stats_on_participants();
+
+DROP TRIGGER IF EXISTS trigger_player_stats_games ON games;
+CREATE TRIGGER trigger_player_stats_games
+    AFTER UPDATE ON games
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION player_stats_on_games();
+
+DROP TRIGGER IF EXISTS trigger_player_stats_transactions ON score_transactions;
+CREATE TRIGGER trigger_player_stats_transactions
+    AFTER INSERT ON score_transactions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION player_stats_on_transactions();
+
+-- 6. 重建指定 player_id 区间（含两端，NULL 表示不限）的汇总，返回重建的玩家数
+CREATE OR REPLACE FUNCTION rebuild_player_stats_summary(
+    p_from_player BIGINT DEFAULT NULL,
+    p_to_player BIGINT DEFAULT NULL
+) RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    WITH target AS (
+        SELECT player_id FROM players
+        WHERE (p_from_player IS NULL OR player_id >= p_from_player)
+          AND (p_to_player IS NULL OR player_id <= p_to_player)
+    ), game_stats AS (
+        SELECT gp.player_id,
+               COUNT(DISTINCT gp.game_id) AS total_games,
+               COUNT(CASE WHEN g.end_time IS NOT NULL THEN 1 END) AS completed_games,
+               COALESCE(SUM(gp.final_score - gp.initial_score), 0) AS delta_sum,
+               COUNT(gp.final_score) AS delta_count,
+               MAX(GREATEST(gp.created_at, g.end_time)) AS last_game
+        FROM game_participants gp
+        JOIN games g ON g.game_id = gp.game_id
+        WHERE gp.player_id IN (SELECT player_id FROM target)
+        GROUP BY gp.player_id
+    ), ledger AS (
+        SELECT player_id, MAX(event_time) AS last_transaction
+        FROM score_transactions
+        WHERE player_id IN (SELECT player_id FROM target)
+        GROUP BY player_id
+    ), rebuilt AS (
+        INSERT INTO player_stats_summary AS s (
+            player_id, total_games, completed_games, score_delta_sum, score_delta_count, last_activity, updated_at
+        )
+        SELECT t.player_id,
+               COALESCE(gs.total_games, 0), COALESCE(gs.completed_games, 0),
+               COALESCE(gs.delta_sum, 0), COALESCE(gs.delta_count, 0),
+               GREATEST(gs.last_game, l.last_transaction), NOW()
+        FROM target t
+        LEFT JOIN game_stats gs ON gs.player_id = t.player_id
+        LEFT JOIN ledger l ON l.player_id = t.player_id
+        ORDER BY t.player_id
+        ON CONFLICT (player_id) DO UPDATE SET
+            total_games = EXCLUDED.total_games,
+            completed_games = EXCLUDED.completed_games,
+            score_delta_sum = EXCLUDED.score_delta_sum,
+            score_delta_count = EXCLUDED.score_delta_count,
+            last_activity = EXCLUDED.last_activity,
+            updated_at = NOW()
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO v_count FROM rebuilt;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
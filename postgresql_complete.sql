@@ -113,6 +113,10 @@ CREATE INDEX idx_game_participants_player_status ON game_participants(player_id,
 CREATE INDEX idx_score_transactions_player_time ON score_transactions(player_id, event_time);
 CREATE INDEX idx_transfer_records_game_time ON transfer_records(game_id, transfer_time);
 
+-- 键集分页：玩家积分流水按 (event_time, transaction_id) 倒序翻页，玩家对局历史按 game_id 倒序翻页
+CREATE INDEX idx_score_transactions_player_time_id ON score_transactions(player_id, event_time DESC, transaction_id DESC);
+CREATE INDEX idx_game_participants_player_game ON game_participants(player_id, game_id DESC);
+
 -- 外键约束
 ALTER TABLE game_participants
     ADD CONSTRAINT fk_game_participants_game_id 
@@ -25,6 +25,23 @@ FROM game_participants gp
 WHERE gp.player_id = $1
 ORDER BY g.start_time DESC;
 
+-- 查询特定玩家的游戏历史（键集分页）
+-- 首页 $2 传 NULL；下一页 $2 传上一页最后一条的 game_id，每页代价相同
+SELECT
+    g.game_id,
+    g.game_type,
+    g.start_time,
+    (SELECT COUNT(*) FROM game_participants x WHERE x.game_id = g.game_id) AS player_count,
+    gp.initial_score,
+    gp.final_score,
+    COALESCE(gp.final_score - gp.initial_score, 0) AS score_change
+FROM game_participants gp
+    INNER JOIN games g ON gp.game_id = g.game_id
+WHERE gp.player_id = $1
+  AND ($2::bigint IS NULL OR gp.game_id < $2)
+ORDER BY gp.game_id DESC
+LIMIT $3;
+
 -- 查询特定游戏的详细统计信息
 SELECT
     p.player_id,
@@ -0,0 +1,225 @@
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import logging
+from benchmark import PERCENTILES, percentile
+from sql_script import split_statements
+
+logger = logging.getLogger(__name__)
+
+# 字符串和注释中的 $1 不是参数
+_STRIP_RE = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.DOTALL)
+_PARAM_RE = re.compile(r"(?<![\w$])\$(\d+)(?![\w$])")
+_EXPLAINABLE_RE = re.compile(r"(?:SELECT|WITH|VALUES|TABLE|INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+def param_count(sql: str) -> int:
+    """语句中最大的 $n 参数编号，没有参数时为 0"""
+    return max((int(n) for n in _PARAM_RE.findall(_STRIP_RE.sub(' ', sql))), default=0)
+
+class QueryBenchmark:
+    """对一条语句或一个 SQL 文件重复执行 iterations 次，统计延迟分位数和每秒行数
+
+    concurrency 个线程各用一条独立连接，共同完成 iterations 次执行；每条连接先执行 warmup 次不计入统计。
+    一次执行依次运行文件中的全部语句并取回所有结果行，耗时从发送第一条语句到取完最后一条的结果，
+    之后回滚，写语句不会改变数据，每次执行面对的数据相同。
+    含 $1、$2 参数的语句（如 query.sql）用 PREPARE/EXECUTE 执行，参数按位置取自 params，'NULL' 表示空值。
+    全部执行结束后，在新连接上对最慢一次执行中最慢的语句重新运行 EXPLAIN (ANALYZE, BUFFERS)
+    （先执行它前面的语句，最后回滚），得到的是缓存已预热时的计划和缓冲区命中情况。
+    """
+
+    def __init__(self, connect: Callable[[], Any], iterations: int = 20, concurrency: int = 1, warmup: int = 1,
+                 params: Sequence[str] = (), explain: bool = True):
+        self.connect = connect
+        self.iterations = max(iterations, 1)
+        self.concurrency = max(min(concurrency, self.iterations), 1)
+        self.warmup = max(warmup, 0)
+        self.params = [None if value.upper() == 'NULL' else value for value in params]
+        self.explain = explain
+
+    def run_file(self, file_path: str) -> Dict[str, Any]:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return self.run(f.read())
+
+    def run(self, script: str) -> Dict[str, Any]:
+        statements = split_statements(script)
+        if not statements:
+            raise ValueError("没有可执行的语句")
+        for statement in statements:
+            needed = param_count(statement.sql)
+            if needed > len(self.params):
+                raise ValueError(f"第 {statement.line} 行的语句需要 {needed} 个参数，只提供了 {len(self.params)} 个")
+            if needed and not _EXPLAINABLE_RE.match(statement.sql):
+                raise ValueError(f"第 {statement.line} 行的语句不能带参数执行")
+
+        counter = iter(range(self.iterations))
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.concurrency)
+        samples: List[Tuple[float, List[float], int]] = []
+        spans: List[Tuple[float, float]] = []
+        errors: List[str] = []
+        workers = [threading.Thread(target=self._worker, args=(statements, counter, lock, barrier, samples, spans, errors),
+                                    name=f"query-bench-{index}", daemon=True)
+                   for index in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        result: Dict[str, Any] = {
+            'statements': len(statements),
+            'iterations': self.iterations,
+            'concurrency': self.concurrency,
+            'warmup': self.warmup,
+            'runs': len(samples),
+            'errors': len(errors),
+            'error': errors[0] if errors else None,
+        }
+        if not samples:
+            return result
+        latencies = sorted(sample[0] for sample in samples)
+        rows = sum(sample[2] for sample in samples)
+        wall = max(end for _, end in spans) - min(start for start, _ in spans)
+        result.update({
+            'min_ms': round(latencies[0] * 1000, 3),
+            **{f"p{pct}_ms": round(percentile(latencies, pct) * 1000, 3) for pct in PERCENTILES},
+            'max_ms': round(latencies[-1] * 1000, 3),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'rows': rows,
+            'rows_per_run': rows // len(samples),
+            'wall_s': round(wall, 3),
+            'runs_per_sec': round(len(samples) / wall, 1) if wall else 0.0,
+            'rows_per_sec': round(rows / wall, 1) if wall else 0.0,
+        })
+        if len(statements) > 1:
+            result['per_statement'] = []
+            for index, statement in enumerate(statements):
+                values = sorted(sample[1][index] for sample in samples)
+                result['per_statement'].append({
+                    'line': statement.line,
+                    'sql': statement.summary(80),
+                    **{f"p{pct}_ms": round(percentile(values, pct) * 1000, 3) for pct in (50, 95)},
+                    'max_ms': round(values[-1] * 1000, 3),
+                })
+        slowest_run = max(samples, key=lambda sample: sample[0])
+        slowest_index = max(range(len(statements)), key=lambda index: slowest_run[1][index])
+        result['slowest'] = {
+            'run_ms': round(slowest_run[0] * 1000, 3),
+            'line': statements[slowest_index].line,
+            'sql': statements[slowest_index].summary(200),
+            'statement_ms': round(slowest_run[1][slowest_index] * 1000, 3),
+            'plan': self._explain(statements, slowest_index) if self.explain else None,
+        }
+        return result
+
+    def _plan(self, cursor, statements) -> List[Tuple[str, Optional[list]]]:
+        """每条语句实际发送的 SQL 和参数；带参数的语句在本连接上 PREPARE"""
+        plan = []
+        for index, statement in enumerate(statements):
+            needed = param_count(statement.sql)
+            if not needed:
+                plan.append((statement.sql, None))
+                continue
+            cursor.execute(f"PREPARE query_bench_{index} AS {statement.sql}")
+            placeholders = ', '.join(['%s'] * needed)
+            plan.append((f"EXECUTE query_bench_{index}({placeholders})", self.params[:needed]))
+        return plan
+
+    @staticmethod
+    def _run_once(conn, cursor, plan) -> Tuple[float, List[float], int]:
+        durations: List[float] = []
+        rows = 0
+        try:
+            started = time.perf_counter()
+            for sql, args in plan:
+                statement_started = time.perf_counter()
+                cursor.execute(sql, args)
+                if cursor.description is not None:
+                    rows += len(cursor.fetchall())
+                else:
+                    rows += max(cursor.rowcount, 0)
+                durations.append(time.perf_counter() - statement_started)
+            return time.perf_counter() - started, durations, rows
+        finally:
+            conn.rollback()
+
+    def _worker(self, statements, counter, lock, barrier, samples, spans, errors) -> None:
+        conn = None
+        try:
+            conn = self.connect()
+            with conn.cursor() as cursor:
+                plan = self._plan(cursor, statements)
+                conn.rollback()
+                for _ in range(self.warmup):
+                    self._run_once(conn, cursor, plan)
+                barrier.wait()
+                started = time.perf_counter()
+                while True:
+                    with lock:
+                        if next(counter, None) is None:
+                            break
+                    try:
+                        sample = self._run_once(conn, cursor, plan)
+                    except Exception as e:
+                        with lock:
+                            errors.append(str(e).strip())
+                        continue
+                    with lock:
+                        samples.append(sample)
+                with lock:
+                    spans.append((started, time.perf_counter()))
+        except threading.BrokenBarrierError:
+            pass
+        except Exception as e:
+            # 连接、PREPARE 或预热失败时其他线程也无法得到可比较的结果，全部停止
+            with lock:
+                errors.append(str(e).strip())
+            barrier.abort()
+            logger.error(f"压测线程 {threading.current_thread().name} 失败: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _explain(self, statements, target: int) -> Optional[List[str]]:
+        statement = statements[target]
+        if not _EXPLAINABLE_RE.match(statement.sql):
+            return None
+        conn = None
+        try:
+            conn = self.connect()
+            with conn.cursor() as cursor:
+                plan = self._plan(cursor, statements[:target + 1])
+                for sql, args in plan[:target]:
+                    cursor.execute(sql, args)
+                sql, args = plan[target]
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", args)
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"获取执行计划失败: {e}")
+            return [f"获取执行计划失败: {str(e).strip()}"]
+        finally:
+            if conn is not None:
+                conn.rollback()
+                conn.close()
+
+def format_report(result: Dict[str, Any]) -> List[str]:
+    """生成文本报告：延迟分位数、吞吐量、各语句耗时和最慢一次的执行计划"""
+    lines = [f"{result['statements']} 条语句 × {result['iterations']} 次，并发 {result['concurrency']}，"
+             f"预热 {result['warmup']} 次/连接；成功 {result['runs']} 次，失败 {result['errors']} 次"]
+    if result['error']:
+        lines.append(f"第一个错误: {result['error']}")
+    if not result['runs']:
+        return lines
+    lines.append(f"{'min ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'次/秒':>9} {'行/秒':>11}")
+    lines.append(f"{result['min_ms']:>9} {result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9} "
+                 f"{result['max_ms']:>9} {result['runs_per_sec']:>9} {result['rows_per_sec']:>11}")
+    lines.append(f"每次返回/影响 {result['rows_per_run']} 行，总耗时 {result['wall_s']} s")
+    for item in result.get('per_statement', []):
+        lines.append(f"  第 {item['line']} 行  p50 {item['p50_ms']} ms  p95 {item['p95_ms']} ms  "
+                     f"max {item['max_ms']} ms  {item['sql']}")
+    slowest = result['slowest']
+    lines.append(f"最慢一次 {slowest['run_ms']} ms，其中第 {slowest['line']} 行的语句 {slowest['statement_ms']} ms")
+    if slowest['plan']:
+        lines.append("EXPLAIN (ANALYZE, BUFFERS):")
+        lines.extend(f"  {line}" for line in slowest['plan'])
+    return lines
@@ -0,0 +1,240 @@
+import bisect
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+from database_manager import db_manager
+from event_listener import NotificationListener, ResyncEvent, ScoreChangeEvent
+
+logger = logging.getLogger(__name__)
+
+class _FenwickTree:
+    """树状数组：单点增减、前缀和、按序号定位，均为 O(log n)"""
+
+    def __init__(self, counts: Iterable[int] = ()):
+        tree = [0]
+        tree.extend(counts)
+        self.size = len(tree) - 1
+        # O(n) 建树：每个节点把自己的和累加到父节点
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._top = 1 << (self.size.bit_length() - 1) if self.size else 0
+
+    def add(self, index: int, delta: int) -> None:
+        i = index + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix(self, index: int) -> int:
+        """返回 [0, index) 的和"""
+        total = 0
+        i = index
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, k: int) -> Tuple[int, int]:
+        """找到第 k 个元素（从 0 开始）所在的下标，返回 (下标, 该下标之前的元素数)"""
+        pos = 0
+        remaining = k
+        step = self._top
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self._tree[nxt] <= remaining:
+                pos = nxt
+                remaining -= self._tree[nxt]
+            step >>= 1
+        return pos, k - remaining
+
+class ScoreRankIndex:
+    """全体玩家积分排名索引
+
+    全体玩家按 (-积分, player_id) 排序后切成若干段有序列表，每段不超过 2 * bucket_size 个，
+    树状数组保存各段长度。分段按键而不是按积分区间划分，大量玩家同分（如都在 0 分或初始分）时
+    同样会被拆成多段，段内插入删除的代价以 bucket_size 为上限；名次查询、周边玩家、百分位为 O(log n)。
+    段超过上限时对半拆分、变空时删除，二者都只重建 O(n / bucket_size) 的树状数组。
+    load() 期间收到的积分变动先记下，快照装入后按到达顺序重放，不会丢失加载与订阅之间的事件。
+    """
+
+    LOAD_SQL = "SELECT player_id, current_total FROM scores"
+
+    def __init__(self, bucket_size: int = 1024):
+        self.bucket_size = bucket_size
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._pending: Optional[List[Tuple[int, int]]] = None
+        self._scores: Dict[int, int] = {}
+        self._build([])
+
+    def _build(self, items: Iterable[Tuple[int, int]]) -> None:
+        """按键排序后等长分段并建立索引"""
+        scores = dict(items)
+        keys = sorted((-score, player_id) for player_id, score in scores.items())
+        size = self.bucket_size
+        self._lists: List[List[Tuple[int, int]]] = [keys[i:i + size] for i in range(0, len(keys), size)]
+        self._maxes = [bucket[-1] for bucket in self._lists]
+        self._fenwick = _FenwickTree(len(bucket) for bucket in self._lists)
+        self._scores = scores
+
+    def _reindex(self) -> None:
+        self._fenwick = _FenwickTree(len(bucket) for bucket in self._lists)
+
+    def _insert(self, key: Tuple[int, int]) -> None:
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._reindex()
+            return
+        index = min(bisect.bisect_left(self._maxes, key), len(self._lists) - 1)
+        bucket = self._lists[index]
+        bisect.insort(bucket, key)
+        self._maxes[index] = bucket[-1]
+        if len(bucket) > 2 * self.bucket_size:
+            tail = bucket[self.bucket_size:]
+            del bucket[self.bucket_size:]
+            self._lists.insert(index + 1, tail)
+            self._maxes[index] = bucket[-1]
+            self._maxes.insert(index + 1, tail[-1])
+            self._reindex()
+        else:
+            self._fenwick.add(index, 1)
+
+    def _delete(self, key: Tuple[int, int]) -> None:
+        index = bisect.bisect_left(self._maxes, key)
+        bucket = self._lists[index]
+        del bucket[bisect.bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[index] = bucket[-1]
+            self._fenwick.add(index, -1)
+        else:
+            del self._lists[index]
+            del self._maxes[index]
+            self._reindex()
+
+    def load(self) -> None:
+        """从 scores 表流式加载全部玩家积分；加载期间的积分变动在快照装入后重放"""
+        with self._load_lock:
+            with self._lock:
+                self._pending = []
+            try:
+                items = []
+                for batch in db_manager.execute_stream(self.LOAD_SQL, batch_size=50000, row_format='tuple'):
+                    items.extend(batch)
+            except Exception:
+                with self._lock:
+                    self._pending = None
+                raise
+            with self._lock:
+                self._build(items)
+                pending, self._pending = self._pending, None
+                # 事件按提交顺序到达，积分为绝对值，按序重放后每名玩家停在最后一次提交的积分
+                for player_id, current_total in pending:
+                    self._apply(player_id, current_total)
+        logger.info(f"排名索引加载完成，共 {len(items)} 名玩家，重放 {len(pending)} 条加载期间的积分变动")
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, player_id: int) -> bool:
+        return player_id in self._scores
+
+    def update(self, player_id: int, current_total: int) -> None:
+        """更新玩家积分（新玩家直接插入）"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((player_id, current_total))
+            self._apply(player_id, current_total)
+
+    def _apply(self, player_id: int, current_total: int) -> None:
+        old = self._scores.get(player_id)
+        if old == current_total:
+            return
+        if old is not None:
+            self._delete((-old, player_id))
+        self._insert((-current_total, player_id))
+        self._scores[player_id] = current_total
+
+    def remove(self, player_id: int) -> None:
+        """移除玩家"""
+        with self._lock:
+            old = self._scores.pop(player_id, None)
+            if old is not None:
+                self._delete((-old, player_id))
+
+    def _count_before(self, key: Tuple) -> int:
+        """排在 key 之前的玩家数"""
+        index = bisect.bisect_left(self._maxes, key)
+        if index == len(self._lists):
+            return len(self._scores)
+        return self._fenwick.prefix(index) + bisect.bisect_left(self._lists[index], key)
+
+    def _at(self, position: int) -> Tuple[int, int]:
+        """按名次位置（从 0 开始）取 (-积分, player_id)"""
+        index, before = self._fenwick.find(position)
+        return self._lists[index][position - before]
+
+    def rank(self, player_id: int) -> Optional[int]:
+        """竞赛排名：积分严格高于该玩家的人数 + 1"""
+        with self._lock:
+            score = self._scores.get(player_id)
+            if score is None:
+                return None
+            return self._count_before((-score,)) + 1
+
+    def lookup(self, player_id: int) -> Optional[Dict[str, Any]]:
+        """一次返回积分、名次、总人数和百分位"""
+        with self._lock:
+            score = self._scores.get(player_id)
+            if score is None:
+                return None
+            return {
+                'player_id': player_id,
+                'current_total': score,
+                'rank': self.rank(player_id),
+                'total_players': len(self._scores),
+                'percentile': self.percentile(player_id),
+            }
+
+    def percentile(self, player_id: int) -> Optional[float]:
+        """百分位：积分低于该玩家的人数占比（0-100）"""
+        with self._lock:
+            score = self._scores.get(player_id)
+            if score is None:
+                return None
+            not_lower = self._count_before((-score, float('inf')))
+            return round((len(self._scores) - not_lower) * 100.0 / len(self._scores), 2)
+
+    def around(self, player_id: int, radius: int = 5) -> List[Dict[str, Any]]:
+        """返回该玩家前后各 radius 名的玩家（按积分降序，同分按 player_id）"""
+        with self._lock:
+            score = self._scores.get(player_id)
+            if score is None:
+                return []
+            position = self._count_before((-score, player_id))
+            start = max(position - radius, 0)
+            end = min(position + radius + 1, len(self._scores))
+            result = []
+            for pos in range(start, end):
+                neg_score, pid = self._at(pos)
+                result.append({
+                    'player_id': pid,
+                    'current_total': -neg_score,
+                    'rank': self._count_before((neg_score,)) + 1,
+                    'position': pos + 1,
+                })
+            return result
+
+    def handle_event(self, event: Any) -> None:
+        """事件订阅回调"""
+        if isinstance(event, ScoreChangeEvent):
+            self.update(event.player_id, event.current_total)
+        elif isinstance(event, ResyncEvent):
+            self.load()
+
+    def attach(self, listener: NotificationListener) -> None:
+        """订阅积分变动事件保持索引最新；应在 load() 之前调用，加载期间的事件才会被重放"""
+        listener.subscribe(self.handle_event, (ScoreChangeEvent,), queue_size=10000, overflow='drop')
@@ -0,0 +1,132 @@
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import logging
+from database_config import db_config
+from db_utils import is_read_only
+
+logger = logging.getLogger(__name__)
+
+class _Replica:
+    __slots__ = ('index', 'healthy', 'lag', 'checked_at', 'queries', 'failures', 'error')
+
+    def __init__(self, index: int):
+        self.index = index
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.checked_at = 0.0
+        self.queries = 0
+        self.failures = 0
+        self.error: Optional[str] = None
+
+class ReplicaRouter:
+    """只读副本路由
+
+    只读语句（见 is_read_only）轮询发往复制延迟不超过 max_lag 秒的副本，没有可用副本时回退到主库。
+    延迟和健康状态在选择副本时按需刷新，每个副本每 check_interval 秒最多检查一次，检查只由一个线程进行，
+    其他线程沿用上一次的结果，不会排队等待。查询失败的副本在下一个检查周期前不再使用。
+    """
+
+    # 副本已回放完收到的全部 WAL 时视为没有延迟（主库空闲时 pg_last_xact_replay_timestamp 会一直变旧）
+    LAG_SQL = """
+        SELECT pg_is_in_recovery() AS in_recovery,
+               CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp())
+               END AS lag_seconds
+        """
+
+    def __init__(self, config=None, max_lag: Optional[float] = None, check_interval: Optional[float] = None):
+        self.config = config or db_config
+        self.max_lag = self.config.replica_max_lag if max_lag is None else max_lag
+        self.check_interval = self.config.replica_check_interval if check_interval is None else check_interval
+        self._replicas = [_Replica(index) for index in range(len(self.config.replica_params))]
+        self._round_robin = itertools.count()
+        self._check_lock = threading.Lock()
+        self.stats = {'replica_queries': 0, 'primary_fallbacks': 0, 'failures': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._replicas)
+
+    def choose(self, query: str) -> Optional[int]:
+        """返回应执行该语句的副本编号；写语句或没有可用副本时返回 None（使用主库）"""
+        if not self._replicas or not is_read_only(query):
+            return None
+        self._refresh()
+        candidates = [replica for replica in self._replicas
+                      if replica.healthy and replica.lag is not None and replica.lag <= self.max_lag]
+        if not candidates:
+            self.stats['primary_fallbacks'] += 1
+            return None
+        replica = candidates[next(self._round_robin) % len(candidates)]
+        replica.queries += 1
+        self.stats['replica_queries'] += 1
+        return replica.index
+
+    def mark_failed(self, index: int, error: Exception) -> None:
+        """副本查询失败，在下一个检查周期前不再使用"""
+        replica = self._replicas[index]
+        replica.healthy = False
+        replica.failures += 1
+        replica.error = str(error)
+        replica.checked_at = time.monotonic()
+        self.stats['failures'] += 1
+        logger.warning(f"副本 {index} 查询失败，暂时改用主库: {error}")
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        due = [replica for replica in self._replicas if now - replica.checked_at >= self.check_interval]
+        if not due or not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            for replica in due:
+                self._check(replica)
+        finally:
+            self._check_lock.release()
+
+    def _check(self, replica: _Replica) -> None:
+        conn = None
+        broken = False
+        try:
+            conn = self.config.get_replica_connection(replica.index)
+            with conn.cursor() as cursor:
+                cursor.execute(self.LAG_SQL)
+                in_recovery, lag = cursor.fetchone()
+            conn.rollback()
+            if not in_recovery:
+                # 副本已被提升为主库，不再跟随当前主库，读到的数据可能与主库分叉
+                replica.healthy, replica.lag, replica.error = False, None, '节点不处于恢复模式'
+                logger.warning(f"副本 {replica.index} 不处于恢复模式，已停止向其路由查询")
+            else:
+                replica.healthy, replica.lag, replica.error = True, None if lag is None else float(lag), None
+                if replica.lag is None:
+                    logger.warning(f"副本 {replica.index} 启动后尚未回放事务，复制延迟未知，暂时改用主库")
+                elif replica.lag > self.max_lag:
+                    logger.warning(f"副本 {replica.index} 复制延迟 {replica.lag:.3f} 秒，超过 {self.max_lag} 秒，暂时改用主库")
+        except Exception as e:
+            broken = True
+            replica.healthy, replica.lag, replica.error = False, None, str(e)
+            logger.warning(f"副本 {replica.index} 健康检查失败: {e}")
+        finally:
+            replica.checked_at = time.monotonic()
+            if conn is not None:
+                self.config.return_replica_connection(replica.index, conn, close=broken)
+
+    def get_stats(self) -> Dict[str, Any]:
+        pool_stats = self.config.get_replica_pool_stats()
+        replicas: List[Dict[str, Any]] = [
+            {
+                'index': replica.index,
+                'host': self.config.replica_params[replica.index].get('host'),
+                'port': self.config.replica_params[replica.index].get('port'),
+                'healthy': replica.healthy,
+                'lag_seconds': replica.lag,
+                'queries': replica.queries,
+                'failures': replica.failures,
+                'error': replica.error,
+                'pool': pool_stats.get(replica.index, {}),
+            }
+            for replica in self._replicas
+        ]
+        return dict(self.stats, max_lag=self.max_lag, replicas=replicas)
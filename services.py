@@ -1,7 +1,20 @@
-from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import json
+from concurrent.futures import Future
+from typing import List, Dict, Any, Iterator, Optional, Tuple, Union
 from datetime import datetime, timedelta
+from psycopg2 import errorcodes, errors
 from models import Player, Game, ScoreTransaction
+from database_config import db_config
 from database_manager import db_manager
+from async_database_manager import async_db_manager
+from settlement import settlement_engine
+from leaderboard_cache import LeaderboardCache
+from rank_index import ScoreRankIndex
+from event_listener import NotificationListener
+from pagination import decode_cursor, split_page
+from ledger_archive import ledger_archive, merge_history
+from ledger_writer import LedgerWriter
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,26 +22,27 @@ logger = logging.getLogger(__name__)
 class GameService:
     """游戏服务类"""
     
+    PARTICIPANTS_SQL = """
+        SELECT gp.participation_id, gp.player_id, p.username, gp.initial_score, 
+               gp.final_score, gp.position, gp.created_at
+        FROM game_participants gp
+        JOIN players p ON gp.player_id = p.player_id
+        WHERE gp.game_id = %s
+        ORDER BY gp.position
+        """
+    
     def __init__(self):
         self.db_manager = db_manager
+        self.async_db_manager = async_db_manager
+        self.settlement_engine = settlement_engine
     
     def start_new_game(self, game_type: str, player_ids: List[int], initial_scores: Optional[List[int]] = None) -> Optional[Game]:
-        """开始新游戏"""
+        """开始新游戏，游戏和所有参与者在同一事务中创建"""
         try:
-            # 创建游戏
-            game = Game.create(game_type)
+            game = Game.create_with_participants(game_type, player_ids, initial_scores)
             if not game:
                 return None
             
-            # 添加参与者
-            if initial_scores is None:
-                initial_scores = [0] * len(player_ids)
-            
-            for i, player_id in enumerate(player_ids):
-                position = i + 1
-                initial_score = initial_scores[i] if i < len(initial_scores) else 0
-                game.add_participant(player_id, initial_score, position)
-            
             logger.info(f"游戏 {game.game_id} 开始，类型: {game_type}，参与者: {player_ids}")
             return game
             
@@ -36,22 +50,24 @@ class GameService:
             logger.error(f"开始新游戏失败: {e}")
             return None
     
-    def end_game_with_results(self, game_id: int, player_results: List[Tuple[int, int]]) -> bool:
-        """结束游戏并记录结果"""
+    def start_new_games(self, rooms: List[Tuple[str, List[int], Optional[List[int]]]]) -> List[Game]:
+        """批量开房（如锦标赛开赛），rooms 为 (游戏类型, 玩家ID列表, 初始积分列表) 的列表"""
         try:
-            game = Game.get_by_id(game_id)
-            if not game:
-                logger.error(f"游戏 {game_id} 不存在")
-                return False
+            games = Game.create_batch(rooms)
+            if games:
+                logger.info(f"批量创建 {len(games)} 个游戏: {[g.game_id for g in games]}")
+            return games
             
-            # 结束游戏
-            if not game.end_game():
+        except Exception as e:
+            logger.error(f"批量开始游戏失败: {e}")
+            return []
+    
+    def end_game_with_results(self, game_id: int, player_results: List[Tuple[int, int]]) -> bool:
+        """结束游戏并记录结果，所有玩家的积分变化在同一事务中结算"""
+        try:
+            if self.settlement_engine.settle(game_id, player_results) is None:
                 return False
             
-            # 记录积分变化
-            for player_id, points_change in player_results:
-                ScoreTransaction.create(player_id, points_change, game_id)
-            
             logger.info(f"游戏 {game_id} 结束，结果: {player_results}")
             return True
             
@@ -61,16 +77,55 @@ class GameService:
     
     def get_game_participants(self, game_id: int) -> List[Dict[str, Any]]:
         """获取游戏参与者信息"""
-        query = """
-        SELECT gp.participation_id, gp.player_id, p.username, gp.initial_score, 
-               gp.final_score, gp.position, gp.created_at
-        FROM game_participants gp
-        JOIN players p ON gp.player_id = p.player_id
-        WHERE gp.game_id = %s
-        ORDER BY gp.position
-        """
         try:
-            return self.db_manager.execute_query(query, (game_id,))
+            return self.db_manager.execute_query(self.PARTICIPANTS_SQL, (game_id,))
+        except Exception as e:
+            logger.error(f"获取游戏参与者失败: {e}")
+            return []
+    
+    async def astart_new_game(self, game_type: str, player_ids: List[int], initial_scores: Optional[List[int]] = None) -> Optional[Game]:
+        """开始新游戏（异步）"""
+        try:
+            game = await Game.acreate_with_participants(game_type, player_ids, initial_scores)
+            if not game:
+                return None
+            
+            logger.info(f"游戏 {game.game_id} 开始，类型: {game_type}，参与者: {player_ids}")
+            return game
+            
+        except Exception as e:
+            logger.error(f"开始新游戏失败: {e}")
+            return None
+    
+    async def astart_new_games(self, rooms: List[Tuple[str, List[int], Optional[List[int]]]]) -> List[Game]:
+        """批量开房（异步）"""
+        try:
+            games = await Game.acreate_batch(rooms)
+            if games:
+                logger.info(f"批量创建 {len(games)} 个游戏: {[g.game_id for g in games]}")
+            return games
+            
+        except Exception as e:
+            logger.error(f"批量开始游戏失败: {e}")
+            return []
+    
+    async def aend_game_with_results(self, game_id: int, player_results: List[Tuple[int, int]]) -> bool:
+        """结束游戏并记录结果（异步）"""
+        try:
+            if await self.settlement_engine.asettle(game_id, player_results) is None:
+                return False
+            
+            logger.info(f"游戏 {game_id} 结束，结果: {player_results}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"结束游戏失败: {e}")
+            return False
+    
+    async def aget_game_participants(self, game_id: int) -> List[Dict[str, Any]]:
+        """获取游戏参与者信息（异步）"""
+        try:
+            return await self.async_db_manager.execute_query(self.PARTICIPANTS_SQL, (game_id,))
         except Exception as e:
             logger.error(f"获取游戏参与者失败: {e}")
             return []
@@ -78,14 +133,122 @@ class GameService:
 class PlayerService:
     """玩家服务类"""
     
+    GAME_STATS_SQL = """
+            SELECT 
+                COUNT(DISTINCT gp.game_id) as total_games,
+                COUNT(CASE WHEN g.end_time IS NOT NULL THEN 1 END) as completed_games,
+                AVG(gp.final_score - gp.initial_score) as avg_score_change
+            FROM game_participants gp
+            JOIN games g ON gp.game_id = g.game_id
+            WHERE gp.player_id = %s
+            """
+    # 一次往返读取玩家、总分、统计汇总（player_stats_summary.sql）和最近 10 条流水
+    PLAYER_STATS_SQL = """
+        SELECT p.player_id, p.username,
+               COALESCE(s.current_total, 0) AS current_score,
+               COALESCE(ss.total_games, 0) AS total_games,
+               COALESCE(ss.completed_games, 0) AS completed_games,
+               ss.score_delta_sum, ss.score_delta_count, ss.last_activity,
+               (SELECT COALESCE(json_agg(t), '[]'::json) FROM (
+                    SELECT points_change, current_total, event_time, game_id
+                    FROM score_transactions
+                    WHERE player_id = p.player_id
+                    ORDER BY event_time DESC, transaction_id DESC
+                    LIMIT 10
+               ) t) AS recent_transactions
+        FROM players p
+        LEFT JOIN scores s ON s.player_id = p.player_id
+        LEFT JOIN player_stats_summary ss ON ss.player_id = p.player_id
+        WHERE p.player_id = %s
+        """
+    LEADERBOARD_SQL = """
+        SELECT p.player_id, p.username, s.current_total, s.last_updated
+        FROM scores s
+        JOIN players p ON s.player_id = p.player_id
+        ORDER BY s.current_total DESC
+        LIMIT %s
+        """
+    # 未启用排名索引时的回退查询（全表扫描）
+    RANK_SQL = """
+        SELECT s.current_total,
+               (SELECT COUNT(*) FROM scores WHERE current_total > s.current_total) + 1 AS rank,
+               (SELECT COUNT(*) FROM scores WHERE current_total < s.current_total) AS lower,
+               (SELECT COUNT(*) FROM scores) AS total_players
+        FROM scores s
+        WHERE s.player_id = %s
+        """
+    AROUND_SQL = """
+        WITH ranked AS (
+            SELECT player_id, current_total,
+                   RANK() OVER (ORDER BY current_total DESC) AS rank,
+                   ROW_NUMBER() OVER (ORDER BY current_total DESC, player_id) AS position
+            FROM scores
+        ), me AS (
+            SELECT position FROM ranked WHERE player_id = %s
+        )
+        SELECT r.player_id, r.current_total, r.rank, r.position
+        FROM ranked r, me
+        WHERE r.position BETWEEN me.position - %s AND me.position + %s
+        ORDER BY r.position
+        """
+    USERNAMES_SQL = "SELECT player_id, username FROM players WHERE player_id = ANY(%s)"
+    # 玩家对局历史（query.sql），按 game_id 键集分页；game_id 随开局时间递增，与按 start_time 倒序一致
+    GAME_HISTORY_SQL = """
+        SELECT g.game_id, g.game_type, g.start_time, g.end_time,
+               (SELECT COUNT(*) FROM game_participants x WHERE x.game_id = g.game_id) AS player_count,
+               gp.initial_score, gp.final_score,
+               COALESCE(gp.final_score - gp.initial_score, 0) AS score_change
+        FROM game_participants gp
+        JOIN games g ON gp.game_id = g.game_id
+        WHERE gp.player_id = %s
+        ORDER BY gp.game_id DESC
+        LIMIT %s
+        """
+    GAME_HISTORY_AFTER_SQL = """
+        SELECT g.game_id, g.game_type, g.start_time, g.end_time,
+               (SELECT COUNT(*) FROM game_participants x WHERE x.game_id = g.game_id) AS player_count,
+               gp.initial_score, gp.final_score,
+               COALESCE(gp.final_score - gp.initial_score, 0) AS score_change
+        FROM game_participants gp
+        JOIN games g ON gp.game_id = g.game_id
+        WHERE gp.player_id = %s AND gp.game_id < %s
+        ORDER BY gp.game_id DESC
+        LIMIT %s
+        """
+    
     def __init__(self):
         self.db_manager = db_manager
+        self.async_db_manager = async_db_manager
+        self.leaderboard_cache: Optional[LeaderboardCache] = None
+        self.rank_index: Optional[ScoreRankIndex] = None
+        # 查询时发现未安装统计汇总表后置为 False，不再重复尝试
+        self.stats_summary_available = True
+    
+    def enable_leaderboard_cache(self, size: int = 100, refresh_interval: float = 30.0,
+                                 listener: Optional[NotificationListener] = None) -> LeaderboardCache:
+        """启用进程内排行榜缓存；传入 listener 时由积分变动事件增量更新，否则按 refresh_interval 定时重载"""
+        cache = LeaderboardCache(size=size, refresh_interval=refresh_interval)
+        if listener is not None:
+            cache.attach(listener)
+        self.leaderboard_cache = cache
+        return cache
+    
+    def enable_rank_index(self, listener: Optional[NotificationListener] = None,
+                          bucket_size: int = 1024) -> ScoreRankIndex:
+        """启用全体玩家排名索引；传入 listener 时由积分变动事件增量更新，否则需自行调用 load() 刷新"""
+        index = ScoreRankIndex(bucket_size=bucket_size)
+        # 先订阅再加载：加载期间到达的事件由 load() 在快照装入后重放
+        if listener is not None:
+            index.attach(listener)
+        index.load()
+        self.rank_index = index
+        return index
     
     def register_player(self, username: str) -> Optional[Player]:
         """注册新玩家"""
         try:
-            # 检查用户名是否已存在
-            existing_player = Player.get_by_username(username)
+            # 检查用户名是否已存在（查询主库，副本可能还没有刚注册的玩家）
+            existing_player = Player.get_by_username(username, read_your_writes=True)
             if existing_player:
                 logger.warning(f"用户名 {username} 已存在")
                 return None
@@ -101,7 +264,22 @@ class PlayerService:
             return None
     
     def get_player_stats(self, player_id: int) -> Dict[str, Any]:
-        """获取玩家统计信息"""
+        """获取玩家统计信息，优先从统计汇总表一次往返读取，未安装汇总表时逐项查询"""
+        if not self.stats_summary_available:
+            return self._get_player_stats_uncached(player_id)
+        try:
+            row = self.db_manager.execute_single_query(self.PLAYER_STATS_SQL, (player_id,))
+            return self._format_summary_stats(row) if row else {}
+        except errors.UndefinedTable:
+            logger.warning("未安装 player_stats_summary，玩家统计改为逐项查询")
+            self.stats_summary_available = False
+            return self._get_player_stats_uncached(player_id)
+        except Exception as e:
+            logger.error(f"获取玩家统计失败: {e}")
+            return {}
+    
+    def _get_player_stats_uncached(self, player_id: int) -> Dict[str, Any]:
+        """逐项查询玩家统计（扫描玩家全部对局）"""
         try:
             player = Player.get_by_id(player_id)
             if not player:
@@ -111,61 +289,270 @@ class PlayerService:
             current_score = player.get_current_score()
             
             # 获取游戏统计
-            game_stats_query = """
-            SELECT 
-                COUNT(DISTINCT gp.game_id) as total_games,
-                COUNT(CASE WHEN g.end_time IS NOT NULL THEN 1 END) as completed_games,
-                AVG(gp.final_score - gp.initial_score) as avg_score_change
-            FROM game_participants gp
-            JOIN games g ON gp.game_id = g.game_id
-            WHERE gp.player_id = %s
-            """
-            game_stats = self.db_manager.execute_single_query(game_stats_query, (player_id,))
+            game_stats = self.db_manager.execute_single_query(self.GAME_STATS_SQL, (player_id,))
             
             # 获取最近积分历史
             recent_transactions = ScoreTransaction.get_player_history(player_id, 10)
             
+            return self._format_player_stats(player, current_score, game_stats, recent_transactions)
+            
+        except Exception as e:
+            logger.error(f"获取玩家统计失败: {e}")
+            return {}
+    
+    @staticmethod
+    def _format_player_stats(player: Player, current_score: int, game_stats: Optional[Dict[str, Any]],
+                             recent_transactions: List[ScoreTransaction]) -> Dict[str, Any]:
+        """组装玩家统计信息"""
+        return {
+            'player_id': player.player_id,
+            'username': player.username,
+            'current_score': current_score,
+            'total_games': game_stats['total_games'] if game_stats else 0,
+            'completed_games': game_stats['completed_games'] if game_stats else 0,
+            'avg_score_change': round(game_stats['avg_score_change'], 2) if game_stats and game_stats['avg_score_change'] else 0,
+            'recent_transactions': [
+                {
+                    'points_change': t.points_change,
+                    'current_total': t.current_total,
+                    'event_time': t.event_time.isoformat(),
+                    'game_id': t.game_id
+                } for t in recent_transactions
+            ]
+        }
+    
+    @staticmethod
+    def _format_summary_stats(row: Dict[str, Any]) -> Dict[str, Any]:
+        """将 PLAYER_STATS_SQL 的结果组装为与 _format_player_stats 相同的结构"""
+        recent = row['recent_transactions']
+        if isinstance(recent, str):  # asyncpg 不自动解析 json
+            recent = json.loads(recent)
+        delta_count = row['score_delta_count'] or 0
+        return {
+            'player_id': row['player_id'],
+            'username': row['username'],
+            'current_score': row['current_score'],
+            'total_games': row['total_games'],
+            'completed_games': row['completed_games'],
+            'avg_score_change': round(row['score_delta_sum'] / delta_count, 2) if delta_count else 0,
+            'last_activity': row['last_activity'].isoformat() if row['last_activity'] else None,
+            'recent_transactions': [
+                {
+                    'points_change': t['points_change'],
+                    'current_total': t['current_total'],
+                    'event_time': datetime.fromisoformat(t['event_time']).isoformat(),
+                    'game_id': t['game_id']
+                } for t in recent
+            ]
+        }
+    
+    def get_leaderboard(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """获取积分排行榜，启用缓存且 limit 在缓存范围内时不访问数据库"""
+        try:
+            if self.leaderboard_cache is not None:
+                cached = self.leaderboard_cache.get(limit)
+                if cached is not None:
+                    return cached
+            return self.db_manager.execute_query(self.LEADERBOARD_SQL, (limit,))
+        except Exception as e:
+            logger.error(f"获取排行榜失败: {e}")
+            return []
+    
+    def get_player_rank(self, player_id: int) -> Optional[Dict[str, Any]]:
+        """获取玩家名次（同分同名次）及百分位，启用排名索引时不访问数据库"""
+        try:
+            if self.rank_index is not None:
+                cached = self.rank_index.lookup(player_id)
+                if cached is not None:
+                    return cached
+            row = self.db_manager.execute_single_query(self.RANK_SQL, (player_id,))
+            if not row:
+                return None
             return {
                 'player_id': player_id,
-                'username': player.username,
-                'current_score': current_score,
-                'total_games': game_stats['total_games'] if game_stats else 0,
-                'completed_games': game_stats['completed_games'] if game_stats else 0,
-                'avg_score_change': round(game_stats['avg_score_change'], 2) if game_stats and game_stats['avg_score_change'] else 0,
-                'recent_transactions': [
-                    {
-                        'points_change': t.points_change,
-                        'current_total': t.current_total,
-                        'event_time': t.event_time.isoformat(),
-                        'game_id': t.game_id
-                    } for t in recent_transactions
-                ]
+                'current_total': row['current_total'],
+                'rank': row['rank'],
+                'total_players': row['total_players'],
+                'percentile': round(row['lower'] * 100.0 / row['total_players'], 2),
             }
+        except Exception as e:
+            logger.error(f"获取玩家排名失败: {e}")
+            return None
+    
+    def get_player_percentile(self, player_id: int) -> Optional[float]:
+        """获取玩家百分位（积分低于该玩家的人数占比，0-100）"""
+        rank = self.get_player_rank(player_id)
+        return rank['percentile'] if rank else None
+    
+    def get_players_around(self, player_id: int, radius: int = 5) -> List[Dict[str, Any]]:
+        """获取排名在该玩家前后各 radius 名的玩家"""
+        try:
+            entries = self.rank_index.around(player_id, radius) if self.rank_index is not None else []
+            if not entries:
+                entries = self.db_manager.execute_query(self.AROUND_SQL, (player_id, radius, radius))
+            if not entries:
+                return []
+            rows = self.db_manager.execute_query(self.USERNAMES_SQL, ([e['player_id'] for e in entries],))
+            usernames = {row['player_id']: row['username'] for row in rows}
+            return [dict(entry, username=usernames.get(entry['player_id'])) for entry in entries]
+        except Exception as e:
+            logger.error(f"获取周边玩家失败: {e}")
+            return []
+    
+    def _game_history_query(self, player_id: int, limit: int, cursor: Optional[str]) -> Tuple[str, Tuple]:
+        if cursor is None:
+            return self.GAME_HISTORY_SQL, (player_id, limit + 1)
+        (game_id,) = decode_cursor(cursor, 1)
+        return self.GAME_HISTORY_AFTER_SQL, (player_id, game_id, limit + 1)
+    
+    def get_game_history_page(self, player_id: int, limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """分页获取玩家对局历史（新到旧），返回 {'items': [...], 'next_cursor': 下一页游标或 None}"""
+        try:
+            query, params = self._game_history_query(player_id, limit, cursor)
+            items, next_cursor = split_page(self.db_manager.execute_query(query, params), limit, ('game_id',))
+            return {'items': items, 'next_cursor': next_cursor}
+        except Exception as e:
+            logger.error(f"获取玩家对局历史失败: {e}")
+            return {'items': [], 'next_cursor': None}
+    
+    async def aregister_player(self, username: str) -> Optional[Player]:
+        """注册新玩家（异步）"""
+        try:
+            existing_player = await Player.aget_by_username(username)
+            if existing_player:
+                logger.warning(f"用户名 {username} 已存在")
+                return None
             
+            player = await Player.acreate(username)
+            if player:
+                logger.info(f"玩家 {username} 注册成功，ID: {player.player_id}")
+            return player
+            
+        except Exception as e:
+            logger.error(f"注册玩家失败: {e}")
+            return None
+    
+    async def aget_player_stats(self, player_id: int) -> Dict[str, Any]:
+        """获取玩家统计信息（异步）"""
+        if not self.stats_summary_available:
+            return await self._aget_player_stats_uncached(player_id)
+        try:
+            row = await self.async_db_manager.execute_single_query(self.PLAYER_STATS_SQL, (player_id,))
+            return self._format_summary_stats(row) if row else {}
         except Exception as e:
+            if getattr(e, 'sqlstate', None) == errorcodes.UNDEFINED_TABLE:
+                logger.warning("未安装 player_stats_summary，玩家统计改为逐项查询")
+                self.stats_summary_available = False
+                return await self._aget_player_stats_uncached(player_id)
             logger.error(f"获取玩家统计失败: {e}")
             return {}
     
-    def get_leaderboard(self, limit: int = 10) -> List[Dict[str, Any]]:
-        """获取积分排行榜"""
-        query = """
-        SELECT p.player_id, p.username, s.current_total, s.last_updated
-        FROM scores s
-        JOIN players p ON s.player_id = p.player_id
-        ORDER BY s.current_total DESC
-        LIMIT %s
-        """
+    async def _aget_player_stats_uncached(self, player_id: int) -> Dict[str, Any]:
+        """逐项查询玩家统计（异步），各项查询并发执行"""
+        try:
+            player = await Player.aget_by_id(player_id)
+            if not player:
+                return {}
+            
+            current_score, game_stats, recent_transactions = await asyncio.gather(
+                player.aget_current_score(),
+                self.async_db_manager.execute_single_query(self.GAME_STATS_SQL, (player_id,)),
+                ScoreTransaction.aget_player_history(player_id, 10),
+            )
+            
+            return self._format_player_stats(player, current_score, game_stats, recent_transactions)
+            
+        except Exception as e:
+            logger.error(f"获取玩家统计失败: {e}")
+            return {}
+    
+    async def aget_leaderboard(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """获取积分排行榜（异步）"""
         try:
-            return self.db_manager.execute_query(query, (limit,))
+            if self.leaderboard_cache is not None:
+                cached = await self.leaderboard_cache.aget(limit)
+                if cached is not None:
+                    return cached
+            return await self.async_db_manager.execute_query(self.LEADERBOARD_SQL, (limit,))
         except Exception as e:
             logger.error(f"获取排行榜失败: {e}")
             return []
+    
+    async def aget_game_history_page(self, player_id: int, limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """分页获取玩家对局历史（异步）"""
+        try:
+            query, params = self._game_history_query(player_id, limit, cursor)
+            rows = await self.async_db_manager.execute_query(query, params)
+            items, next_cursor = split_page(rows, limit, ('game_id',))
+            return {'items': items, 'next_cursor': next_cursor}
+        except Exception as e:
+            logger.error(f"获取玩家对局历史失败: {e}")
+            return {'items': [], 'next_cursor': None}
 
 class ScoreService:
     """积分服务类"""
     
+    SCORE_HISTORY_SQL = """
+        SELECT st.transaction_id, st.points_change, st.current_total, st.event_time,
+               st.game_id, g.game_type, p.username
+        FROM score_transactions st
+        LEFT JOIN games g ON st.game_id = g.game_id
+        LEFT JOIN players p ON st.player_id = p.player_id
+        WHERE st.player_id = %s AND st.event_time >= %s
+        ORDER BY st.event_time DESC
+        """
+    SCORE_HISTORY_PAGE_SQL = """
+        SELECT st.transaction_id, st.points_change, st.current_total, st.event_time,
+               st.game_id, g.game_type, p.username
+        FROM score_transactions st
+        LEFT JOIN games g ON st.game_id = g.game_id
+        LEFT JOIN players p ON st.player_id = p.player_id
+        WHERE st.player_id = %s AND st.event_time >= %s
+        ORDER BY st.event_time DESC, st.transaction_id DESC
+        LIMIT %s
+        """
+    SCORE_HISTORY_AFTER_SQL = """
+        SELECT st.transaction_id, st.points_change, st.current_total, st.event_time,
+               st.game_id, g.game_type, p.username
+        FROM score_transactions st
+        LEFT JOIN games g ON st.game_id = g.game_id
+        LEFT JOIN players p ON st.player_id = p.player_id
+        WHERE st.player_id = %s AND st.event_time >= %s
+          AND (st.event_time, st.transaction_id) < (%s::timestamptz, %s::uuid)
+        ORDER BY st.event_time DESC, st.transaction_id DESC
+        LIMIT %s
+        """
+    # 归档流水只保存 game_id，游戏类型从在线 games 表补齐
+    GAME_TYPES_SQL = "SELECT game_id, game_type FROM games WHERE game_id = ANY(%s)"
+    
     def __init__(self):
         self.db_manager = db_manager
+        self.async_db_manager = async_db_manager
+        # 启用写后缓冲时积分变动经 LedgerWriter 成批提交，否则每次变动单独提交
+        self.ledger_writer: Optional[LedgerWriter] = LedgerWriter() if db_config.ledger_write_behind else None
+    
+    def enable_write_behind(self, batch_size: Optional[int] = None, flush_interval: Optional[float] = None,
+                            queue_size: Optional[int] = None) -> LedgerWriter:
+        """启用积分流水写后缓冲（group commit）"""
+        if self.ledger_writer is not None:
+            self.ledger_writer.close()
+        self.ledger_writer = LedgerWriter(batch_size, flush_interval, queue_size)
+        return self.ledger_writer
+    
+    def submit_points_change(self, player_id: int, points_change: int, game_id: Optional[int] = None) -> Future:
+        """提交积分变动，返回持久化后完成的 Future（结果为 ScoreTransaction，积分不足时为 None）；
+        未启用写后缓冲时同步写入，返回已完成的 Future"""
+        if self.ledger_writer is not None:
+            return self.ledger_writer.submit(player_id, points_change, game_id)
+        future: Future = Future()
+        future.set_result(ScoreTransaction.create(player_id, points_change, game_id))
+        return future
+    
+    async def _aapply_points_change(self, player_id: int, points_change: int,
+                                    game_id: Optional[int]) -> Optional[ScoreTransaction]:
+        if self.ledger_writer is not None:
+            return await self.ledger_writer.asubmit(player_id, points_change, game_id)
+        return await ScoreTransaction.acreate(player_id, points_change, game_id)
     
     def award_points(self, player_id: int, points: int, game_id: Optional[int] = None, reason: str = "") -> bool:
         """奖励积分"""
@@ -174,7 +561,7 @@ class ScoreService:
                 logger.error("奖励积分必须为正数")
                 return False
             
-            transaction = ScoreTransaction.create(player_id, points, game_id)
+            transaction = self.submit_points_change(player_id, points, game_id).result()
             if transaction:
                 logger.info(f"玩家 {player_id} 获得 {points} 积分，原因: {reason}")
                 return True
@@ -191,7 +578,7 @@ class ScoreService:
                 logger.error("扣除积分必须为正数")
                 return False
             
-            transaction = ScoreTransaction.create(player_id, -points, game_id)
+            transaction = self.submit_points_change(player_id, -points, game_id).result()
             if transaction:
                 logger.info(f"玩家 {player_id} 扣除 {points} 积分，原因: {reason}")
                 return True
@@ -202,22 +589,129 @@ class ScoreService:
             return False
     
     def get_score_history(self, player_id: int, days: int = 30) -> List[Dict[str, Any]]:
-        """获取积分历史"""
-        query = """
-        SELECT st.transaction_id, st.points_change, st.current_total, st.event_time,
-               st.game_id, g.game_type, p.username
-        FROM score_transactions st
-        LEFT JOIN games g ON st.game_id = g.game_id
-        LEFT JOIN players p ON st.player_id = p.player_id
-        WHERE st.player_id = %s AND st.event_time >= %s
-        ORDER BY st.event_time DESC
-        """
+        """获取积分历史，时间范围早于归档边界时合并已归档的流水"""
         try:
             start_date = datetime.now() - timedelta(days=days)
-            return self.db_manager.execute_query(query, (player_id, start_date))
+            rows = self.db_manager.execute_query(self.SCORE_HISTORY_SQL, (player_id, start_date))
+            since = start_date.astimezone()
+            if not ledger_archive.needed(ledger_archive.horizon(), since=since):
+                return rows
+            archived = ledger_archive.read_player(player_id, since=since)
+            if not archived:
+                return rows
+            game_ids = list({row['game_id'] for row in archived if row['game_id'] is not None})
+            game_types = self.db_manager.execute_query(self.GAME_TYPES_SQL, (game_ids,)) if game_ids else []
+            return merge_history(rows, self._format_archived(archived, game_types, Player.get_by_id(player_id)))
         except Exception as e:
             logger.error(f"获取积分历史失败: {e}")
             return []
+    
+    @staticmethod
+    def _format_archived(archived: List[Dict[str, Any]], game_types: List[Dict[str, Any]],
+                         player: Optional[Player]) -> List[Dict[str, Any]]:
+        """归档行转换为与 SCORE_HISTORY_SQL 相同的字段"""
+        types = {row['game_id']: row['game_type'] for row in game_types}
+        username = player.username if player else None
+        return [{
+            'transaction_id': row['transaction_id'],
+            'points_change': row['points_change'],
+            'current_total': row['current_total'],
+            'event_time': row['event_time'],
+            'game_id': row['game_id'],
+            'game_type': types.get(row['game_id']),
+            'username': username,
+        } for row in archived]
+    
+    def _score_history_query(self, player_id: int, days: int, limit: int, cursor: Optional[str]) -> Tuple[str, Tuple]:
+        start_date = datetime.now() - timedelta(days=days)
+        if cursor is None:
+            return self.SCORE_HISTORY_PAGE_SQL, (player_id, start_date, limit + 1)
+        event_time, transaction_id = decode_cursor(cursor, 2)
+        return self.SCORE_HISTORY_AFTER_SQL, (player_id, start_date, event_time, str(transaction_id), limit + 1)
+    
+    def get_score_history_page(self, player_id: int, days: int = 30, limit: int = 50,
+                               cursor: Optional[str] = None) -> Dict[str, Any]:
+        """分页获取积分历史，返回 {'items': [...], 'next_cursor': 下一页游标或 None}"""
+        try:
+            query, params = self._score_history_query(player_id, days, limit, cursor)
+            items, next_cursor = split_page(self.db_manager.execute_query(query, params), limit, ScoreTransaction.PAGE_KEY)
+            return {'items': items, 'next_cursor': next_cursor}
+        except Exception as e:
+            logger.error(f"获取积分历史失败: {e}")
+            return {'items': [], 'next_cursor': None}
+    
+    def iter_score_history(self, player_id: int, days: int = 30, batch_size: int = 1000,
+                           row_format: str = 'dict') -> Iterator[Union[List[Any], Dict[str, List[Any]]]]:
+        """流式获取积分历史，按批返回，适合导出和统计长时间范围的流水"""
+        start_date = datetime.now() - timedelta(days=days)
+        return self.db_manager.execute_stream(self.SCORE_HISTORY_SQL, (player_id, start_date), batch_size, row_format)
+    
+    async def aaward_points(self, player_id: int, points: int, game_id: Optional[int] = None, reason: str = "") -> bool:
+        """奖励积分（异步）"""
+        try:
+            if points <= 0:
+                logger.error("奖励积分必须为正数")
+                return False
+            
+            transaction = await self._aapply_points_change(player_id, points, game_id)
+            if transaction:
+                logger.info(f"玩家 {player_id} 获得 {points} 积分，原因: {reason}")
+                return True
+            return False
+            
+        except Exception as e:
+            logger.error(f"奖励积分失败: {e}")
+            return False
+    
+    async def adeduct_points(self, player_id: int, points: int, game_id: Optional[int] = None, reason: str = "") -> bool:
+        """扣除积分（异步）"""
+        try:
+            if points <= 0:
+                logger.error("扣除积分必须为正数")
+                return False
+            
+            transaction = await self._aapply_points_change(player_id, -points, game_id)
+            if transaction:
+                logger.info(f"玩家 {player_id} 扣除 {points} 积分，原因: {reason}")
+                return True
+            return False
+            
+        except Exception as e:
+            logger.error(f"扣除积分失败: {e}")
+            return False
+    
+    async def aget_score_history(self, player_id: int, days: int = 30) -> List[Dict[str, Any]]:
+        """获取积分历史（异步），时间范围早于归档边界时合并已归档的流水"""
+        try:
+            start_date = datetime.now() - timedelta(days=days)
+            rows = await self.async_db_manager.execute_query(self.SCORE_HISTORY_SQL, (player_id, start_date))
+            since = start_date.astimezone()
+            if not ledger_archive.needed(await ledger_archive.ahorizon(), since=since):
+                return rows
+            archived = await ledger_archive.aread_player(player_id, since=since)
+            if not archived:
+                return rows
+            game_ids = list({row['game_id'] for row in archived if row['game_id'] is not None})
+            game_types = await self.async_db_manager.execute_query(self.GAME_TYPES_SQL, (game_ids,)) if game_ids else []
+            return merge_history(rows, self._format_archived(archived, game_types, await Player.aget_by_id(player_id)))
+        except Exception as e:
+            logger.error(f"获取积分历史失败: {e}")
+            return []
+    
+    async def aget_score_history_page(self, player_id: int, days: int = 30, limit: int = 50,
+                                      cursor: Optional[str] = None) -> Dict[str, Any]:
+        """分页获取积分历史（异步）"""
+        try:
+            query, params = self._score_history_query(player_id, days, limit, cursor)
+            rows = await self.async_db_manager.execute_query(query, params)
+            items, next_cursor = split_page(rows, limit, ScoreTransaction.PAGE_KEY)
+            return {'items': items, 'next_cursor': next_cursor}
+        except Exception as e:
+            logger.error(f"获取积分历史失败: {e}")
+            return {'items': [], 'next_cursor': None}
+
+# 排行榜为热点查询，注册为服务端预备语句
+db_manager.register_prepared('player_leaderboard', PlayerService.LEADERBOARD_SQL)
 
 # 全局服务实例
 game_service = GameService()
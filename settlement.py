@@ -0,0 +1,144 @@
+from typing import List, Dict, Any, Optional, Tuple
+import logging
+from database_manager import db_manager
+from async_database_manager import async_db_manager, to_asyncpg_query
+from model_cache import game_cache
+
+logger = logging.getLogger(__name__)
+
+class SettlementError(Exception):
+    """结算失败（游戏不存在、已结算或积分不足），整个事务回滚"""
+
+class GameSettlementEngine:
+    """游戏结算引擎
+
+    在一个事务中完成整桌结算：结束游戏、更新所有玩家总分、写入积分流水、回填参与者 final_score。
+    无论桌上有几名玩家，语句数固定；scores 行按 player_id 升序加锁，结算之间不会互相死锁。
+    """
+
+    # 先锁定未结束的游戏行，已结束的游戏不会被重复结算。
+    # 用 FOR NO KEY UPDATE 而不是 FOR UPDATE：单次加减分先锁 scores 行，写流水时外键检查对 games 行加 FOR KEY SHARE，
+    # 它与 FOR UPDATE 冲突（结算持有游戏行、等待 scores 行时会死锁），与 FOR NO KEY UPDATE 不冲突
+    LOCK_GAME_SQL = """
+        SELECT game_id FROM games
+        WHERE game_id = %s AND end_time IS NULL
+        FOR NO KEY UPDATE
+        """
+    # 最后再标记结束：games 上的统计触发器会锁 player_stats_summary 行，
+    # 必须排在 scores 之后，与单次加减分（scores -> 汇总）的加锁顺序一致，否则会互相死锁
+    FINISH_GAME_SQL = """
+        UPDATE games SET end_time = NOW()
+        WHERE game_id = %s
+        RETURNING game_id, end_time
+        """
+    ENSURE_SCORES_SQL = """
+        INSERT INTO scores (player_id, current_total, last_updated)
+        SELECT player_id, 0, NOW() FROM unnest(%s::bigint[]) AS player_id
+        ON CONFLICT (player_id) DO NOTHING
+        """
+    LOCK_SCORES_SQL = """
+        SELECT player_id, current_total FROM scores
+        WHERE player_id = ANY(%s::bigint[])
+        ORDER BY player_id
+        FOR UPDATE
+        """
+    # final_score 是结算后的总分（与 initial_score 开局总分对应，满足 final_score >= 0 约束）；
+    # 分数不变的玩家不在 updated 中，取已锁定的当前总分
+    APPLY_SQL = """
+        WITH delta AS (
+            SELECT * FROM unnest(%s::bigint[], %s::integer[]) AS d(player_id, points_change)
+        ), updated AS (
+            UPDATE scores s
+            SET current_total = s.current_total + d.points_change, last_updated = NOW()
+            FROM delta d
+            WHERE s.player_id = d.player_id AND d.points_change <> 0
+            RETURNING s.player_id, d.points_change, s.current_total
+        ), ledger AS (
+            INSERT INTO score_transactions (player_id, game_id, points_change, current_total, event_time)
+            SELECT player_id, %s::bigint, points_change, current_total, NOW() FROM updated
+            RETURNING player_id, transaction_id, current_total
+        ), participants AS (
+            UPDATE game_participants gp
+            SET final_score = COALESCE(u.current_total, s.current_total), updated_at = NOW()
+            FROM delta d
+            JOIN scores s ON s.player_id = d.player_id
+            LEFT JOIN updated u ON u.player_id = d.player_id
+            WHERE gp.game_id = %s::bigint AND gp.player_id = d.player_id
+            RETURNING gp.player_id, gp.final_score
+        )
+        SELECT d.player_id, d.points_change, l.transaction_id, l.current_total, p.final_score
+        FROM delta d
+        LEFT JOIN ledger l ON l.player_id = d.player_id
+        LEFT JOIN participants p ON p.player_id = d.player_id
+        ORDER BY d.player_id
+        """
+
+    @staticmethod
+    def _aggregate(player_results: List[Tuple[int, int]]) -> Tuple[List[int], List[int]]:
+        """合并同一玩家的多条结果，并按 player_id 排序以保证加锁顺序一致"""
+        totals: Dict[int, int] = {}
+        for player_id, points_change in player_results:
+            totals[player_id] = totals.get(player_id, 0) + points_change
+        player_ids = sorted(totals)
+        return player_ids, [totals[player_id] for player_id in player_ids]
+
+    @staticmethod
+    def _check_balances(locked_rows: List[Dict[str, Any]], player_ids: List[int], deltas: List[int]) -> None:
+        current = {row['player_id']: row['current_total'] for row in locked_rows}
+        for player_id, delta in zip(player_ids, deltas):
+            if player_id not in current:
+                raise SettlementError(f"玩家 {player_id} 不存在")
+            if current[player_id] + delta < 0:
+                raise SettlementError(f"玩家 {player_id} 积分不足，无法扣除 {delta} 分")
+
+    def settle(self, game_id: int, player_results: List[Tuple[int, int]]) -> Optional[List[Dict[str, Any]]]:
+        """结算游戏，返回每名玩家的结算结果，失败时返回 None 且不做任何修改"""
+        player_ids, deltas = self._aggregate(player_results)
+        try:
+            with db_manager.transaction() as cursor:
+                cursor.execute(self.LOCK_GAME_SQL, (game_id,))
+                if cursor.fetchone() is None:
+                    raise SettlementError(f"游戏 {game_id} 不存在或已结算")
+
+                results = []
+                if player_ids:
+                    cursor.execute(self.ENSURE_SCORES_SQL, (player_ids,))
+                    cursor.execute(self.LOCK_SCORES_SQL, (player_ids,))
+                    self._check_balances(cursor.fetchall(), player_ids, deltas)
+                    cursor.execute(self.APPLY_SQL, (player_ids, deltas, game_id, game_id))
+                    results = [dict(row) for row in cursor.fetchall()]
+                cursor.execute(self.FINISH_GAME_SQL, (game_id,))
+                return results
+        except Exception as e:
+            logger.error(f"游戏 {game_id} 结算失败: {e}")
+            return None
+        finally:
+            # 事务结束后使缓存的游戏行失效，避免读到结算前的 end_time
+            game_cache.invalidate(game_id)
+
+    async def asettle(self, game_id: int, player_results: List[Tuple[int, int]]) -> Optional[List[Dict[str, Any]]]:
+        """结算游戏（异步）"""
+        player_ids, deltas = self._aggregate(player_results)
+        try:
+            async with async_db_manager.transaction() as conn:
+                if await conn.fetchrow(to_asyncpg_query(self.LOCK_GAME_SQL), game_id) is None:
+                    raise SettlementError(f"游戏 {game_id} 不存在或已结算")
+
+                results = []
+                if player_ids:
+                    await conn.execute(to_asyncpg_query(self.ENSURE_SCORES_SQL), player_ids)
+                    locked_rows = await conn.fetch(to_asyncpg_query(self.LOCK_SCORES_SQL), player_ids)
+                    self._check_balances([dict(row) for row in locked_rows], player_ids, deltas)
+                    rows = await conn.fetch(to_asyncpg_query(self.APPLY_SQL), player_ids, deltas, game_id, game_id)
+                    results = [dict(row) for row in rows]
+                await conn.execute(to_asyncpg_query(self.FINISH_GAME_SQL), game_id)
+                return results
+        except Exception as e:
+            logger.error(f"游戏 {game_id} 结算失败: {e}")
+            return None
+        finally:
+            # 事务结束后使缓存的游戏行失效，避免读到结算前的 end_time
+            game_cache.invalidate(game_id)
+
+# 全局结算引擎实例
+settlement_engine = GameSettlementEngine()
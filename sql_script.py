@@ -0,0 +1,312 @@
+import re
+import time
+from collections import deque
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+import logging
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+# 语句起点之后需要跳过其内容的记号：字符串、带引号标识符、注释、美元引用；分号结束语句
+_TOKEN_RE = re.compile(r"(?<![\w$])[Ee]'|'|\"|--|/\*|(?<![\w$])\$(?:[A-Za-z_\x80-\U0010ffff][\w\x80-\U0010ffff]*)?\$|;")
+_STRING_END_RE = re.compile(r"[^']*(?:''[^']*)*'")
+_ESTRING_END_RE = re.compile(r"[^'\\]*(?:(?:''|\\.)[^'\\]*)*'", re.DOTALL)
+_IDENT_END_RE = re.compile(r'[^"]*(?:""[^"]*)*"')
+_BLOCK_COMMENT_RE = re.compile(r"/\*|\*/")
+
+_TRANSACTION_CONTROL_RE = re.compile(
+    r"(?:BEGIN|START\s+TRANSACTION|COMMIT|END|ROLLBACK|ABORT|SAVEPOINT|RELEASE|PREPARE\s+TRANSACTION)\b",
+    re.IGNORECASE)
+# 不能在事务块（包括多语句简单查询的隐式事务）中执行的语句
+_NON_TRANSACTIONAL_RE = re.compile(
+    r"(?:VACUUM|(?:CREATE|DROP)\s+DATABASE|ALTER\s+SYSTEM|(?:CREATE|DROP)\s+TABLESPACE"
+    r"|(?:CREATE\s+(?:UNIQUE\s+)?|DROP\s+)INDEX\s+CONCURRENTLY|REINDEX\b[^;]*\bCONCURRENTLY)\b",
+    re.IGNORECASE)
+_ROWS_RE = re.compile(r"(?:SELECT|WITH|VALUES|TABLE|SHOW|EXPLAIN)\b", re.IGNORECASE)
+
+class SQLScriptError(ValueError):
+    """脚本无法解析，或包含当前执行方式不支持的语句"""
+
+class Statement:
+    """脚本中的一条语句，line 为语句在文件中的起始行号（跳过前导注释后）"""
+
+    __slots__ = ('sql', 'line')
+
+    def __init__(self, sql: str, line: int):
+        self.sql = sql
+        self.line = line
+
+    @property
+    def transaction_control(self) -> bool:
+        return _TRANSACTION_CONTROL_RE.match(self.sql) is not None
+
+    @property
+    def non_transactional(self) -> bool:
+        return _NON_TRANSACTIONAL_RE.match(self.sql) is not None
+
+    @property
+    def returns_rows(self) -> bool:
+        return _ROWS_RE.match(self.sql) is not None
+
+    def summary(self, width: int = 100) -> str:
+        text = ' '.join(self.sql.split())
+        return text if len(text) <= width else text[:width] + '...'
+
+def split_statements(text: str) -> List[Statement]:
+    """按顶层分号拆分 SQL 脚本
+
+    正确跳过单引号字符串（含 '' 转义和 E'' 反斜杠转义）、双引号标识符、-- 和可嵌套的 /* */ 注释、
+    $$ / $tag$ 美元引用（函数体）；只含注释的片段被丢弃。字符串或注释未闭合时抛出 SQLScriptError。
+    """
+    statements: List[Statement] = []
+    start = pos = 0
+    line, line_pos = 1, 0
+
+    def add(end: int) -> None:
+        nonlocal line, line_pos
+        offset = _skip_leading(text, start, end)
+        sql = text[offset:end].rstrip()
+        if sql:
+            line += text.count('\n', line_pos, offset)
+            line_pos = offset
+            statements.append(Statement(sql, line))
+
+    def unterminated(what: str, at: int) -> SQLScriptError:
+        return SQLScriptError(f"第 {text.count(chr(10), 0, at) + 1} 行的{what}未闭合")
+
+    def skip_block_comment(at: int) -> int:
+        depth, pos = 1, at + 2
+        while depth:
+            inner = _BLOCK_COMMENT_RE.search(text, pos)
+            if inner is None:
+                raise unterminated('块注释', at)
+            depth += 1 if inner.group() == '/*' else -1
+            pos = inner.end()
+        return pos
+
+    while True:
+        match = _TOKEN_RE.search(text, pos)
+        if match is None:
+            break
+        token = match.group()
+        if token == ';':
+            add(match.start())
+            start = pos = match.end()
+        elif token == '--':
+            newline = text.find('\n', match.end())
+            pos = len(text) if newline < 0 else newline + 1
+        elif token == '/*':
+            pos = skip_block_comment(match.start())
+        elif token.startswith('$'):
+            end = text.find(token, match.end())
+            if end < 0:
+                raise unterminated(f'美元引用 {token}', match.start())
+            pos = end + len(token)
+        else:
+            end_re = _IDENT_END_RE if token == '"' else _STRING_END_RE if token == "'" else _ESTRING_END_RE
+            end = end_re.match(text, match.end())
+            if end is None:
+                raise unterminated('标识符' if token == '"' else '字符串', match.start())
+            pos = end.end()
+    add(len(text))
+    return statements
+
+def _skip_leading(text: str, pos: int, end: int) -> int:
+    """跳过语句前的空白和注释（块注释可嵌套，调用前已确认都是闭合的）"""
+    while pos < end:
+        if text[pos].isspace():
+            pos += 1
+        elif text.startswith('--', pos):
+            newline = text.find('\n', pos)
+            pos = end if newline < 0 else newline + 1
+        elif text.startswith('/*', pos):
+            depth, pos = 1, pos + 2
+            while depth and pos < end:
+                inner = _BLOCK_COMMENT_RE.search(text, pos, end)
+                if inner is None:
+                    return end
+                depth += 1 if inner.group() == '/*' else -1
+                pos = inner.end()
+        else:
+            break
+    return min(pos, end)
+
+class ScriptRunner:
+    """批量执行 SQL 脚本
+
+    psycopg2 不支持 libpq 的 pipeline 模式，这里把连续的多条语句拼成一次多语句简单查询发送，
+    batch_size 条语句只需一次网络往返。语句之间插入 DO 块发出带 clock_timestamp() 的 NOTICE 作为标记
+    （每个约 20µs），由相邻标记的服务端时间得到每条语句的耗时，执行失败时由最后收到的标记确定出错的语句。
+
+    transaction=True（默认）：整个脚本在一个事务中执行，任一语句失败则全部回滚；
+    脚本中不能含有 BEGIN/COMMIT 等事务控制语句，以及 VACUUM、CREATE INDEX CONCURRENTLY 等不能在事务中执行的语句。
+    transaction=False：与 psql 默认行为相同，每条语句单独提交（批内每条语句包在 BEGIN/COMMIT 中）；
+    出错时停止，之前的语句已提交，continue_on_error=True 时跳过出错的语句继续执行。
+    不能在事务中执行的语句单独发送；脚本自带事务控制语句时逐条发送，不再合并。
+    fetch_results=True 时返回行的语句（SELECT、WITH 等）单独发送并取回最多 max_rows 行结果，
+    注意 SELECT 调用写数据的函数（如 test_data.sql 中的 update_player_score）也会因此单独往返。
+    脚本把 client_min_messages 调到 NOTICE 以上时收不到标记，此时没有单条耗时，出错时只能定位到批次的第一条。
+    """
+
+    MARKER_PREFIX = 'sql_script:'
+    MARKER_SQL = ("DO $sql_script$BEGIN RAISE NOTICE '" + MARKER_PREFIX +
+                  "% %', {index}, extract(epoch FROM clock_timestamp()); END$sql_script$")
+
+    def __init__(self, conn, batch_size: int = 500, transaction: bool = True, fetch_results: bool = False,
+                 max_rows: int = 5, continue_on_error: bool = False):
+        if continue_on_error and transaction:
+            raise ValueError("continue_on_error 只能用于 transaction=False")
+        self.conn = conn
+        self.batch_size = max(batch_size, 1)
+        self.transaction = transaction
+        self.fetch_results = fetch_results
+        self.max_rows = max_rows
+        self.continue_on_error = continue_on_error
+
+    def run_file(self, file_path: str) -> Dict[str, Any]:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return self.run(f.read())
+
+    def run(self, script: str) -> Dict[str, Any]:
+        """执行脚本，返回每条语句的耗时、NOTICE 和（fetch_results 时）结果行，以及往返次数和总耗时"""
+        statements = split_statements(script)
+        has_transaction_control = any(statement.transaction_control for statement in statements)
+        if self.transaction:
+            rejected = [s for s in statements if s.transaction_control or s.non_transactional]
+            if rejected:
+                raise SQLScriptError(
+                    f"第 {rejected[0].line} 行的语句不能在单个事务中执行: {rejected[0].summary(60)}，"
+                    f"请使用 transaction=False")
+        reports = [{'index': index, 'line': statement.line, 'sql': statement.summary(),
+                    'duration_ms': None, 'notices': []} for index, statement in enumerate(statements)]
+        result: Dict[str, Any] = {'statements': reports, 'executed': 0, 'committed': 0, 'batches': 0,
+                                  'total_ms': 0.0, 'ok': True, 'error': None, 'failed_statement': None}
+        if not statements:
+            return result
+
+        saved_notices, saved_autocommit = self.conn.notices, self.conn.autocommit
+        self.conn.notices = deque()
+        started = time.perf_counter()
+        try:
+            if self.conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                self.conn.rollback()
+            self.conn.autocommit = not self.transaction
+            with self.conn.cursor() as cursor:
+                pos = 0
+                while pos < len(statements):
+                    batch = self._next_batch(statements, pos, single=has_transaction_control)
+                    result['batches'] += 1
+                    try:
+                        self._execute_batch(cursor, statements, batch, reports, raw=has_transaction_control)
+                    except psycopg2.Error as e:
+                        last_marker = self._collect_notices(reports, batch)
+                        failed = last_marker if last_marker in batch else batch[0]
+                        reports[failed]['error'] = str(e).strip()
+                        result['executed'] += failed - batch[0]
+                        if result['ok']:
+                            result.update(ok=False, error=reports[failed]['error'], failed_statement=failed)
+                        if self.transaction:
+                            self.conn.rollback()
+                            result['committed'] = 0
+                            return result
+                        # 出错的语句所在的 BEGIN 块已中止，之前的语句已各自提交
+                        if self.conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INERROR:
+                            cursor.execute("ROLLBACK")
+                        result['committed'] = result['executed']
+                        if not self.continue_on_error:
+                            return result
+                        pos = failed + 1
+                        continue
+                    result['executed'] += len(batch)
+                    if not self.transaction:
+                        result['committed'] = result['executed']
+                    pos = batch[-1] + 1
+            if self.transaction:
+                self.conn.commit()
+                result['committed'] = result['executed']
+            return result
+        finally:
+            result['total_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            self.conn.notices = saved_notices
+            self.conn.autocommit = saved_autocommit
+
+    def _alone(self, statement: Statement) -> bool:
+        return statement.non_transactional or (self.fetch_results and statement.returns_rows)
+
+    def _next_batch(self, statements: List[Statement], pos: int, single: bool = False) -> List[int]:
+        """从 pos 开始取下一批语句，需要单独发送的语句自成一批"""
+        batch: List[int] = []
+        for index in range(pos, len(statements)):
+            if self._alone(statements[index]) or single:
+                return batch or [index]
+            batch.append(index)
+            if len(batch) >= self.batch_size:
+                break
+        return batch
+
+    def _execute_batch(self, cursor, statements: List[Statement], batch: List[int],
+                       reports: List[Dict[str, Any]], raw: bool = False) -> None:
+        first = statements[batch[0]]
+        if len(batch) == 1 and (raw or self._alone(first)):
+            # 单独发送原语句：不加标记和 BEGIN/COMMIT，按客户端时间计时
+            started = time.perf_counter()
+            cursor.execute(first.sql)
+            report = reports[batch[0]]
+            report['duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            report['rowcount'] = cursor.rowcount
+            if cursor.description:
+                report['columns'] = [desc[0] for desc in cursor.description]
+                report['rows'] = [dict(zip(report['columns'], row)) for row in cursor.fetchmany(self.max_rows)]
+            self._collect_notices(reports, batch)
+            return
+        parts = []
+        for index in batch:
+            if not self.transaction:
+                parts.append('BEGIN')
+            parts.append(self.MARKER_SQL.format(index=index))
+            # 换行后再加分号，避免语句末尾的 -- 注释吞掉分号
+            parts.append(statements[index].sql + '\n')
+            if not self.transaction:
+                parts.append('COMMIT')
+        parts.append(self.MARKER_SQL.format(index=batch[-1] + 1))
+        cursor.execute(';\n'.join(parts))
+        self._collect_notices(reports, batch)
+
+    def _collect_notices(self, reports: List[Dict[str, Any]], batch: List[int]) -> Optional[int]:
+        """解析标记得到每条语句的服务端耗时，其余 NOTICE 归到它之前最近的标记对应的语句；返回最后一个标记的编号"""
+        current = batch[0]
+        marks: Dict[int, Decimal] = {}
+        notices = self.conn.notices
+        while notices:
+            notice = notices.popleft().strip()
+            message = notice.split(':  ', 1)[-1]
+            if message.startswith(self.MARKER_PREFIX):
+                index, epoch = message[len(self.MARKER_PREFIX):].split(' ', 1)
+                current = int(index)
+                marks[current] = Decimal(epoch)
+            elif current < len(reports):
+                reports[current]['notices'].append(notice)
+        for index in batch:
+            if index in marks and index + 1 in marks:
+                reports[index]['duration_ms'] = round(float(marks[index + 1] - marks[index]) * 1000, 3)
+        return max(marks) if marks else None
+
+def format_report(result: Dict[str, Any], slowest: int = 10) -> List[str]:
+    """生成文本报告：汇总、最慢的语句、NOTICE 和错误"""
+    lines = [f"共 {len(result['statements'])} 条语句，{result['batches']} 次往返，"
+             f"已执行 {result['executed']} 条，已提交 {result['committed']} 条，总耗时 {result['total_ms']:.1f} ms"]
+    timed = [report for report in result['statements'] if report['duration_ms'] is not None]
+    if timed:
+        lines.append(f"最慢的 {min(slowest, len(timed))} 条语句:")
+        for report in sorted(timed, key=lambda item: item['duration_ms'], reverse=True)[:slowest]:
+            lines.append(f"  #{report['index'] + 1} 第 {report['line']} 行  {report['duration_ms']:.3f} ms  {report['sql'][:80]}")
+    for report in result['statements']:
+        for notice in report['notices']:
+            lines.append(f"  #{report['index'] + 1} 第 {report['line']} 行 {notice}")
+    for report in result['statements']:
+        if 'error' in report:
+            lines.append(f"第 {report['line']} 行的语句 #{report['index'] + 1} 执行失败: {report['error']}")
+            lines.append(f"  {report['sql']}")
+    return lines